@@ -2,27 +2,30 @@ import os
 import sys
 import tempfile
 import streamlit as st
-import streamlit.components.v1 as components
-from downloader import build_dynamic_quality_options, apply_common_ydl_hardening, is_aria2c_available
-import requests
-from pathlib import Path
+from streamlit.runtime import get_instance as streamlit_runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from downloader import apply_common_ydl_hardening, is_aria2c_available, FormatTable
+import tracing
+from session_downloads import SessionDownloads, SessionReaper, is_age_restricted
+from file_links import FILE_LINK_HOST, FILE_LINK_PORT, FILE_LINK_SERVER, FileLinkServer, base_url_for, link_url
 import subprocess
-import shutil
 import re
-import os
 
-# Configure ffmpeg path
+# Configure ffmpeg path (once per process: Streamlit re-executes this script on every rerun)
 FFMPEG_BIN_DIR = os.path.join(os.path.dirname(__file__), 'ffmpeg-master-latest-win64-gpl', 'bin')
-os.environ["PATH"] = FFMPEG_BIN_DIR + os.pathsep + os.environ.get("PATH", "")
-
-try:
-    from yt_dlp import YoutubeDL
-except Exception:
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "yt-dlp"])
-    from yt_dlp import YoutubeDL
+if FFMPEG_BIN_DIR not in os.environ.get("PATH", "").split(os.pathsep):
+    os.environ["PATH"] = FFMPEG_BIN_DIR + os.pathsep + os.environ.get("PATH", "")
 
+# yt-dlp and browser_cookie3 are imported where they are used, so the first page render doesn't wait for them
 st.set_page_config(page_title="YouTube Downloader", page_icon="🎥", layout="wide")
 
+INFO_CACHE_TTL = float(os.environ.get('APP_INFO_CACHE_TTL', '3600'))
+INFO_CACHE_ENTRIES = int(os.environ.get('APP_INFO_CACHE_ENTRIES', '256'))
+APP_DOWNLOAD_WORKERS = int(os.environ.get('APP_DOWNLOAD_WORKERS', '3'))
+# How long a closed or disconnected session keeps its downloads before they are cancelled
+APP_SESSION_GRACE_SEC = float(os.environ.get('APP_SESSION_GRACE_SEC', '120'))
+PROGRESS_REFRESH_SEC = float(os.environ.get('APP_PROGRESS_REFRESH_SEC', '1'))
+
 # Configure yt-dlp with enhanced options for all videos
 YDL_OPTS = {
     'format': 'bestvideo+bestaudio/best',
@@ -36,6 +39,7 @@ YDL_OPTS = {
     'cookiesfrombrowser': ('chrome',),  # Try to get cookies from Chrome
 }
 
+@tracing.traced('cookies.load')
 def get_chrome_cookies():
     """Get cookies from Chrome by creating a fresh cookie file."""
     import datetime
@@ -74,23 +78,54 @@ def get_chrome_cookies():
 if 'video_info' not in st.session_state:
     st.session_state['video_info'] = None
 
+@tracing.traced('extract_video_info')
+def _extract_video_info(url):
+    """Extract video information using yt-dlp; raises on failure."""
+    opts = dict(YDL_OPTS)
+    # Get cookies for authentication
+    cookie_file = get_chrome_cookies()
+    if cookie_file:
+        opts['cookiefile'] = cookie_file
+    from yt_dlp import YoutubeDL
+    with YoutubeDL(opts) as ydl:
+        video_info = ydl.extract_info(url, download=False)
+    if not video_info:
+        raise ValueError("No video information returned")
+    # Keep a compact format table instead of the raw format dicts
+    return {
+        'title': video_info.get('title', 'Unknown Title'),
+        'uploader': video_info.get('uploader', 'Unknown Uploader'),
+        'duration': int(video_info.get('duration') or 0),
+        'thumbnail': video_info.get('thumbnail'),
+        'format_table': FormatTable.from_info(video_info),
+    }
+
+@st.cache_data(ttl=INFO_CACHE_TTL, max_entries=INFO_CACHE_ENTRIES, show_spinner=False)
+def cached_video_info(video_key, _url):
+    """Extraction shared across reruns and sessions, keyed by video id (the URL is not hashed).
+
+    Failures raise, so they are not cached.
+    """
+    return _extract_video_info(_url)
+
+@st.cache_data(ttl=INFO_CACHE_TTL, max_entries=INFO_CACHE_ENTRIES, show_spinner=False)
+def format_choices(video_key, _format_table):
+    """Quality selector contents derived from the format table, once per video id."""
+    return {
+        'heights': _format_table.heights(),
+        'fps': _format_table.fps_values(),
+        'exact': _format_table.quality_options(),
+    }
+
 def extract_video_info(url):
-    """Extract video information using yt-dlp"""
+    """Extract video information, reusing the cached result for the same video id"""
     try:
-        with YoutubeDL(YDL_OPTS) as ydl:
-            video_info = ydl.extract_info(url, download=False)
-            if video_info:
-                return {
-                    'title': video_info.get('title', 'Unknown Title'),
-                    'uploader': video_info.get('uploader', 'Unknown Uploader'),
-                    'duration': int(video_info.get('duration', 0)),
-                    'thumbnail': video_info.get('thumbnail'),
-                    'formats': video_info.get('formats', []),
-                }
+        info = dict(cached_video_info(extract_video_id(url) or url, url))
+        info['video_key'] = extract_video_id(url) or url
+        return info
     except Exception as e:
         st.error(f"Error fetching video info: {str(e)}")
         return None
-    return None
 
 
 
@@ -123,6 +158,7 @@ st.caption("Select video quality and FPS or extract MP3 with chosen bitrate. Pro
 
 
 # Simple browser detection
+@st.cache_data(show_spinner=False)
 def detect_local_browsers() -> list[str]:
     """Return a list of browsers available on the system"""
     detected: list[str] = []
@@ -171,37 +207,70 @@ if get_info_clicked:
         try:
             info_status.write("Fetching video info...")
             info_progress.progress(10)
-            
-            # Get cookies for authentication
-            cookie_file = get_chrome_cookies()
-            if cookie_file:
-                YDL_OPTS['cookiefile'] = cookie_file
-            
+
             info = extract_video_info(url)
             if not info:
                 st.error("Could not fetch video information. Please check the URL and try again.")
                 st.stop()
                 
-            info_progress.progress(60)
-            _ = info.get('formats', [])
             info_progress.progress(100)
             info_status.write("Info loaded")
             st.session_state['video_info'] = info
         except Exception as e:
             info_status.write("")
             info_progress.progress(0)
-            msg = str(e).lower()
-            if ('age-restricted' in msg) or ('sign in to confirm your age' in msg):
+            if is_age_restricted(str(e)):
                 st.warning("This video is age-restricted and requires sign-in.")
             else:
                 st.error("Failed to fetch video info.")
 
 info = st.session_state.get('video_info')
 
+@st.cache_resource
+def session_reaper():
+    """One per Streamlit process: stops the download pools of sessions that have ended."""
+    return SessionReaper(streamlit_runtime().is_active_session, grace=APP_SESSION_GRACE_SEC).start()
+
+# Downloads run on this session's worker pool and survive reruns
+if 'downloads' not in st.session_state or st.session_state['downloads'].closed:
+    st.session_state['downloads'] = SessionDownloads(APP_DOWNLOAD_WORKERS)
+    session_reaper().register(get_script_run_ctx().session_id, st.session_state['downloads'])
+downloads = st.session_state['downloads']
+
+@st.cache_resource
+def file_link_server():
+    """One sidecar file server per Streamlit process, shared by every session."""
+    if FILE_LINK_SERVER == 'external':
+        return None
+    try:
+        return FileLinkServer().start()
+    except OSError:
+        # Port taken (e.g. a second app instance): any free port will do for direct links
+        return FileLinkServer(port=0).start()
+
+def file_link(path):
+    """Short-lived signed link that streams path from disk, instead of through Streamlit."""
+    server = file_link_server()
+    if server is None:
+        return link_url(path, base_url_for(FILE_LINK_HOST, FILE_LINK_PORT))
+    return server.link(path)
+
+def open_folder(folder):
+    try:
+        if os.name == 'nt':
+            os.startfile(folder)
+        elif sys.platform == 'darwin':
+            subprocess.Popen(['open', folder])
+        else:
+            subprocess.Popen(['xdg-open', folder])
+    except Exception:
+        pass
+
 if info:
     col1, col2 = st.columns([1, 2])
     with col1:
-        st.image(info.get('thumbnail', ''), use_container_width=True)
+        if info.get('thumbnail'):
+            st.image(info['thumbnail'], use_container_width=True)
     with col2:
         st.subheader(info.get('title', 'Unknown Title'))
         st.write(f"Channel: {info.get('uploader', 'Unknown')}")
@@ -215,8 +284,9 @@ if info:
 
     # Derive available qualities from formats, if desired
     only_available = st.checkbox("Only show available qualities", value=False)
-    available_heights = sorted({f.get('height') for f in (info.get('formats') or []) if f.get('vcodec') and f.get('vcodec') != 'none' and f.get('height')}, reverse=True)
-    available_fps = sorted({int(f.get('fps')) for f in (info.get('formats') or []) if f.get('vcodec') and f.get('vcodec') != 'none' and f.get('fps')}, reverse=True)
+    choices = format_choices(info['video_key'], info.get('format_table') or FormatTable())
+    available_heights = choices['heights']
+    available_fps = choices['fps']
     fixed_heights = [2160, 1440, 1080, 720, 480]
     fixed_fps = [60, 30]
     height_options = [str(h) for h in (available_heights if (only_available and available_heights) else fixed_heights)]
@@ -227,7 +297,7 @@ if info:
     if mode == "Video":
         use_dynamic_format_id = st.checkbox("Choose exact available format (faster & precise)", value=False)
         if use_dynamic_format_id:
-            dynamic_opts = build_dynamic_quality_options(info)
+            dynamic_opts = choices['exact']
             labels = [opt['label'] for opt in dynamic_opts] or ["No video formats listed"]
             selected_idx = st.selectbox("Available formats", list(range(len(labels))), format_func=lambda i: labels[i] if i < len(labels) else labels[0])
         else:
@@ -244,20 +314,16 @@ if info:
     st.session_state['output_dir'] = st.text_input("Save to folder", value=st.session_state['output_dir'])
     output_dir = st.session_state['output_dir']
 
+    use_aria = st.checkbox("Use aria2c if available (faster)", value=is_aria2c_available())
+
     # Mobile-friendly spacing
     st.markdown("""
         <style>
           button[kind="primary"] { width: 100%; }
-          .stDownloadButton { width: 100%; }
+          .stLinkButton { width: 100%; }
         </style>
     """, unsafe_allow_html=True)
 
-    # Progress UI
-    progress_bar = st.progress(0)
-    progress_text = st.empty()
-    info_line = st.empty()  # shows "XX% - mm:ss remaining" and final state
-    status_text = st.empty()
-
     # Start download
     if st.button("Start Download"):
         # Validate/create output directory
@@ -272,195 +338,118 @@ if info:
         # Output name pattern
         base_outtmpl = os.path.join(output_dir, '%(title)s.%(ext)s')
 
-        def _format_eta(d):
-            secs = d.get('eta')
-            if isinstance(secs, (int, float)) and secs >= 0:
-                mins = int(secs) // 60
-                s = int(secs) % 60
-                return f"{mins:02d}:{s:02d}"
-            return (d.get('_eta_str') or d.get('eta_str') or 'N/A')
-
-        downloaded_path = {'path': None}
-
-        def progress_hook(d):
-            if d.get('status') == 'downloading':
-                try:
-                    total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
-                    downloaded = d.get('downloaded_bytes') or 0
-                    percent = int(downloaded * 100 / total) if total else 0
-                    progress_bar.progress(min(max(percent, 0), 100))
-                    progress_text.markdown(f"**Progress:** {percent}%")
-                    eta_fmt = _format_eta(d)
-                    info_line.write(f"{percent}% - {eta_fmt} remaining")
-                    status_text.write("Downloading...")
-                except Exception:
-                    pass
-            elif d.get('status') == 'finished':
-                progress_bar.progress(100)
-                progress_text.markdown("**Progress:** 100%")
-                info_line.write("100% - processing...")
-                status_text.write("Processing...")
-                # Capture filename if provided
-                fn = d.get('filename')
-                if fn:
-                    downloaded_path['path'] = fn
-
-        def postprocessor_hook(d):
-            try:
-                if d.get('status') == 'started':
-                    status_text.write("Post-processing...")
-                elif d.get('status') == 'finished':
-                    status_text.write("Completed")
-            except Exception:
-                pass
-
+        if mode == "Audio Only (MP3)":
+            ydl_opts = {
+                'format': 'bestaudio/best',
+                'noplaylist': True,
+                'outtmpl': base_outtmpl,
+                'quiet': True,
+                'no_warnings': True,
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'mp3',
+                    'preferredquality': audio_quality,
+                }],
+            }
+        elif mode == "Audio Only (Original M4A/Opus)":
+            ydl_opts = {
+                'format': 'bestaudio/best',
+                'noplaylist': True,
+                'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
+                'quiet': True,
+                'no_warnings': True,
+            }
+        else:
+            if use_dynamic_format_id and dynamic_opts:
+                selected = dynamic_opts[selected_idx]
+                # exact format id for video + bestaudio
+                format_str = f"{selected['id']}+bestaudio/best"
+            else:
+                format_str = (
+                    f"bestvideo[height<={quality}][fps<={fps_choice}][ext=mp4]+bestaudio[ext=m4a]/"
+                    f"bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/"
+                    f"best[height<={quality}]"
+                )
+            ydl_opts = {
+                'format': format_str,
+                'noplaylist': True,
+                'merge_output_format': 'mp4',
+                'outtmpl': os.path.join(output_dir, '%(title)s_%(height)sp%(fps)s.%(ext)s'),
+                'quiet': True,
+                'no_warnings': True,
+                'postprocessors': [{
+                    'key': 'FFmpegVideoConvertor',
+                    'preferedformat': 'mp4',
+                }],
+            }
+
+        # Apply hardening (no cookie file used here)
+        ydl_opts = apply_common_ydl_hardening(ydl_opts, FFMPEG_BIN_DIR, None, use_aria)
+        # Add default headers for better compatibility
+        ydl_opts.update({
+            'http_headers': {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+                'Accept-Language': 'en-us,en;q=0.5',
+                'Accept-Encoding': 'gzip,deflate',
+                'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7'
+            }
+        })
+
+        # Try to use cookies from browsers
         try:
+            available_browsers = detect_local_browsers()
+            if available_browsers:
+                # Let yt-dlp auto-detect profile for the first supported browser
+                first = 'chrome' if 'chrome' in available_browsers else available_browsers[0]
+                ydl_opts['cookiesfrombrowser'] = (first,)
+        except Exception:
+            pass
 
-            if mode == "Audio Only (MP3)":
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'noplaylist': True,
-                    'outtmpl': base_outtmpl,
-                    'quiet': True,
-                    'no_warnings': True,
-                    'progress_hooks': [progress_hook],
-                    'postprocessor_hooks': [postprocessor_hook],
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': audio_quality,
-                    }],
-                }
-            elif mode == "Audio Only (Original M4A/Opus)":
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'noplaylist': True,
-                    'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
-                    'quiet': True,
-                    'no_warnings': True,
-                    'progress_hooks': [progress_hook],
-                    'postprocessor_hooks': [postprocessor_hook],
-                }
-            else:
-                if use_dynamic_format_id and dynamic_opts:
-                    selected = dynamic_opts[selected_idx]
-                    # exact format id for video + bestaudio
-                    ydl_opts = {
-                        'format': f"{selected['id']}+bestaudio/best",
-                        'noplaylist': True,
-                        'merge_output_format': 'mp4',
-                        'outtmpl': os.path.join(output_dir, '%(title)s_%(height)sp%(fps)s.%(ext)s'),
-                        'quiet': True,
-                        'no_warnings': True,
-                        'progress_hooks': [progress_hook],
-                        'postprocessor_hooks': [postprocessor_hook],
-                        'postprocessors': [{
-                            'key': 'FFmpegVideoConvertor',
-                            'preferedformat': 'mp4',
-                        }],
-                    }
-                else:
-                    format_str = (
-                        f"bestvideo[height<={quality}][fps<={fps_choice}][ext=mp4]+bestaudio[ext=m4a]/"
-                        f"bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/"
-                        f"best[height<={quality}]"
-                    )
-                    ydl_opts = {
-                        'format': format_str,
-                        'noplaylist': True,
-                        'merge_output_format': 'mp4',
-                        'outtmpl': os.path.join(output_dir, '%(title)s_%(height)sp%(fps)s.%(ext)s'),
-                        'quiet': True,
-                        'no_warnings': True,
-                        'progress_hooks': [progress_hook],
-                        'postprocessor_hooks': [postprocessor_hook],
-                        'postprocessors': [{
-                            'key': 'FFmpegVideoConvertor',
-                            'preferedformat': 'mp4',
-                        }],
-                    }
-
-            # Common robustness + aria2c
-            use_aria = st.checkbox("Use aria2c if available (faster)", value=is_aria2c_available())
-            # Apply hardening (no cookie file used here)
-            ydl_opts = apply_common_ydl_hardening(ydl_opts, FFMPEG_BIN_DIR, None, use_aria)
-            # Add default headers for better compatibility
-            ydl_opts.update({
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                    'Accept-Language': 'en-us,en;q=0.5',
-                    'Accept-Encoding': 'gzip,deflate',
-                    'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7'
-                }
-            })
-
-            # Try to use cookies from browsers
-            try:
-                available_browsers = detect_local_browsers()
-                if available_browsers:
-                    # Let yt-dlp auto-detect profile for the first supported browser
-                    first = 'chrome' if 'chrome' in available_browsers else available_browsers[0]
-                    ydl_opts['cookiesfrombrowser'] = (first,)
-            except Exception:
-                pass
-
-            last_downloaded = None
-
-            # Download with yt-dlp
-            try:
-                before = set(os.listdir(output_dir))
-                with YoutubeDL(ydl_opts) as ydl:
-                    status_text.write("Downloading...")
-                    ydl.download([url])
-                
-                # Find the downloaded file
-                candidate = downloaded_path.get('path')
-                if candidate and os.path.exists(candidate):
-                    last_downloaded = candidate
-                else:
-                    after = set(os.listdir(output_dir))
-                    new_files = list(after - before)
-                    if new_files:
-                        new_files.sort(key=lambda f: os.path.getmtime(os.path.join(output_dir, f)), reverse=True)
-                        last_downloaded = os.path.join(output_dir, new_files[0])
-            except Exception as e:
-                err_msg = str(e).lower()
-                if 'sign in to confirm your age' in err_msg or 'age-restricted' in err_msg:
-                    st.warning("This video is age-restricted and requires sign-in.")
-                    st.stop()
-                raise
-
-            # Completed UI
-            progress_bar.progress(100)
-            progress_text.markdown("**Progress:** 100%")
-            info_line.write("100% - complete")
-            status_text.write("Completed")
-
-            # Provide last file for direct download and open-folder action
-            if last_downloaded and os.path.exists(last_downloaded):
-                with open(last_downloaded, 'rb') as fh:
-                    st.download_button(label="Download file", data=fh, file_name=os.path.basename(last_downloaded), mime="application/octet-stream")
-                st.success(f"Saved to: {last_downloaded}")
-                # Open folder button
-                if st.button("Open folder"):
-                    try:
-                        folder = os.path.dirname(last_downloaded)
-                        if os.name == 'nt':
-                            os.startfile(folder)
-                        elif sys.platform == 'darwin':
-                            import subprocess
-                            subprocess.Popen(['open', folder])
-                        else:
-                            import subprocess
-                            subprocess.Popen(['xdg-open', folder])
-                    except Exception:
-                        pass
-            else:
-                st.error("Could not find the downloaded file.")
-        except Exception as e:
-            msg = str(e)
-            if ('sign in to confirm your age' in msg.lower()) or ('age-restricted' in msg.lower()):
+        downloads.submit(url, info.get('title', 'Unknown Title'), ydl_opts)
+
+# Progress for every download of this session. While any is running, only this
+# fragment reruns on a timer; the rest of the page is left alone.
+polling = downloads.active()
+
+@st.fragment(run_every=PROGRESS_REFRESH_SEC if polling else None)
+def download_panel():
+    tasks = downloads.snapshot()
+    if not tasks:
+        return
+    st.divider()
+    st.subheader("Downloads")
+    for task in reversed(tasks):
+        st.write(f"**{task['title']}**")
+        if task['status'] == 'error':
+            if task['age_restricted']:
                 st.warning("Sign in to download age-restricted video.")
             else:
-                st.error("Download failed.")
+                st.error(f"Download failed. {task['error'] or ''}")
+            continue
+        st.progress(task['percent'])
+        if task['status'] == 'finished':
+            path = task['path']
+            st.write("100% - complete")
+            st.success(f"Saved to: {path}")
+            cols = st.columns([1, 1, 3])
+            with cols[0]:
+                st.link_button("Download file", file_link(path))
+            with cols[1]:
+                if st.button("Open folder", key=f"folder-{task['id']}"):
+                    open_folder(os.path.dirname(path))
+        elif task['status'] == 'downloading':
+            st.write(f"{task['percent']}% - {task['eta']} remaining")
+        elif task['status'] in ('processing', 'post-processing'):
+            st.write("100% - processing...")
+        else:
+            st.write("Waiting for a free download slot..." if task['status'] == 'queued' else "Starting...")
+    if not downloads.active():
+        if st.button("Clear finished"):
+            downloads.clear_finished()
+            st.rerun()
+        if polling:
+            # Everything finished: one full rerun drops the refresh timer
+            st.rerun()
+
+download_panel()
@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+
+# A lease running at >= this fraction of its rate is assumed to want more
+_SATURATED = 0.9
+# Headroom given to a lease that is limited by something else (slow upstream/client)
+_HEADROOM = 1.25
+_REBALANCE_INTERVAL = 0.5
+
+
+def max_min_shares(capacity: float, demands: Dict[Any, float | None]) -> Dict[Any, float]:
+    """Water-filling: split capacity so no one gets more than they demand and the rest is shared equally.
+
+    A demand of None means "as much as possible".
+    """
+    shares: Dict[Any, float] = {}
+    remaining = capacity
+    pending = dict(demands)
+    while pending:
+        fair = remaining / len(pending)
+        satisfied = {k: d for k, d in pending.items() if d is not None and d <= fair}
+        if not satisfied:
+            for k in pending:
+                shares[k] = fair
+            return shares
+        for k, d in satisfied.items():
+            shares[k] = d
+            remaining -= d
+            del pending[k]
+    return shares
+
+
+class Lease:
+    """One transfer's slice of a BandwidthAllocator, enforced with a token bucket."""
+
+    def __init__(self, allocator: 'BandwidthAllocator', client: str):
+        self.allocator = allocator
+        self.client = client
+        self.rate: float | None = None
+        self.demand: float | None = None
+        self.bytes = 0
+        self._params: List[Dict[str, Any]] = []
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._window_start = self._last
+        self._window_bytes = 0
+        self._lock = threading.Lock()
+
+    def _set_rate(self, rate: float | None) -> None:
+        with self._lock:
+            self.rate = rate
+            self._tokens = min(self._tokens, rate or 0.0)
+            for params in self._params:
+                params['ratelimit'] = int(rate) if rate else None
+
+    def bind_params(self, params: Dict[str, Any]) -> None:
+        """Keep a yt-dlp params dict's 'ratelimit' in sync with this lease (read by the native HTTP downloader and passed to aria2c)."""
+        with self._lock:
+            self._params.append(params)
+            params['ratelimit'] = int(self.rate) if self.rate else None
+
+    def consume(self, nbytes: int) -> None:
+        """Account for nbytes transferred and sleep long enough to stay within the current rate."""
+        delay = self.charge(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    def charge(self, nbytes: int) -> float:
+        """Account for nbytes transferred; returns how long to pause (for callers that cannot block, e.g. asyncio)."""
+        if nbytes <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            self.bytes += nbytes
+            self._window_bytes += nbytes
+            rate = self.rate
+            delay = 0.0
+            if rate:
+                self._tokens = min(rate, self._tokens + (now - self._last) * rate) - nbytes
+                if self._tokens < 0:
+                    delay = -self._tokens / rate
+            self._last = now
+            observed = None
+            if now - self._window_start >= 1.0:
+                observed = self._window_bytes / (now - self._window_start)
+                self._window_start, self._window_bytes = now, 0
+        if observed is not None:
+            self.report_speed(observed)
+        return min(delay, 5.0)
+
+    def progress_hook(self) -> Any:
+        """A yt-dlp progress hook that feeds downloaded bytes through consume()."""
+        last = {}
+
+        def hook(d):
+            if d.get('status') != 'downloading':
+                return
+            key = d.get('tmpfilename') or d.get('filename')
+            downloaded = d.get('downloaded_bytes') or 0
+            delta = downloaded - last.get(key, 0)
+            last[key] = downloaded
+            self.consume(delta)
+        return hook
+
+    def report_speed(self, observed: float | None) -> None:
+        if not observed:
+            return
+        rate = self.rate
+        new_demand = None if (rate is None or observed >= rate * _SATURATED) else observed * _HEADROOM
+        if new_demand != self.demand:
+            self.demand = new_demand
+            self.allocator.rebalance(force=False)
+
+    def release(self) -> None:
+        self.allocator.release(self)
+
+    def __enter__(self) -> 'Lease':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class BandwidthAllocator:
+    """Max-min fair split of a link's capacity (bytes/s) across clients, then across each client's transfers.
+
+    Rates are recomputed whenever a transfer starts or finishes and, at most every
+    half second, when a transfer's observed speed shows it cannot use its share
+    (the surplus is handed to everyone else). A capacity of 0 disables shaping.
+    """
+
+    def __init__(self, capacity: float, name: str = 'link', min_rate: float = 32 * 1024):
+        self.capacity = float(capacity or 0)
+        self.name = name
+        self.min_rate = min_rate
+        self._leases: List[Lease] = []
+        self._lock = threading.Lock()
+        self._last_rebalance = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def acquire(self, client: str) -> Lease:
+        lease = Lease(self, client)
+        with self._lock:
+            self._leases.append(lease)
+        self.rebalance()
+        return lease
+
+    def release(self, lease: Lease) -> None:
+        with self._lock:
+            if lease in self._leases:
+                self._leases.remove(lease)
+        self.rebalance()
+
+    def rebalance(self, force: bool = True) -> None:
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_rebalance < _REBALANCE_INTERVAL:
+                return
+            self._last_rebalance = now
+            by_client: Dict[str, List[Lease]] = {}
+            for lease in self._leases:
+                by_client.setdefault(lease.client, []).append(lease)
+            client_demand = {}
+            for client, leases in by_client.items():
+                demands = [l.demand for l in leases]
+                client_demand[client] = None if any(d is None for d in demands) else sum(demands)
+            client_share = max_min_shares(self.capacity, client_demand)
+            rates = {}
+            for client, leases in by_client.items():
+                lease_share = max_min_shares(client_share[client], {l: l.demand for l in leases})
+                for lease, rate in lease_share.items():
+                    rates[lease] = max(self.min_rate, rate)
+        for lease, rate in rates.items():
+            lease._set_rate(rate)
+
+    def stream_file(self, path: str, client: str, chunk_size: int = 64 * 1024,
+                    start: int = 0, length: int | None = None) -> Iterator[bytes]:
+        """Yield a file's bytes paced by a lease for client; the lease is released when the stream ends or is closed."""
+        lease = self.acquire(client)
+        try:
+            with open(path, 'rb') as fh:
+                fh.seek(start)
+                remaining = length
+                while remaining is None or remaining > 0:
+                    chunk = fh.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    lease.consume(len(chunk))
+                    yield chunk
+        finally:
+            lease.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            leases = list(self._leases)
+        clients: Dict[str, Dict[str, Any]] = {}
+        for lease in leases:
+            c = clients.setdefault(lease.client, {'transfers': 0, 'rate': 0.0, 'bytes': 0})
+            c['transfers'] += 1
+            c['rate'] += lease.rate or 0.0
+            c['bytes'] += lease.bytes
+        return {'name': self.name, 'capacity': self.capacity, 'enabled': self.enabled,
+                'transfers': len(leases), 'clients': clients}
+
+
+INGRESS = BandwidthAllocator(float(os.environ.get('INGRESS_LIMIT_BPS', '0')), name='ingress')
+EGRESS = BandwidthAllocator(float(os.environ.get('EGRESS_LIMIT_BPS', '0')), name='egress')
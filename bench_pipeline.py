@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+try:
+    import resource  # POSIX only; CPU/RSS columns are empty elsewhere
+except ImportError:
+    resource = None
+
+from downloader import apply_common_ydl_hardening, is_aria2c_available
+from bench_upstream import BenchIE, FakeUpstream, MediaLibrary, make_profile
+
+_HAS_FFMPEG = shutil.which('ffmpeg') is not None
+
+
+def _ffmpeg_dir() -> str:
+    return os.path.dirname(shutil.which('ffmpeg') or '')
+
+
+def _hardened(opts: Dict[str, Any], use_aria2c: bool = False) -> Dict[str, Any]:
+    opts = apply_common_ydl_hardening(opts, _ffmpeg_dir(), None, use_aria2c=use_aria2c)
+    if not opts.get('ffmpeg_location'):
+        opts.pop('ffmpeg_location', None)
+    return opts
+
+
+# Each scenario: a description, optional 'needs' (external tools), optional 'network'
+# overrides of the fake upstream profile, and a factory for the yt-dlp options
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    'progressive_native': {
+        'description': 'single progressive file, yt-dlp defaults',
+        'opts': lambda: {'format': 'progressive'},
+    },
+    'progressive_hardened': {
+        'description': 'single progressive file, apply_common_ydl_hardening',
+        'opts': lambda: _hardened({'format': 'progressive'}),
+    },
+    'progressive_aria2c': {
+        'description': 'single progressive file through aria2c (-x16)',
+        'needs': ['aria2c'],
+        'opts': lambda: _hardened({'format': 'progressive'}, use_aria2c=True),
+    },
+    'dash_serial': {
+        'description': 'DASH video, one fragment at a time',
+        'opts': lambda: {'format': 'dash-video', 'concurrent_fragment_downloads': 1},
+    },
+    'dash_hardened': {
+        'description': 'DASH video, hardening (8 concurrent fragments, retries)',
+        'opts': lambda: _hardened({'format': 'dash-video'}),
+    },
+    'dash_lossy': {
+        'description': 'DASH video, hardening, 5% of responses fail',
+        'network': {'error_rate': 0.05},
+        'opts': lambda: _hardened({'format': 'dash-video', 'retry_sleep_functions': {'http': lambda n: 0.1, 'fragment': lambda n: 0.1}}),
+    },
+    'dash_aria2c': {
+        'description': 'DASH video fragments through aria2c',
+        'needs': ['aria2c'],
+        'opts': lambda: _hardened({'format': 'dash-video'}, use_aria2c=True),
+    },
+    'dash_merge': {
+        'description': 'DASH video+audio merged to mp4 by ffmpeg',
+        'needs': ['ffmpeg'],
+        'opts': lambda: _hardened({'format': 'dash-video+dash-audio', 'merge_output_format': 'mp4'}),
+    },
+    'remux_mkv': {
+        'description': 'progressive file remuxed to mkv (no re-encode)',
+        'needs': ['ffmpeg'],
+        'opts': lambda: _hardened({'format': 'progressive',
+                                   'postprocessors': [{'key': 'FFmpegVideoRemuxer', 'preferedformat': 'mkv'}]}),
+    },
+    'mp3_extract': {
+        'description': 'DASH audio converted to 192k MP3',
+        'needs': ['ffmpeg'],
+        'opts': lambda: _hardened({'format': 'dash-audio', 'postprocessors': [
+            {'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}]}),
+    },
+}
+
+
+def _missing(requirements: List[str]) -> List[str]:
+    checks: Dict[str, Callable[[], bool]] = {'ffmpeg': lambda: _HAS_FFMPEG, 'aria2c': is_aria2c_available}
+    return [r for r in requirements if not checks[r]()]
+
+
+def _usage() -> Dict[str, float]:
+    if resource is None:
+        return {}
+    me, kids = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'cpu_user_sec': me.ru_utime + kids.ru_utime,
+        'cpu_sys_sec': me.ru_stime + kids.ru_stime,
+        'peak_rss_mb': max(me.ru_maxrss, kids.ru_maxrss) * scale / 1e6,
+    }
+
+
+def run_scenario_child(name: str, url: str) -> Dict[str, Any]:
+    """Runs inside a fresh interpreter so CPU and peak RSS belong to this scenario alone."""
+    from yt_dlp import YoutubeDL
+    downloaded: Dict[str, int] = {}
+
+    def hook(d):
+        if d.get('status') in ('downloading', 'finished'):
+            downloaded[d.get('filename') or ''] = d.get('downloaded_bytes') or d.get('total_bytes') or 0
+
+    out_dir = tempfile.mkdtemp(prefix='bench-out-')
+    opts = SCENARIOS[name]['opts']()
+    opts.update({'paths': {'home': out_dir}, 'outtmpl': '%(id)s.%(ext)s', 'quiet': True,
+                 'noprogress': True, 'progress_hooks': [hook]})
+    before = _usage()
+    started = time.perf_counter()
+    error = None
+    try:
+        with YoutubeDL(opts) as ydl:
+            ydl.add_info_extractor(BenchIE())
+            ydl.extract_info(url, download=True, ie_key='Bench')
+    except Exception as e:
+        error = str(e)
+    wall = time.perf_counter() - started
+    after = _usage()
+    output_bytes = sum(os.path.getsize(os.path.join(out_dir, f)) for f in os.listdir(out_dir))
+    shutil.rmtree(out_dir, ignore_errors=True)
+    net_bytes = sum(downloaded.values())
+    result = {
+        'scenario': name,
+        'ok': error is None,
+        'error': error,
+        'wall_sec': round(wall, 3),
+        'downloaded_bytes': net_bytes,
+        'output_bytes': output_bytes,
+        'mb_per_sec': round(net_bytes / wall / 1e6, 2) if wall > 0 else None,
+    }
+    for key in ('cpu_user_sec', 'cpu_sys_sec'):
+        if key in after:
+            result[key] = round(after[key] - before[key], 3)
+    if 'peak_rss_mb' in after:
+        result['peak_rss_mb'] = round(after['peak_rss_mb'], 1)
+    return result
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names: List[str], repeat: int, network: Dict[str, float], media: Dict[str, int]) -> Dict[str, Any]:
+    import yt_dlp
+    library = MediaLibrary(**media)
+    server = FakeUpstream(library).start()
+    results = []
+    try:
+        for name in names:
+            spec = SCENARIOS[name]
+            missing = _missing(spec.get('needs', []))
+            if missing:
+                print(f'{name:22} skipped (needs {", ".join(missing)})')
+                results.append({'scenario': name, 'skipped': True, 'reason': f'needs {", ".join(missing)}'})
+                continue
+            profile = make_profile(**dict(network, **spec.get('network', {})))
+            url = server.page_url(profile)
+            for n in range(repeat):
+                proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--url', url],
+                                      capture_output=True, text=True)
+                try:
+                    result = json.loads(proc.stdout.strip().splitlines()[-1])
+                except (IndexError, ValueError):
+                    result = {'scenario': name, 'ok': False, 'error': proc.stderr.strip()[-500:]}
+                result['run'] = n
+                results.append(result)
+                status = 'ok' if result.get('ok') else f'FAILED: {result.get("error")}'
+                print(f'{name:22} run {n}: {result.get("wall_sec", "-")}s '
+                      f'{result.get("mb_per_sec", "-")} MB/s cpu {result.get("cpu_user_sec", "-")}+{result.get("cpu_sys_sec", "-")}s '
+                      f'rss {result.get("peak_rss_mb", "-")} MB  {status}')
+    finally:
+        server.stop()
+
+    summary = {}
+    for name in names:
+        runs = [r for r in results if r['scenario'] == name and r.get('ok')]
+        if runs:
+            summary[name] = {
+                'runs': len(runs),
+                'median_wall_sec': round(statistics.median(r['wall_sec'] for r in runs), 3),
+                'median_mb_per_sec': round(statistics.median(r['mb_per_sec'] for r in runs), 2),
+            }
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'yt_dlp': yt_dlp.version.__version__,
+            'ffmpeg': _HAS_FFMPEG,
+            'aria2c': is_aria2c_available(),
+            'real_media': library.real_media,
+            'network': network,
+            'media': media,
+            'repeat': repeat,
+        },
+        'results': results,
+        'summary': summary,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Scenarios whose median throughput dropped by more than tolerance (fraction) vs the baseline."""
+    regressions = []
+    for name, now in current['summary'].items():
+        before = baseline.get('summary', {}).get(name)
+        if not before or not before.get('median_mb_per_sec'):
+            continue
+        change = now['median_mb_per_sec'] / before['median_mb_per_sec'] - 1
+        line = f'{name:22} {before["median_mb_per_sec"]:>8} -> {now["median_mb_per_sec"]:>8} MB/s ({change:+.1%})'
+        print(line)
+        if change < -tolerance:
+            regressions.append(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the download pipeline against a local fake upstream')
+    parser.add_argument('scenarios', nargs='*', help=f'Scenarios to run (default: all): {", ".join(SCENARIOS)}')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='Runs per scenario (default: 3)')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against an earlier results file; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed throughput drop vs baseline (default: 0.10)')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Per-response latency (default: 20)')
+    parser.add_argument('--bandwidth', type=float, default=8e6, help='Per-response bandwidth in bytes/s, 0 = unlimited (default: 8e6)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of failed responses (default: 0)')
+    parser.add_argument('--duration', type=int, default=60, help='Synthetic video length in seconds (default: 60)')
+    parser.add_argument('--video-kbps', type=int, default=2500)
+    parser.add_argument('--audio-kbps', type=int, default=128)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario_child(args.child, args.url)))
+        return
+
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenario(s): {", ".join(unknown)}')
+    report = run_suite(
+        args.scenarios or list(SCENARIOS),
+        repeat=max(1, args.repeat),
+        network={'latency_ms': args.latency_ms, 'bandwidth_bps': args.bandwidth, 'error_rate': args.error_rate},
+        media={'duration': args.duration, 'video_kbps': args.video_kbps, 'audio_kbps': args.audio_kbps},
+    )
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regression(s) beyond {args.tolerance:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
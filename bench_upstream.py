@@ -0,0 +1,355 @@
+# Local fake upstream for benchmarking the download pipeline without touching YouTube.
+#
+# Serves one synthetic video as a DASH manifest (video + audio representations,
+# each with an init segment and numbered fragments) and as a progressive file:
+#   /bench/<profile>/<video_id>/{info.json, manifest.mpd, progressive.mp4}
+#   /bench/<profile>/<video_id>/<rep>/{init.mp4, seg-<n>.m4s}
+# <profile> sets per-response latency, bandwidth and error injection, e.g.
+# lat20-bw4000000-err0.05 (20 ms, 4 MB/s, 5% answered with 503 or a dropped
+# connection). With ffmpeg on PATH the media is real H.264/AAC, so merges and
+# MP3 extraction work; otherwise it is random bytes of the same sizes.
+# BenchIE resolves the page URL for yt-dlp: ydl.extract_info(url, ie_key='Bench').
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from yt_dlp.extractor.common import InfoExtractor
+
+SEGMENT_SECONDS = 2
+_CHUNK = 16 * 1024
+
+
+def parse_profile(profile: str) -> Dict[str, float]:
+    """'lat20-bw4000000-err0.05' -> {'latency': 0.02, 'bandwidth': 4e6, 'error_rate': 0.05}"""
+    conf = {'latency': 0.0, 'bandwidth': 0.0, 'error_rate': 0.0}
+    for part in profile.split('-'):
+        m = re.fullmatch(r'(lat|bw|err)([0-9.]+)', part)
+        if not m:
+            continue
+        key, value = m.group(1), float(m.group(2))
+        if key == 'lat':
+            conf['latency'] = value / 1000
+        elif key == 'bw':
+            conf['bandwidth'] = value
+        else:
+            conf['error_rate'] = value
+    return conf
+
+
+def make_profile(latency_ms: float = 0, bandwidth_bps: float = 0, error_rate: float = 0) -> str:
+    return f'lat{latency_ms:g}-bw{bandwidth_bps:g}-err{error_rate:g}'
+
+
+# -- media ---------------------------------------------------------------------------
+
+def _split_fmp4(data: bytes) -> tuple:
+    """Split a fragmented MP4 into (init segment, [moof+mdat fragments])."""
+    init, fragments, current = b'', [], b''
+    pos = 0
+    while pos + 8 <= len(data):
+        size = int.from_bytes(data[pos:pos + 4], 'big')
+        box = data[pos + 4:pos + 8]
+        if size == 1:
+            size = int.from_bytes(data[pos + 8:pos + 16], 'big')
+        elif size == 0:
+            size = len(data) - pos
+        chunk = data[pos:pos + size]
+        if box == b'moof' and current:
+            fragments.append(current)
+            current = b''
+        if box in (b'moof', b'mdat') or fragments or current:
+            current += chunk
+        else:
+            init += chunk
+        pos += size
+    if current:
+        fragments.append(current)
+    return init, fragments
+
+
+def _ffmpeg(args: List[str]) -> None:
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y'] + args, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+class MediaLibrary:
+    """The synthetic video: one video and one audio representation plus a progressive file."""
+
+    def __init__(self, duration: int = 60, video_kbps: int = 2500, audio_kbps: int = 128,
+                 height: int = 720, real_media: bool | None = None):
+        self.duration = duration
+        self.video_kbps = video_kbps
+        self.audio_kbps = audio_kbps
+        self.height = height
+        if real_media is None:
+            real_media = shutil.which('ffmpeg') is not None
+        self.real_media = False
+        self.reps: Dict[str, Dict[str, Any]] = {}
+        self.progressive = b''
+        if real_media:
+            try:
+                self._encode()
+                self.real_media = True
+            except (OSError, subprocess.CalledProcessError):
+                self.reps = {}
+        if not self.real_media:
+            self._synthesize()
+
+    def _rep(self, rep_id: str, kind: str, kbps: int, codecs: str, init: bytes, fragments: List[bytes]) -> None:
+        self.reps[rep_id] = {'kind': kind, 'bandwidth': kbps * 1000, 'codecs': codecs,
+                             'init': init, 'fragments': fragments}
+
+    def _synthesize(self) -> None:
+        count = max(1, -(-self.duration // SEGMENT_SECONDS))
+        rng = random.Random(42)
+        for rep_id, kind, kbps, codecs in (('video', 'video', self.video_kbps, 'avc1.64001f'),
+                                           ('audio', 'audio', self.audio_kbps, 'mp4a.40.2')):
+            seg_bytes = kbps * 1000 // 8 * SEGMENT_SECONDS
+            self._rep(rep_id, kind, kbps, codecs, rng.randbytes(1024),
+                      [rng.randbytes(seg_bytes) for _ in range(count)])
+        total = (self.video_kbps + self.audio_kbps) * 1000 // 8 * self.duration
+        self.progressive = rng.randbytes(total)
+
+    def _encode(self) -> None:
+        width = self.height * 16 // 9 // 2 * 2
+        frag = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-frag_duration', str(SEGMENT_SECONDS * 1_000_000)]
+        # Random noise keeps the encoder near the requested bitrate
+        video_src = ['-f', 'lavfi', '-i', f'nullsrc=s={width}x{self.height}:r=30:d={self.duration},geq=random(1)*255:128:128']
+        audio_src = ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={self.duration}']
+        v_enc = ['-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(30 * SEGMENT_SECONDS),
+                 '-b:v', f'{self.video_kbps}k', '-maxrate', f'{self.video_kbps}k', '-bufsize', f'{self.video_kbps}k']
+        a_enc = ['-c:a', 'aac', '-b:a', f'{self.audio_kbps}k']
+        with tempfile.TemporaryDirectory(prefix='bench-media-') as tmp:
+            v, a, p = (os.path.join(tmp, n) for n in ('v.mp4', 'a.mp4', 'p.mp4'))
+            _ffmpeg(video_src + v_enc + frag + ['-an', v])
+            _ffmpeg(audio_src + a_enc + frag + ['-vn', a])
+            _ffmpeg(video_src + audio_src + v_enc + a_enc + ['-movflags', '+faststart', p])
+            for rep_id, kind, kbps, codecs, path in (('video', 'video', self.video_kbps, 'avc1.64001f', v),
+                                                     ('audio', 'audio', self.audio_kbps, 'mp4a.40.2', a)):
+                with open(path, 'rb') as f:
+                    init, fragments = _split_fmp4(f.read())
+                self._rep(rep_id, kind, kbps, codecs, init, fragments)
+            with open(p, 'rb') as f:
+                self.progressive = f.read()
+
+    def total_bytes(self, rep_id: str) -> int:
+        rep = self.reps[rep_id]
+        return len(rep['init']) + sum(len(f) for f in rep['fragments'])
+
+    def mpd(self) -> str:
+        sets = []
+        for rep_id, rep in self.reps.items():
+            if rep['kind'] == 'video':
+                attrs = f'width="{self.height * 16 // 9 // 2 * 2}" height="{self.height}" frameRate="30"'
+                mime = 'video/mp4'
+            else:
+                attrs = 'audioSamplingRate="44100"'
+                mime = 'audio/mp4'
+            sets.append(
+                f'<AdaptationSet mimeType="{mime}" segmentAlignment="true">'
+                f'<Representation id="{rep_id}" bandwidth="{rep["bandwidth"]}" codecs="{rep["codecs"]}" {attrs}>'
+                # explicit list: real audio and video fragment counts need not match
+                f'<SegmentList timescale="1" duration="{SEGMENT_SECONDS}">'
+                f'<Initialization sourceURL="{rep_id}/init.mp4"/>'
+                + ''.join(f'<SegmentURL media="{rep_id}/seg-{n}.m4s"/>' for n in range(1, len(rep['fragments']) + 1))
+                + '</SegmentList></Representation></AdaptationSet>'
+            )
+        count = max(len(rep['fragments']) for rep in self.reps.values())
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" minBufferTime="PT2S" '
+            f'mediaPresentationDuration="PT{count * SEGMENT_SECONDS}S" '
+            'profiles="urn:mpeg:dash:profile:isoff-live:2011">'
+            f'<Period id="0">{"".join(sets)}</Period></MPD>'
+        )
+
+
+# -- server --------------------------------------------------------------------------
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'FakeUpstream'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _resolve(self, rest: str) -> tuple:
+        lib = self.server.library
+        if rest == 'info.json':
+            return json.dumps({'duration': lib.duration, 'height': lib.height, 'real_media': lib.real_media,
+                               'progressive_size': len(lib.progressive),
+                               'video_kbps': lib.video_kbps, 'audio_kbps': lib.audio_kbps}).encode(), 'application/json'
+        if rest == 'manifest.mpd':
+            return lib.mpd().encode(), 'application/dash+xml'
+        if rest == 'progressive.mp4':
+            return lib.progressive, 'video/mp4'
+        m = re.fullmatch(r'(\w+)/(init\.mp4|seg-(\d+)\.m4s)', rest)
+        if m and m.group(1) in lib.reps:
+            rep = lib.reps[m.group(1)]
+            if m.group(3) is None:
+                return rep['init'], 'video/mp4'
+            n = int(m.group(3))
+            if 1 <= n <= len(rep['fragments']):
+                return rep['fragments'][n - 1], 'video/iso.segment'
+        return None, None
+
+    def do_GET(self) -> None:
+        m = re.fullmatch(r'/bench/([^/]+)/([^/]+)/(.+)', self.path.split('?', 1)[0])
+        body, ctype = self._resolve(m.group(3)) if m else (None, None)
+        if body is None:
+            self.send_error(404)
+            return
+        conf = parse_profile(m.group(1))
+        self.server.count_request()
+        if conf['latency']:
+            time.sleep(conf['latency'])
+        failure = self.server.roll_failure(conf['error_rate'])
+        if failure == 'status':
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end = 0, len(body) - 1
+        rng = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if rng and (rng.group(1) or rng.group(2)):
+            if rng.group(1):
+                start = int(rng.group(1))
+                end = min(end, int(rng.group(2))) if rng.group(2) else end
+            else:
+                start = max(0, len(body) - int(rng.group(2)))
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        view = memoryview(body)[start:end + 1]
+        cut = len(view) // 2 if failure == 'drop' else len(view)
+        started = time.monotonic()
+        sent = 0
+        try:
+            while sent < cut:
+                chunk = view[sent:min(cut, sent + _CHUNK)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                self.server.count_bytes(len(chunk))
+                if conf['bandwidth']:
+                    ahead = sent / conf['bandwidth'] - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        if failure == 'drop':
+            self.close_connection = True
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, library: MediaLibrary, host: str = '127.0.0.1', port: int = 0, seed: int = 1):
+        super().__init__((host, port), _Handler)
+        self.library = library
+        self.requests = 0
+        self.bytes_sent = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def page_url(self, profile: str = 'lat0-bw0-err0', video_id: str = 'benchvideo0') -> str:
+        return f'{self.base_url}/bench/{profile}/{video_id}/'
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def count_bytes(self, n: int) -> None:
+        with self._lock:
+            self.bytes_sent += n
+
+    def roll_failure(self, rate: float) -> str | None:
+        if rate <= 0:
+            return None
+        with self._lock:
+            if self._rng.random() >= rate:
+                return None
+            self.failures += 1
+            return 'status' if self._rng.random() < 0.5 else 'drop'
+
+    def start(self) -> 'FakeUpstream':
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-upstream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+# -- yt-dlp extractor ----------------------------------------------------------------
+
+class BenchIE(InfoExtractor):
+    IE_NAME = 'bench'
+    _VALID_URL = r'https?://(?:127\.0\.0\.1|localhost):\d+/bench/(?P<profile>[^/]+)/(?P<id>[^/?#]+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        base = re.match(self._VALID_URL, url).group(0) + '/'
+        info = self._download_json(base + 'info.json', video_id)
+        formats = self._extract_mpd_formats(base + 'manifest.mpd', video_id, mpd_id='dash')
+        formats.append({
+            'format_id': 'progressive',
+            'url': base + 'progressive.mp4',
+            'ext': 'mp4',
+            'height': info['height'],
+            'vcodec': 'avc1.64001f',
+            'acodec': 'mp4a.40.2',
+            'filesize': info['progressive_size'],
+            'tbr': info['video_kbps'] + info['audio_kbps'],
+            'quality': -1,
+        })
+        return {
+            'id': video_id,
+            'title': f'Bench {video_id}',
+            'duration': info['duration'],
+            'formats': formats,
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the fake upstream on its own (Ctrl-C to stop)')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--duration', type=int, default=60)
+    parser.add_argument('--video-kbps', type=int, default=2500)
+    parser.add_argument('--audio-kbps', type=int, default=128)
+    args = parser.parse_args()
+    server = FakeUpstream(MediaLibrary(args.duration, args.video_kbps, args.audio_kbps), port=args.port)
+    print(f'Fake upstream on {server.page_url()} (real media: {server.library.real_media})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,75 @@
+import mimetypes
+import os
+from typing import Dict, List, Tuple
+from urllib.parse import quote
+from flask import Response
+
+DELIVERY_MODES = ('send_file', 'x-accel', 'x-sendfile')
+
+
+def parse_redirect_map(spec: str) -> List[Tuple[str, str]]:
+    """Parse '/srv/jobs=/_jobs/,/mnt/artifacts=/_artifacts/' into [(directory, internal prefix)]."""
+    mapping = []
+    for item in (spec or '').split(','):
+        root, sep, prefix = item.strip().partition('=')
+        if sep and root and prefix:
+            mapping.append((os.path.abspath(root), '/' + prefix.strip('/') + '/'))
+    # longest directory first, so nested roots win
+    return sorted(mapping, key=lambda m: len(m[0]), reverse=True)
+
+
+class Delivery:
+    """Hands file transfers to the front proxy instead of streaming them from Python.
+
+    * ``x-accel`` (nginx): the response carries ``X-Accel-Redirect`` with the
+      file's internal URI, derived from ``redirect_map`` (directory -> internal
+      location prefix).
+    * ``x-sendfile`` (Apache mod_xsendfile, lighttpd): ``X-Sendfile`` with the
+      absolute path.
+    * ``send_file``: no offload.
+
+    ``response`` returns None when the file cannot be offloaded (send_file mode,
+    or a path outside every mapped directory); callers then send it themselves.
+    """
+
+    def __init__(self, mode: str = 'send_file', redirect_map: List[Tuple[str, str]] | None = None):
+        if mode not in DELIVERY_MODES:
+            raise ValueError(f'Unknown DELIVERY_MODE: {mode}')
+        self.mode = mode
+        self.redirect_map = redirect_map or []
+
+    @property
+    def offloads(self) -> bool:
+        return self.mode != 'send_file'
+
+    def internal_uri(self, path: str) -> str | None:
+        path = os.path.abspath(path)
+        for root, prefix in self.redirect_map:
+            if path.startswith(root + os.sep):
+                rel = os.path.relpath(path, root).replace(os.sep, '/')
+                return prefix + quote(rel)
+        return None
+
+    def headers(self, path: str, filename: str | None = None) -> Dict[str, str] | None:
+        """Offload headers for an empty-bodied response, or None when the file cannot be offloaded."""
+        if not self.offloads:
+            return None
+        if self.mode == 'x-accel':
+            uri = self.internal_uri(path)
+            if uri is None:
+                return None
+            header = ('X-Accel-Redirect', uri)
+        else:
+            header = ('X-Sendfile', os.path.abspath(path))
+        filename = filename or os.path.basename(path)
+        return {
+            header[0]: header[1],
+            'Content-Type': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            'Content-Disposition': f"attachment; filename=\"{filename}\"; filename*=UTF-8''{quote(filename)}",
+        }
+
+    def response(self, path: str, filename: str | None = None) -> Response | None:
+        headers = self.headers(path, filename)
+        if headers is None:
+            return None
+        return Response(status=200, headers=headers)
@@ -1,9 +1,14 @@
+import functools
 import os
+import sys
 import shutil
+from array import array
 from typing import Any, Dict, List, Tuple
 
 
+@functools.lru_cache(maxsize=None)
 def is_aria2c_available() -> bool:
+    # Checked per job and per Streamlit rerun; a PATH walk each time adds up
     return shutil.which('aria2c') is not None
 
 
@@ -34,46 +39,234 @@ def estimate_format_size(fmt: Dict[str, Any], duration_sec: float | None) -> flo
     return None
 
 
+_CODEC_FAMILIES = {
+    'avc1': 'avc1', 'avc3': 'avc1', 'h264': 'avc1',
+    'hev1': 'hevc', 'hvc1': 'hevc', 'h265': 'hevc', 'hevc': 'hevc',
+    'vp09': 'vp9', 'vp9': 'vp9', 'vp8': 'vp8',
+    'av01': 'av01', 'av1': 'av01',
+    'mp4a': 'mp4a', 'aac': 'mp4a',
+    'opus': 'opus', 'vorbis': 'vorbis', 'mp3': 'mp3',
+}
+
+KIND_VIDEO, KIND_AUDIO, KIND_PROGRESSIVE = 0, 1, 2
+
+
+def codec_family(codec: str | None) -> str:
+    """Normalize a codec string such as 'avc1.64001F' or 'vp09.00.40.08' to its family ('avc1', 'vp9')."""
+    if not codec or codec == 'none':
+        return ''
+    base = codec.split('.', 1)[0].lower()
+    return _CODEC_FAMILIES.get(base, base)
+
+
+class FormatTable:
+    """Column-oriented view of a video's format ladder, built once per video.
+
+    The raw yt-dlp ``formats`` list holds dozens of large dicts (URLs, headers,
+    fragment lists); this keeps only the columns the UI and format selection need,
+    in arrays and interned strings, with indexes precomputed by height, fps, codec,
+    container and size.
+    """
+
+    __slots__ = (
+        'duration', 'ids', 'ext', 'vcodec', 'acodec', 'vfamily', 'afamily',
+        'kind', 'height', 'fps', 'tbr', 'abr', 'size',
+        'by_height', 'by_fps', 'by_vcodec', 'by_acodec', 'by_ext', 'by_size',
+        '_quality_options',
+    )
+
+    def __init__(self, duration: float | None = None):
+        self.duration = duration
+        self.ids: List[str] = []
+        self.ext: List[str] = []
+        self.vcodec: List[str] = []
+        self.acodec: List[str] = []
+        self.vfamily: List[str] = []
+        self.afamily: List[str] = []
+        self.kind = array('B')
+        self.height = array('H')   # 0 = unknown
+        self.fps = array('f')      # 0 = unknown
+        self.tbr = array('f')      # Kbps, 0 = unknown
+        self.abr = array('f')      # Kbps, 0 = unknown
+        self.size = array('d')     # bytes (reported or estimated), 0 = unknown
+        self.by_height: Dict[int, Tuple[int, ...]] = {}
+        self.by_fps: Dict[int, Tuple[int, ...]] = {}
+        self.by_vcodec: Dict[str, Tuple[int, ...]] = {}
+        self.by_acodec: Dict[str, Tuple[int, ...]] = {}
+        self.by_ext: Dict[str, Tuple[int, ...]] = {}
+        self.by_size: Tuple[int, ...] = ()
+        self._quality_options: List[Dict[str, Any]] | None = None
+
+    @classmethod
+    def from_info(cls, info: Dict[str, Any]) -> 'FormatTable':
+        return cls.from_formats(info.get('formats') or [], info.get('duration'))
+
+    @classmethod
+    def from_formats(cls, formats: List[Dict[str, Any]], duration: float | None) -> 'FormatTable':
+        table = cls(duration)
+        intern = sys.intern
+        for f in formats:
+            fmt_id = f.get('format_id') or f.get('format') if f else None
+            if not fmt_id:
+                continue
+            vcodec = f.get('vcodec') or 'none'
+            acodec = f.get('acodec') or 'none'
+            has_video = vcodec != 'none'
+            has_audio = acodec != 'none'
+            if not has_video and not has_audio:
+                # storyboards and other non-media entries
+                if not f.get('abr'):
+                    continue
+                has_audio = True
+            if has_video and has_audio:
+                kind = KIND_PROGRESSIVE
+            elif has_video:
+                kind = KIND_VIDEO
+            else:
+                kind = KIND_AUDIO
+            table.ids.append(str(fmt_id))
+            table.ext.append(intern(f.get('ext') or '?'))
+            table.vcodec.append(intern(vcodec))
+            table.acodec.append(intern(acodec))
+            table.vfamily.append(intern(codec_family(vcodec)))
+            table.afamily.append(intern(codec_family(acodec)))
+            table.kind.append(kind)
+            table.height.append(min(int(f.get('height') or 0), 65535))
+            table.fps.append(float(f.get('fps') or 0))
+            table.tbr.append(float(f.get('tbr') or 0))
+            table.abr.append(float(f.get('abr') or 0))
+            table.size.append(estimate_format_size(f, duration) or 0.0)
+        table._build_indexes()
+        return table
+
+    def _build_indexes(self) -> None:
+        by_height: Dict[int, List[int]] = {}
+        by_fps: Dict[int, List[int]] = {}
+        by_vcodec: Dict[str, List[int]] = {}
+        by_acodec: Dict[str, List[int]] = {}
+        by_ext: Dict[str, List[int]] = {}
+        for i in range(len(self.ids)):
+            if self.kind[i] != KIND_AUDIO:
+                if self.height[i]:
+                    by_height.setdefault(self.height[i], []).append(i)
+                if self.fps[i]:
+                    by_fps.setdefault(int(round(self.fps[i])), []).append(i)
+                by_vcodec.setdefault(self.vfamily[i], []).append(i)
+            if self.kind[i] != KIND_VIDEO:
+                by_acodec.setdefault(self.afamily[i], []).append(i)
+            by_ext.setdefault(self.ext[i], []).append(i)
+        self.by_height = {k: tuple(v) for k, v in by_height.items()}
+        self.by_fps = {k: tuple(v) for k, v in by_fps.items()}
+        self.by_vcodec = {k: tuple(v) for k, v in by_vcodec.items()}
+        self.by_acodec = {k: tuple(v) for k, v in by_acodec.items()}
+        self.by_ext = {k: tuple(v) for k, v in by_ext.items()}
+        self.by_size = tuple(sorted((i for i in range(len(self.ids)) if self.size[i]), key=self.size.__getitem__))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def heights(self) -> List[int]:
+        """Distinct known video heights, highest first."""
+        return sorted(self.by_height, reverse=True)
+
+    def fps_values(self) -> List[int]:
+        """Distinct known video frame rates (rounded), highest first."""
+        return sorted(self.by_fps, reverse=True)
+
+    def size_of(self, i: int) -> float | None:
+        return self.size[i] or None
+
+    def row(self, i: int) -> Dict[str, Any]:
+        return {
+            'id': self.ids[i],
+            'ext': self.ext[i],
+            'vcodec': self.vcodec[i],
+            'acodec': self.acodec[i],
+            'height': self.height[i] or None,
+            'fps': self.fps[i] or None,
+            'tbr': self.tbr[i] or None,
+            'size_bytes': self.size[i] or None,
+        }
+
+    def _quality_key(self, i: int) -> Tuple[int, float, float]:
+        return (self.height[i], self.fps[i], self.tbr[i])
+
+    def video_rows(self, max_height: int | None = None, max_fps: float | None = None, ext: str | None = None,
+                   vcodec: str | None = None, include_progressive: bool = False) -> List[int]:
+        """Row indexes of video formats within the limits, best quality first."""
+        if max_height:
+            candidates = [i for h, rows in self.by_height.items() if h <= max_height for i in rows]
+        else:
+            candidates = [i for rows in self.by_vcodec.values() for i in rows]
+        if ext:
+            candidates = [i for i in candidates if self.ext[i] == ext]
+        if vcodec:
+            family = codec_family(vcodec)
+            candidates = [i for i in candidates if self.vfamily[i] == family]
+        if max_fps:
+            candidates = [i for i in candidates if self.fps[i] <= max_fps + 0.5]
+        if not include_progressive:
+            candidates = [i for i in candidates if self.kind[i] == KIND_VIDEO]
+        return sorted(candidates, key=self._quality_key, reverse=True)
+
+    def audio_rows(self, ext: str | None = None, acodec: str | None = None) -> List[int]:
+        """Row indexes of audio-only formats, highest bitrate first."""
+        candidates = [i for i in range(len(self.ids)) if self.kind[i] == KIND_AUDIO]
+        if ext:
+            candidates = [i for i in candidates if self.ext[i] == ext]
+        if acodec:
+            family = codec_family(acodec)
+            candidates = [i for i in candidates if self.afamily[i] == family]
+        return sorted(candidates, key=lambda i: (self.abr[i] or self.tbr[i], self.size[i]), reverse=True)
+
+    def quality_options(self) -> List[Dict[str, Any]]:
+        """Selectable video-only formats for the UI, computed once per table."""
+        if self._quality_options is None:
+            options: List[Dict[str, Any]] = []
+            for i in self.video_rows():
+                height = self.height[i] or "?"
+                fps = self.fps[i]
+                fps_label = int(fps) if fps else "?"
+                size_bytes = self.size[i] or None
+                size_label = human_size(size_bytes) if size_bytes else "?"
+                options.append({
+                    "id": self.ids[i],
+                    "label": f"{height}p{fps_label} {self.ext[i]} {self.vcodec[i]} ~{size_label}",
+                    "height": height,
+                    "fps": fps_label if fps else "?",
+                    "ext": self.ext[i],
+                    "vcodec": self.vcodec[i],
+                    "size_bytes": size_bytes,
+                })
+            self._quality_options = options
+        return self._quality_options
+
+
 def build_dynamic_quality_options(info: Dict[str, Any]) -> List[Dict[str, Any]]:
-    duration = info.get("duration")
-    formats = info.get("formats") or []
-    options: List[Dict[str, Any]] = []
     # Only video-only formats (no audio). We'll merge with bestaudio later.
-    for f in formats:
-        if not f or f.get("vcodec") in (None, "none"):
-            continue
-        if f.get("acodec") and f.get("acodec") != "none":
-            # skip progressive when we want to combine with bestaudio; we still can allow it, but prefer video-only
-            continue
-        height = f.get("height") or "?"
-        fps = f.get("fps") or "?"
-        ext = f.get("ext") or "?"
-        vcodec = f.get("vcodec") or "?"
-        fmt_id = f.get("format_id") or f.get("format")
-        if not fmt_id:
-            continue
-        size_bytes = estimate_format_size(f, duration)
-        size_label = human_size(size_bytes) if size_bytes else "?"
-        label = f"{height}p{int(fps) if isinstance(fps, (int, float)) else fps} {ext} {vcodec} ~{size_label}"
-        options.append({
-            "id": str(fmt_id),
-            "label": label,
-            "height": height,
-            "fps": fps,
-            "ext": ext,
-            "vcodec": vcodec,
-            "size_bytes": size_bytes,
-        })
-    # Deduplicate by (height, fps, ext, vcodec, id) order by height desc then fps desc
-    seen = set()
-    deduped: List[Dict[str, Any]] = []
-    for opt in sorted(options, key=lambda o: (int(o["height"]) if str(o["height"]).isdigit() else 0, int(o["fps"]) if str(o["fps"]).isdigit() else 0), reverse=True):
-        key = (opt["id"], opt["height"], opt["fps"], opt["ext"], opt["vcodec"])
-        if key in seen:
-            continue
-        seen.add(key)
-        deduped.append(opt)
-    return deduped
+    table = info.get("format_table")
+    if table is None:
+        table = FormatTable.from_info(info)
+    return table.quality_options()
+
+
+THROTTLE_MARKERS = (
+    'http error 429',
+    'too many requests',
+    'http error 403',
+    'sign in to confirm you',
+    'rate-limited',
+    'rate limited',
+)
+
+
+def is_throttle_error(err: BaseException | str) -> bool:
+    """True when an upstream error looks like throttling rather than a per-video failure."""
+    msg = str(err).lower()
+    if 'sign in to confirm your age' in msg:
+        # Age gate, not throttling
+        return False
+    return any(marker in msg for marker in THROTTLE_MARKERS)
 
 
 def apply_common_ydl_hardening(opts: Dict[str, Any], ffmpeg_dir: str, cookiefile_path: str | None, use_aria2c: bool) -> Dict[str, Any]:
@@ -97,5 +290,47 @@ def apply_common_ydl_hardening(opts: Dict[str, Any], ffmpeg_dir: str, cookiefile
     return opts
 
 
+class DownloadResult:
+    """Where one download ended up, taken from yt-dlp's own hooks instead of a directory scan.
+
+    ``post_hooks`` get the final path after every postprocessor and the move out
+    of the temp dir; the last postprocessor's ``info_dict['filepath']`` and the
+    downloader's 'finished' filename are fallbacks for callers (or fakes) that
+    never reach that step. One instance per job, so jobs sharing an output
+    directory can never pick up each other's files.
+    """
+
+    def __init__(self):
+        self.paths: List[str] = []       # final files, one per downloaded video
+        self.downloaded: List[str] = []  # per-format files as the downloader finished them
+        self.postprocessed: str | None = None
+        self.info: Dict[str, Any] = {}
+
+    def attach(self, ydl_opts: Dict[str, Any]) -> 'DownloadResult':
+        ydl_opts['progress_hooks'] = list(ydl_opts.get('progress_hooks') or []) + [self.progress_hook]
+        ydl_opts['postprocessor_hooks'] = list(ydl_opts.get('postprocessor_hooks') or []) + [self.postprocessor_hook]
+        ydl_opts['post_hooks'] = list(ydl_opts.get('post_hooks') or []) + [self.post_hook]
+        return self
+
+    def progress_hook(self, d: Dict[str, Any]) -> None:
+        if d.get('status') == 'finished' and d.get('filename'):
+            self.downloaded.append(d['filename'])
+
+    def postprocessor_hook(self, d: Dict[str, Any]) -> None:
+        if d.get('status') != 'finished':
+            return
+        info = d.get('info_dict') or {}
+        if info.get('filepath'):
+            self.postprocessed = info['filepath']
+        self.info = {k: info.get(k) for k in ('id', 'title', 'ext', 'filepath')}
 
+    def post_hook(self, filepath: str) -> None:
+        self.paths.append(filepath)
 
+    @property
+    def path(self) -> str | None:
+        """The final artifact, or None if the download produced nothing that still exists."""
+        for candidate in (self.paths[-1:] + [self.postprocessed] + self.downloaded[-1:]):
+            if candidate and os.path.exists(candidate):
+                return candidate
+        return None
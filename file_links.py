@@ -0,0 +1,229 @@
+# Sidecar file server for the Streamlit app's finished downloads.
+#
+# st.download_button reads the whole file into the Streamlit server and pushes
+# it over the websocket; with a few multi-GB videos that is an OOM. Instead the
+# app hands out short-lived links to this server:
+#   /files/<token>/<filename>
+# The token is an HMAC-signed (path, expiry) pair, so the server keeps no state
+# and only serves files the app signed. Bodies go out with socket.sendfile()
+# from disk (single byte ranges supported), so memory stays flat at any size.
+# Runs in-process (FileLinkServer.start()) or standalone:
+#   FILE_LINK_SECRET=... python file_links.py --port 8502
+import argparse
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from urllib.parse import quote
+
+# Without a shared secret, links are only valid for the in-process server that signed them
+FILE_LINK_SECRET = os.environ.get('FILE_LINK_SECRET', '').encode('utf-8') or os.urandom(32)
+FILE_LINK_TTL_SEC = float(os.environ.get('FILE_LINK_TTL_SEC', '900'))
+FILE_LINK_HOST = os.environ.get('FILE_LINK_HOST', '127.0.0.1')
+FILE_LINK_PORT = int(os.environ.get('FILE_LINK_PORT', '8502'))
+# Public base URL, e.g. https://example.com/dl behind a TLS proxy; required unless bound to loopback
+FILE_LINK_BASE_URL = os.environ.get('FILE_LINK_BASE_URL', '').rstrip('/')
+# 'embedded' runs the server inside the app process; 'external' only signs links for a standalone one
+FILE_LINK_SERVER = os.environ.get('FILE_LINK_SERVER', 'embedded')
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def sign_path(path: str, ttl: float | None = None, secret: bytes = FILE_LINK_SECRET) -> str:
+    payload = _b64(json.dumps({'p': os.path.abspath(path), 'e': int(time.time() + (ttl or FILE_LINK_TTL_SEC))},
+                              separators=(',', ':')).encode('utf-8'))
+    sig = _b64(hmac.new(secret, payload.encode('ascii'), hashlib.sha256).digest())
+    return f'{payload}.{sig}'
+
+
+def verify_token(token: str, secret: bytes = FILE_LINK_SECRET) -> str | None:
+    """The signed path, or None if the token is malformed, forged or expired."""
+    payload, _, sig = token.partition('.')
+    expected = _b64(hmac.new(secret, payload.encode('ascii', 'replace'), hashlib.sha256).digest())
+    if not sig or not hmac.compare_digest(sig, expected):
+        return None
+    try:
+        claims = json.loads(_unb64(payload))
+    except ValueError:
+        return None
+    if claims.get('e', 0) < time.time():
+        return None
+    return claims.get('p')
+
+
+def is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        return False
+
+
+def base_url_for(host: str, port: int, base_url: str = FILE_LINK_BASE_URL) -> str:
+    """Where links point: base_url, else the loopback address itself.
+
+    A sidecar reachable from other machines must be given its public URL: links
+    are never built from a Host header or sent over plain HTTP to a wildcard bind.
+    """
+    if base_url:
+        return base_url.rstrip('/')
+    if not is_loopback(host):
+        raise ValueError(f'FILE_LINK_BASE_URL must be set when the file link server binds to {host}')
+    host = host.strip('[]')
+    return f'http://[{host}]:{port}' if ':' in host else f'http://{host}:{port}'
+
+
+def link_url(path: str, base_url: str, ttl: float | None = None, secret: bytes = FILE_LINK_SECRET) -> str:
+    return f'{base_url.rstrip("/")}/files/{sign_path(path, ttl, secret)}/{quote(os.path.basename(path))}'
+
+
+def parse_range(header: str, size: int) -> Tuple[int, int] | None:
+    """(start, end) inclusive for a single 'bytes=' range; None to send the whole file.
+
+    Raises ValueError when the range cannot be satisfied.
+    """
+    rng = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not rng or not (rng.group(1) or rng.group(2)):
+        return None  # absent, multi-range or malformed: 200 with the full body
+    if rng.group(1):
+        start = int(rng.group(1))
+        end = min(size - 1, int(rng.group(2))) if rng.group(2) else size - 1
+    else:
+        start, end = max(0, size - int(rng.group(2))), size - 1
+    if start > end or start >= size:
+        raise ValueError('unsatisfiable range')
+    return start, end
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'FileLinkServer'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _reply_empty(self, status: int, headers: dict | None = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self) -> None:
+        self.do_GET(body=False)
+
+    def do_GET(self, body: bool = True) -> None:
+        m = re.fullmatch(r'/files/([\w.-]+)/[^/]*', self.path.split('?', 1)[0])
+        path = verify_token(m.group(1), self.server.secret) if m else None
+        if not path:
+            self._reply_empty(403 if m else 404)
+            return
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self._reply_empty(404)
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+            try:
+                rng = parse_range(self.headers.get('Range', ''), size)
+            except ValueError:
+                self._reply_empty(416, {'Content-Range': f'bytes */{size}'})
+                return
+            if rng and self.headers.get('If-Range') not in (None, etag):
+                rng = None  # file changed since the client's partial copy
+            filename = os.path.basename(path)
+            start, end = rng or (0, size - 1)
+            self.send_response(206 if rng else 200)
+            if rng:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.send_header('Content-Type', mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Content-Disposition', f"attachment; filename=\"{filename}\"; filename*=UTF-8''{quote(filename)}")
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'private, no-store')
+            self.end_headers()
+            if not body or end < start:
+                return
+            try:
+                # Zero-copy where the OS allows it; socket.sendfile falls back to chunked send()
+                self.connection.sendfile(f, start, end - start + 1)
+                self.server.count_bytes(end - start + 1)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+
+class FileLinkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = FILE_LINK_HOST, port: int = FILE_LINK_PORT, secret: bytes = FILE_LINK_SECRET,
+                 base_url: str = FILE_LINK_BASE_URL):
+        # Refuse a public bind without a public URL before opening the socket
+        base_url_for(host, port, base_url)
+        super().__init__((host, port), _Handler)
+        self.secret = secret
+        self.base_url = base_url_for(host, self.port, base_url)
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def count_bytes(self, n: int) -> None:
+        with self._lock:
+            self.bytes_sent += n
+
+    def start(self) -> 'FileLinkServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='file-links', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def link(self, path: str, ttl: float | None = None) -> str:
+        """Signed URL for path under this server's base URL."""
+        return link_url(path, self.base_url, ttl, self.secret)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Serve signed file links (set FILE_LINK_SECRET to share it with the app)')
+    parser.add_argument('--host', default=FILE_LINK_HOST)
+    parser.add_argument('--port', type=int, default=FILE_LINK_PORT)
+    args = parser.parse_args()
+    if not os.environ.get('FILE_LINK_SECRET'):
+        parser.error('FILE_LINK_SECRET must be set for a standalone server')
+    try:
+        server = FileLinkServer(args.host, args.port)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f'Serving signed file links on {args.host}:{server.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+from typing import Any, Dict, List, Tuple
+from downloader import FormatTable, KIND_PROGRESSIVE, human_size
+
+# Codec families each output container takes without re-encoding
+CONTAINER_CODECS = {
+    'mp4': ({'avc1', 'hevc', 'av01'}, {'mp4a', 'mp3'}),
+    'webm': ({'vp9', 'vp8', 'av01'}, {'opus', 'vorbis'}),
+    'mkv': (None, None),  # anything goes
+}
+
+
+def _codecs_fit(container: str, vfamily: str, afamily: str) -> bool:
+    video_ok, audio_ok = CONTAINER_CODECS.get(container, (None, None))
+    return ((video_ok is None or not vfamily or vfamily in video_ok)
+            and (audio_ok is None or not afamily or afamily in audio_ok))
+
+
+def byte_budget(max_bytes: float | None = None, bandwidth_bps: float | None = None,
+                target_seconds: float | None = None) -> Tuple[float | None, List[str]]:
+    """Combine an explicit size cap and a time target at a measured bandwidth (bits/s) into one byte budget."""
+    limits = []
+    notes = []
+    if max_bytes:
+        limits.append(float(max_bytes))
+        notes.append(f"size cap {human_size(max_bytes)}")
+    if bandwidth_bps and target_seconds:
+        time_cap = float(bandwidth_bps) / 8.0 * float(target_seconds)
+        limits.append(time_cap)
+        notes.append(f"{target_seconds:g}s at {float(bandwidth_bps) / 1e6:.2f} Mbit/s allows {human_size(time_cap)}")
+    return (min(limits) if limits else None), notes
+
+
+def select_format(table: FormatTable, max_height: int | None = None, max_fps: float | None = None,
+                  max_bytes: float | None = None, bandwidth_bps: float | None = None,
+                  target_seconds: float | None = None, container: str = 'mp4',
+                  prefer_no_transcode: bool = True) -> Dict[str, Any]:
+    """Pick the best video+audio combination from the full format ladder under size and time constraints.
+
+    Candidates are every video-only format paired with every audio stream (and
+    every progressive format on its own), sized with estimate_format_size, so a
+    smaller audio stream can buy a higher video height. Among the combinations
+    that fit the byte budget the highest height, then fps, wins; then codecs the
+    container takes natively (when prefer_no_transcode is set), then the higher
+    audio bitrate. If nothing fits, the smallest known combination is returned
+    and flagged.
+
+    Returns a dict with the yt-dlp ``format`` spec, the chosen ids, predicted bytes
+    and seconds, and a human-readable ``explanation`` list.
+    """
+    budget, explanation = byte_budget(max_bytes, bandwidth_bps, target_seconds)
+    audio_rows = table.audio_rows()
+
+    candidates = []
+    for v in table.video_rows(max_height, max_fps, include_progressive=True):
+        if table.kind[v] == KIND_PROGRESSIVE:
+            size = table.size[v] or None
+            candidates.append((v, None, size, _codecs_fit(container, table.vfamily[v], table.afamily[v])))
+            continue
+        for a in audio_rows:
+            size = (table.size[v] + table.size[a]) if (table.size[v] and table.size[a]) else None
+            candidates.append((v, a, size, _codecs_fit(container, table.vfamily[v], table.afamily[a])))
+
+    result: Dict[str, Any] = {
+        'format': None, 'video_id': None, 'audio_id': None, 'height': None, 'fps': None,
+        'predicted_bytes': None, 'predicted_seconds': None, 'needs_transcode': None,
+        'within_budget': None, 'budget_bytes': budget, 'explanation': explanation,
+    }
+    if not candidates:
+        explanation.append("no video formats match the height/fps limits")
+        return result
+
+    def rank(c):
+        v, a, size, fits_codecs = c
+        audio_rate = (table.abr[a] or table.tbr[a]) if a is not None else table.abr[v]
+        return (table.height[v], round(table.fps[v]), fits_codecs if prefer_no_transcode else True,
+                audio_rate, size is not None, -(size or 0))
+
+    if budget is not None:
+        feasible = [c for c in candidates if c[2] is not None and c[2] <= budget]
+        unknown = sum(1 for c in candidates if c[2] is None)
+        if unknown:
+            explanation.append(f"{unknown} combination(s) skipped: size unknown")
+    else:
+        feasible = candidates
+
+    if feasible:
+        best = max(feasible, key=rank)
+        within = True if budget is not None else None
+    else:
+        sized = [c for c in candidates if c[2] is not None]
+        best = min(sized, key=lambda c: c[2]) if sized else min(candidates, key=lambda c: table.height[c[0]])
+        within = False
+        explanation.append("nothing fits the budget; using the smallest available combination")
+
+    v, a, size, fits_codecs = best
+    result.update({
+        'format': f"{table.ids[v]}+{table.ids[a]}" if a is not None else table.ids[v],
+        'video_id': table.ids[v],
+        'audio_id': table.ids[a] if a is not None else None,
+        'height': table.height[v] or None,
+        'fps': round(table.fps[v]) if table.fps[v] else None,
+        'predicted_bytes': size,
+        'needs_transcode': not fits_codecs,
+        'within_budget': within,
+    })
+    desc = f"{table.height[v]}p{round(table.fps[v]) if table.fps[v] else ''} {table.vcodec[v]}"
+    if a is not None:
+        desc += f" + {table.acodec[a]}"
+    explanation.append(f"chose {result['format']} ({desc}) of {len(candidates)} candidate(s)"
+                       + (f", ~{human_size(size)}" if size else ", size unknown"))
+    if size and bandwidth_bps:
+        result['predicted_seconds'] = round(size * 8.0 / float(bandwidth_bps), 1)
+        explanation.append(f"predicted transfer {result['predicted_seconds']}s at {float(bandwidth_bps) / 1e6:.2f} Mbit/s")
+    explanation.append(f"codecs fit {container} without re-encoding" if fits_codecs
+                       else f"codecs need re-encoding for {container}")
+    return result
+
+
+def select_audio_format(table: FormatTable, max_bytes: float | None = None, bandwidth_bps: float | None = None,
+                        target_seconds: float | None = None) -> Dict[str, Any]:
+    """Pick the best audio-only stream under the byte budget (for MP3 extraction the source codec does not matter)."""
+    budget, explanation = byte_budget(max_bytes, bandwidth_bps, target_seconds)
+    rows = table.audio_rows()
+    result: Dict[str, Any] = {
+        'format': None, 'audio_id': None, 'predicted_bytes': None, 'predicted_seconds': None,
+        'within_budget': None, 'budget_bytes': budget, 'explanation': explanation,
+    }
+    if not rows:
+        explanation.append("no audio-only formats listed")
+        return result
+    choice = rows[0]
+    if budget is not None:
+        fitting = [i for i in rows if table.size[i] and table.size[i] <= budget]
+        if fitting:
+            choice = fitting[0]
+            result['within_budget'] = True
+        else:
+            sized = [i for i in rows if table.size[i]]
+            choice = min(sized, key=table.size.__getitem__) if sized else rows[-1]
+            result['within_budget'] = False
+            explanation.append("nothing fits the budget; using the smallest audio stream")
+    size = table.size[choice] or None
+    result.update({'format': table.ids[choice], 'audio_id': table.ids[choice], 'predicted_bytes': size})
+    explanation.append(f"chose audio {table.ids[choice]} ({table.acodec[choice]})"
+                       + (f", ~{human_size(size)}" if size else ", size unknown"))
+    if size and bandwidth_bps:
+        result['predicted_seconds'] = round(size * 8.0 / float(bandwidth_bps), 1)
+    return result
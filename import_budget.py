@@ -0,0 +1,102 @@
+# Import-time budget check for the app entry points.
+#
+# Runs `python -X importtime -c "import <module>"` in a fresh interpreter per
+# entry point (best of --runs), reports the cumulative import time and the
+# heaviest direct imports, and exits non-zero when an entry point goes over its
+# budget or pulls in a module that is meant to load on first use (yt-dlp, the
+# Google OAuth stack, Flask-Session). Meant for CI after dependency or import
+# changes:
+#   python import_budget.py
+#   python import_budget.py --scale 2 web_app2 app    # slower CI machine
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Cumulative milliseconds for `import <module>`, roughly twice what a warm run takes on a dev laptop
+BUDGETS_MS = {
+    'web_app2': 450,
+    'web_app_async': 650,
+    'web_app': 350,
+    'app': 1000,
+    'youtube_downloader_gui': 150,
+    'ytdlp_downloader': 600,
+}
+
+# Loaded on first use by the server and UI entry points; importing any of them at startup is a regression
+DEFERRED = ('yt_dlp', 'google_auth_oauthlib', 'google.oauth2', 'google.auth.transport', 'flask_session')
+DEFERRED_FOR = ('web_app2', 'web_app_async', 'web_app', 'app', 'youtube_downloader_gui')
+
+_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    entries = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            entries.append({'self_us': int(m.group(1)), 'cumulative_us': int(m.group(2)),
+                            'depth': len(m.group(3)) // 2, 'name': m.group(4)})
+    return entries
+
+
+def measure(module: str) -> Dict[str, Any]:
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=HERE,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    entries = parse_importtime(proc.stderr)
+    # Children are printed before their parent, so the direct imports of the
+    # module are the depth-1 lines since the previous top-level line
+    children: List[Dict[str, Any]] = []
+    for entry in entries:
+        if entry['depth'] == 0:
+            if entry['name'] == module:
+                return {'module': module, 'ok': proc.returncode == 0, 'cumulative_ms': entry['cumulative_us'] / 1000,
+                        'children': children, 'names': {e['name'] for e in entries}}
+            children = []
+        elif entry['depth'] == 1:
+            children.append(entry)
+    return {'module': module, 'ok': False, 'error': proc.stderr.strip().splitlines()[-1:] or ['no output']}
+
+
+def best_of(module: str, runs: int) -> Dict[str, Any]:
+    results = [measure(module) for _ in range(max(1, runs))]
+    ok = [r for r in results if r['ok']]
+    return min(ok, key=lambda r: r['cumulative_ms']) if ok else results[0]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Check entry-point import times against a budget')
+    parser.add_argument('modules', nargs='*', help=f'Entry points to check (default: {", ".join(BUDGETS_MS)})')
+    parser.add_argument('--runs', type=int, default=3, help='Fresh interpreters per entry point; the fastest counts (default: 3)')
+    parser.add_argument('--scale', type=float, default=float(os.environ.get('IMPORT_BUDGET_SCALE', '1')),
+                        help='Multiply every budget, for slower machines (default: IMPORT_BUDGET_SCALE or 1)')
+    parser.add_argument('--top', type=int, default=5, help='Heaviest direct imports to list (default: 5)')
+    args = parser.parse_args()
+
+    failures = 0
+    for module in args.modules or list(BUDGETS_MS):
+        budget = BUDGETS_MS.get(module, 0) * args.scale
+        result = best_of(module, args.runs)
+        if not result['ok']:
+            print(f'{module:<24} FAILED to import: {result["error"][0]}')
+            failures += 1
+            continue
+        over = budget and result['cumulative_ms'] > budget
+        leaked = [name for name in DEFERRED if module in DEFERRED_FOR
+                  and any(n == name or n.startswith(name + '.') for n in result['names'])]
+        status = 'OVER' if over or leaked else 'ok'
+        print(f'{module:<24} {result["cumulative_ms"]:8.1f} ms  budget {budget:6.0f} ms  {status}')
+        for child in sorted(result['children'], key=lambda e: -e['cumulative_us'])[:args.top]:
+            print(f'    {child["cumulative_us"] / 1000:8.1f} ms  {child["name"]}')
+        if leaked:
+            print(f'    imported at startup, should load on first use: {", ".join(leaked)}')
+        failures += bool(over or leaked)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
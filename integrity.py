@@ -0,0 +1,215 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict
+
+try:
+    import xxhash  # optional, much cheaper than SHA-256 for quick comparisons
+except ImportError:
+    xxhash = None
+
+SIDECAR_SUFFIX = '.digests.json'
+_READ_CHUNK = 1024 * 1024
+
+
+def new_hashers() -> Dict[str, Any]:
+    hashers = {'sha256': hashlib.sha256()}
+    if xxhash is not None:
+        hashers['xxh3_64'] = xxhash.xxh3_64()
+    return hashers
+
+
+def hash_file(path: str) -> Dict[str, Any]:
+    """Digests of a whole file in a single read pass."""
+    hashers = new_hashers()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_READ_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            for h in hashers.values():
+                h.update(chunk)
+    return _finish(hashers, size)
+
+
+def _finish(hashers: Dict[str, Any], size: int) -> Dict[str, Any]:
+    digests: Dict[str, Any] = {name: h.hexdigest() for name, h in hashers.items()}
+    digests['size'] = size
+    return digests
+
+
+class IncrementalHasher:
+    """Hashes files while yt-dlp writes them, from its progress hook.
+
+    On every progress callback only the bytes appended since the previous one
+    are read back (they are still in the page cache), so a finished download
+    already has its digests and is never re-read from disk. If a file shrinks
+    or restarts (retry without range support) its hash is started over. Not
+    usable with downloaders that write out of order (aria2c with several
+    connections), which callers should detect and skip.
+    """
+
+    def __init__(self):
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._done: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _feed(self, key: str, path: str) -> Dict[str, Any] | None:
+        state = self._state.get(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return state
+        if state is None or size < state['offset']:
+            state = self._state[key] = {'hashers': new_hashers(), 'offset': 0}
+        if size > state['offset']:
+            with open(path, 'rb') as f:
+                f.seek(state['offset'])
+                remaining = size - state['offset']
+                while remaining > 0:
+                    chunk = f.read(min(_READ_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    state['offset'] += len(chunk)
+                    for h in state['hashers'].values():
+                        h.update(chunk)
+        return state
+
+    def progress_hook(self) -> Any:
+        def hook(d):
+            status = d.get('status')
+            filename = d.get('filename')
+            if status not in ('downloading', 'finished') or not filename:
+                return
+            with self._lock:
+                if status == 'downloading':
+                    tmp = d.get('tmpfilename') or filename
+                    self._feed(filename, tmp)
+                else:
+                    # .part has been renamed to the final name by now
+                    state = self._feed(filename, filename)
+                    self._state.pop(filename, None)
+                    if state is not None:
+                        self._done[os.path.abspath(filename)] = _finish(state['hashers'], state['offset'])
+        return hook
+
+    def digests_for(self, path: str) -> Dict[str, Any] | None:
+        """Digests collected for path, if it was hashed while downloading and has not changed since."""
+        with self._lock:
+            digests = self._done.get(os.path.abspath(path))
+            if digests is None:
+                # staged in a temp dir (yt-dlp 'paths') and moved into place afterwards
+                name = os.path.basename(path)
+                digests = next((d for p, d in self._done.items() if os.path.basename(p) == name), None)
+        if digests is None or not os.path.exists(path) or os.path.getsize(path) != digests['size']:
+            return None
+        return dict(digests)
+
+
+# -- sidecar storage ---------------------------------------------------------------
+
+def read_digests(path: str) -> Dict[str, Any] | None:
+    """Stored digests for path, or None when missing or stale (size/mtime changed)."""
+    try:
+        with open(path + SIDECAR_SUFFIX, 'r', encoding='utf-8') as f:
+            digests = json.load(f)
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if digests.get('size') != st.st_size or digests.get('mtime_ns') != st.st_mtime_ns:
+        return None
+    return digests
+
+
+def write_digests(path: str, digests: Dict[str, Any]) -> Dict[str, Any]:
+    digests = dict(digests, mtime_ns=os.stat(path).st_mtime_ns)
+    tmp = path + SIDECAR_SUFFIX + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(digests, f)
+    os.replace(tmp, path + SIDECAR_SUFFIX)
+    return digests
+
+
+def artifact_digests(path: str, hasher: IncrementalHasher | None = None) -> Dict[str, Any]:
+    """Digests for a finished artifact: from its sidecar, else from the incremental hasher,
+    else one read of the file (e.g. after an ffmpeg merge or conversion). Stores the sidecar."""
+    digests = read_digests(path)
+    if digests is not None:
+        return digests
+    digests = (hasher.digests_for(path) if hasher is not None else None) or hash_file(path)
+    return write_digests(path, digests)
+
+
+def http_headers(digests: Dict[str, Any]) -> Dict[str, str]:
+    """ETag plus RFC 3230 Digest and RFC 9530 Repr-Digest headers for the artifact."""
+    b64 = base64.b64encode(bytes.fromhex(digests['sha256'])).decode('ascii')
+    return {
+        'ETag': f'"{digests["sha256"]}"',
+        'Digest': f'sha-256={b64}',
+        'Repr-Digest': f'sha-256=:{b64}:',
+    }
+
+
+# -- content-addressed deduplication -----------------------------------------------
+
+class DedupStore:
+    """Hardlink identical artifacts to one copy, keyed by SHA-256.
+
+    ``store_dir`` must be on the same filesystem as the artifacts. A store entry
+    whose link count drops to 1 is no longer used by any artifact and is pruned.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+
+    def _entry(self, sha256: str) -> str:
+        return os.path.join(self.store_dir, sha256[:2], sha256)
+
+    def link(self, path: str, digests: Dict[str, Any]) -> bool:
+        """Replace path with a hardlink to an identical stored copy, or register it as that copy.
+
+        Returns True if path now shares its data with an earlier artifact.
+        """
+        entry = self._entry(digests['sha256'])
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(entry), exist_ok=True)
+                if os.path.exists(entry):
+                    if os.path.samefile(entry, path):
+                        return True
+                    if os.path.getsize(entry) != digests['size']:
+                        # corrupt store entry: replace it with this verified copy
+                        os.remove(entry)
+                    else:
+                        tmp = path + '.dedup.tmp'
+                        os.link(entry, tmp)
+                        os.replace(tmp, path)
+                        write_digests(path, digests)
+                        return True
+                os.link(path, entry)
+            except OSError:
+                # e.g. cross-device or no hardlink support: keep the plain file
+                return False
+        return False
+
+    def prune(self) -> int:
+        removed = 0
+        if not os.path.isdir(self.store_dir):
+            return 0
+        with self._lock:
+            for root, _dirs, files in os.walk(self.store_dir):
+                for name in files:
+                    entry = os.path.join(root, name)
+                    try:
+                        if os.stat(entry).st_nlink <= 1:
+                            os.remove(entry)
+                            removed += 1
+                    except OSError:
+                        pass
+        return removed
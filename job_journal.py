@@ -0,0 +1,239 @@
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List, Set
+
+# Phases a job can be in when the process dies; these are resumed on startup
+ACTIVE_PHASES = ('queued', 'downloading', 'postprocessing')
+FINISHED_PHASES = ('done', 'failed', 'cancelled')
+MAX_RESUME_ATTEMPTS = 3
+
+
+def _node_id() -> str:
+    # Hostname plus PID namespace: containers sharing a hostname must not judge each other's PIDs
+    try:
+        ns = os.readlink('/proc/self/ns/pid')
+    except OSError:
+        return socket.gethostname()
+    return f"{socket.gethostname()}/{''.join(c for c in ns if c.isdigit())}"
+
+
+NODE_ID = _node_id()
+OWNER_ID = f'{NODE_ID}:{os.getpid()}:{int(time.time())}'
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == 'nt':
+        return True  # os.kill would terminate it; rely on the lease instead
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def owner_gone(owner: str | None) -> bool:
+    """True when owner is a process on this node that no longer exists."""
+    node, _, rest = (owner or '').partition(':')
+    pid = rest.partition(':')[0]
+    if node != NODE_ID or not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    return not _pid_alive(int(pid))
+
+
+class JobJournal:
+    """Write-ahead journal of download jobs in SQLite.
+
+    Every job is recorded before it is queued (parameters, owner, working dir)
+    and its phase is updated as it moves through downloading, post-processing
+    and completion. After a restart, jobs still in an active phase are claimed
+    by exactly one process and re-run in the same working dir, so yt-dlp picks
+    up its ``.part``/``.ytdl`` files and finished fragments; completed jobs are
+    re-registered so their artifacts can still be delivered.
+
+    Active jobs are leases: their owner refreshes ``updated_at`` with
+    heartbeat(), and another process only takes a job over once that lease is
+    ``lease_sec`` old, or right away when the owner is a dead PID on the same node.
+    """
+
+    def __init__(self, path: str, lease_sec: float = 60.0):
+        self.path = path
+        self.lease_sec = lease_sec
+        conn = self._conn()
+        try:
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                client TEXT,
+                priority TEXT,
+                cost REAL,
+                work_dir TEXT,
+                phase TEXT NOT NULL,
+                result_path TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_phase ON jobs (phase)')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL;')
+        conn.execute('PRAGMA synchronous=NORMAL;')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _execute(self, sql: str, args: tuple) -> int:
+        conn = self._conn()
+        try:
+            cur = conn.execute(sql, args)
+            conn.commit()
+            return cur.rowcount
+        finally:
+            conn.close()
+
+    def record(self, job: Any) -> None:
+        """Journal a newly submitted job (call before it is queued)."""
+        now = time.time()
+        self._execute(
+            'INSERT OR REPLACE INTO jobs (id, params, client, priority, cost, work_dir, phase, attempts, owner, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?)',
+            (job.id, json.dumps(job.params), job.client, job.priority, job.cost, job.work_dir,
+             'queued', OWNER_ID, job.submitted_at or now, now),
+        )
+
+    def set_phase(self, job_id: str, phase: str, **fields: Any) -> None:
+        allowed = {'work_dir', 'result_path', 'error'}
+        cols = ['phase = ?', 'updated_at = ?']
+        args: List[Any] = [phase, time.time()]
+        for key, value in fields.items():
+            if key in allowed:
+                cols.append(f'{key} = ?')
+                args.append(value)
+        if phase == 'downloading':
+            cols.append('attempts = attempts + 1')
+        args.append(job_id)
+        self._execute(f'UPDATE jobs SET {", ".join(cols)} WHERE id = ?', tuple(args))
+
+    def set_cost(self, job_id: str, cost: float) -> None:
+        self._execute('UPDATE jobs SET cost = ? WHERE id = ?', (cost, job_id))
+
+    def drop_param(self, name: str) -> int:
+        """Remove a parameter from every journaled job, e.g. a secret older versions stored."""
+        conn = self._conn()
+        try:
+            rows = conn.execute('SELECT id, params FROM jobs WHERE params LIKE ?', (f'%"{name}"%',)).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            params = json.loads(row['params'])
+            params.pop(name, None)
+            self._execute('UPDATE jobs SET params = ? WHERE id = ?', (json.dumps(params), row['id']))
+        return len(rows)
+
+    def rename_client(self, old: str, new: str) -> int:
+        """Re-key every job of one client, e.g. to replace an identifier older versions stored."""
+        return self._execute('UPDATE jobs SET client = ? WHERE client = ?', (new, old))
+
+    def load(self, job_id: str) -> Dict[str, Any] | None:
+        conn = self._conn()
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            return self._row(row) if row else None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict[str, Any]:
+        data = dict(row)
+        data['params'] = json.loads(data['params'])
+        return data
+
+    def heartbeat(self) -> int:
+        """Renew the lease on every active job this process owns."""
+        return self._execute(
+            f'UPDATE jobs SET updated_at = ? WHERE owner = ? AND phase IN ({",".join("?" * len(ACTIVE_PHASES))})',
+            (time.time(), OWNER_ID, *ACTIVE_PHASES),
+        )
+
+    def claim_interrupted(self) -> List[Dict[str, Any]]:
+        """Take ownership of jobs left in an active phase by a dead process.
+
+        Jobs of live siblings (other workers or nodes sharing the journal) keep
+        renewing their lease and are left alone. The conditional UPDATE, which
+        also checks the lease was not renewed in the meantime, makes each claim
+        atomic, so each job is resumed by exactly one process.
+        Jobs that already crashed the server MAX_RESUME_ATTEMPTS times are failed.
+        """
+        conn = self._conn()
+        try:
+            rows = conn.execute(
+                f'SELECT * FROM jobs WHERE phase IN ({",".join("?" * len(ACTIVE_PHASES))}) AND owner != ?',
+                (*ACTIVE_PHASES, OWNER_ID),
+            ).fetchall()
+        finally:
+            conn.close()
+        claimed = []
+        now = time.time()
+        for row in rows:
+            if now - row['updated_at'] < self.lease_sec and not owner_gone(row['owner']):
+                continue
+            if row['attempts'] >= MAX_RESUME_ATTEMPTS:
+                self._execute('UPDATE jobs SET phase = ?, error = ?, updated_at = ? WHERE id = ? AND owner = ? AND updated_at = ?',
+                              ('failed', 'Interrupted too many times', time.time(), row['id'], row['owner'], row['updated_at']))
+                continue
+            won = self._execute('UPDATE jobs SET owner = ?, phase = ?, updated_at = ? WHERE id = ? AND owner = ? AND updated_at = ?',
+                                (OWNER_ID, 'queued', time.time(), row['id'], row['owner'], row['updated_at']))
+            if won:
+                claimed.append(self._row(row))
+        return claimed
+
+    def active_ids(self) -> Set[str]:
+        """Ids of jobs some process still owns or will resume."""
+        conn = self._conn()
+        try:
+            rows = conn.execute(f'SELECT id FROM jobs WHERE phase IN ({",".join("?" * len(ACTIVE_PHASES))})',
+                                ACTIVE_PHASES).fetchall()
+            return {row['id'] for row in rows}
+        finally:
+            conn.close()
+
+    def completed(self, since: float = 0.0) -> List[Dict[str, Any]]:
+        conn = self._conn()
+        try:
+            rows = conn.execute('SELECT * FROM jobs WHERE phase = ? AND updated_at >= ?', ('done', since)).fetchall()
+            return [self._row(r) for r in rows]
+        finally:
+            conn.close()
+
+    def purge(self, older_than: float, on_purge: Callable[[Dict[str, Any]], None] | None = None) -> int:
+        """Delete finished jobs (and their working dirs) last updated before older_than.
+
+        on_purge is called with each job row first, e.g. to drop copies kept elsewhere.
+        """
+        conn = self._conn()
+        try:
+            rows = conn.execute(f'SELECT * FROM jobs WHERE phase IN ({",".join("?" * len(FINISHED_PHASES))}) AND updated_at < ?',
+                                (*FINISHED_PHASES, older_than)).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            if on_purge is not None:
+                try:
+                    on_purge(self._row(row))
+                except Exception:
+                    pass
+            if row['work_dir']:
+                shutil.rmtree(row['work_dir'], ignore_errors=True)
+            self._execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+        return len(rows)
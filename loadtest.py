@@ -0,0 +1,357 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from typing import Any, Dict, List
+from urllib.parse import quote, urlparse
+
+SERVE_MODES = ('threaded', 'processes', 'async')
+
+
+# -- fake yt-dlp -----------------------------------------------------------------------
+
+class FakeDownloadError(Exception):
+    pass
+
+
+class FakeDownloadCancelled(Exception):
+    pass
+
+
+class FakeYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL inside the app under test.
+
+    Extraction sleeps FAKE_YTDLP_EXTRACT_MS; a download writes FAKE_YTDLP_BYTES
+    at FAKE_YTDLP_BPS (bytes/s, 0 = as fast as possible) in chunks, calling the
+    progress and postprocessor hooks the way yt-dlp does, so the app's own
+    hooks, pacing and file handling run for real.
+    """
+
+    def __init__(self, params: Dict[str, Any] | None = None, auto_init: bool = True):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_info_extractor(self, ie):
+        pass
+
+    def extract_info(self, url, download=True, process=True, ie_key=None, **kwargs):
+        time.sleep(float(os.environ.get('FAKE_YTDLP_EXTRACT_MS', '150')) / 1000)
+        video_id = url.rstrip('/')[-11:]
+        info = {
+            'id': video_id, 'title': f'Load {video_id}', 'duration': 120, 'uploader': 'Load Test',
+            'thumbnail': None, 'age_limit': 0,
+            'formats': [
+                {'format_id': '136', 'ext': 'mp4', 'height': 720, 'fps': 30, 'vcodec': 'avc1.4d401f',
+                 'acodec': 'none', 'tbr': 1500, 'filesize': 22_500_000},
+                {'format_id': '137', 'ext': 'mp4', 'height': 1080, 'fps': 30, 'vcodec': 'avc1.640028',
+                 'acodec': 'none', 'tbr': 4000, 'filesize': 60_000_000},
+                {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'tbr': 128,
+                 'abr': 128, 'filesize': 1_920_000},
+            ],
+        }
+        if download:
+            self._download(info)
+        return info
+
+    def download(self, urls):
+        for url in urls:
+            self.extract_info(url, download=True)
+        return 0
+
+    def _download(self, info):
+        total = int(os.environ.get('FAKE_YTDLP_BYTES', str(5 * 1024 * 1024)))
+        rate = float(os.environ.get('FAKE_YTDLP_BPS', '0'))
+        outtmpl = self.params.get('outtmpl')
+        outtmpl = outtmpl.get('default') if isinstance(outtmpl, dict) else outtmpl
+        paths = self.params.get('paths') or {}
+        if outtmpl and os.path.isabs(outtmpl):
+            home = temp = os.path.dirname(outtmpl)
+        else:
+            home = paths.get('home') or tempfile.gettempdir()
+            temp = paths.get('temp') or home
+        audio = any(pp.get('key') == 'FFmpegExtractAudio' for pp in self.params.get('postprocessors') or [])
+        ext = 'mp3' if audio else 'mp4'
+        tmp_path = os.path.join(temp, f'{info["id"]}.{ext}')
+        hooks = self.params.get('progress_hooks') or []
+        chunk = bytes(256 * 1024)
+        started = time.monotonic()
+        written = 0
+        with open(tmp_path + '.part', 'wb') as f:
+            while written < total:
+                n = min(len(chunk), total - written)
+                f.write(chunk[:n])
+                written += n
+                for hook in hooks:
+                    hook({'status': 'downloading', 'downloaded_bytes': written, 'total_bytes': total,
+                          'filename': tmp_path, 'tmpfilename': tmp_path + '.part', 'info_dict': info,
+                          '_speed_str': 'N/A', '_eta_str': 'N/A'})
+                if rate:
+                    ahead = written / rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        os.replace(tmp_path + '.part', tmp_path)
+        for hook in hooks:
+            hook({'status': 'finished', 'downloaded_bytes': total, 'total_bytes': total,
+                  'filename': tmp_path, 'info_dict': info})
+        final = os.path.join(home, os.path.basename(tmp_path))
+        for hook in self.params.get('postprocessor_hooks') or []:
+            hook({'status': 'started', 'postprocessor': 'MoveFiles', 'info_dict': dict(info, filepath=tmp_path)})
+        if final != tmp_path:
+            os.replace(tmp_path, final)
+        for hook in self.params.get('postprocessor_hooks') or []:
+            hook({'status': 'finished', 'postprocessor': 'MoveFiles', 'info_dict': dict(info, filepath=final)})
+        info['filepath'] = final
+        info['requested_downloads'] = [{'filepath': final}]
+        for hook in self.params.get('post_hooks') or []:
+            hook(final)
+
+
+def install_fake_ytdlp() -> None:
+    """Make `import yt_dlp` (and yt_dlp.utils) resolve to the fake, before the app is imported."""
+    module = types.ModuleType('yt_dlp')
+    utils = types.ModuleType('yt_dlp.utils')
+    utils.DownloadError = FakeDownloadError
+    utils.DownloadCancelled = FakeDownloadCancelled
+    module.YoutubeDL = FakeYoutubeDL
+    module.utils = utils
+    sys.modules['yt_dlp'] = module
+    sys.modules['yt_dlp.utils'] = utils
+
+
+# -- server side -----------------------------------------------------------------------
+
+def serve_app(mode: str, port: int, workers: int) -> None:
+    install_fake_ytdlp()
+    os.environ.setdefault('RATE_LIMIT_MAX', '1000000000')
+    os.environ.setdefault('RATE_LIMIT_COOLDOWN_SEC', '0')
+    os.environ.setdefault('JOBS_DIR', tempfile.mkdtemp(prefix='loadtest-jobs-'))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if mode == 'async':
+        import web_app_async
+        web_app_async.app.run(host='127.0.0.1', port=port, use_reloader=False)
+        return
+    import web_app2
+    web_app2.init_db()
+    if mode == 'processes':
+        web_app2.app.run(host='127.0.0.1', port=port, threaded=False, processes=workers, use_reloader=False)
+    else:
+        web_app2.app.run(host='127.0.0.1', port=port, threaded=True, use_reloader=False)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode: str, workers: int, env: Dict[str, str]) -> tuple:
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port),
+                             '--workers', str(workers)], env=dict(os.environ, **env),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/jobs')
+            conn.getresponse().read()
+            return proc, f'http://127.0.0.1:{port}'
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f'{mode} server exited with code {proc.returncode}')
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{mode} server did not come up')
+
+
+# -- load generator --------------------------------------------------------------------
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """'info=5,progress=3,download=1' -> normalised weights."""
+    weights = {}
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in ENDPOINTS:
+            raise ValueError(f'Unknown endpoint in mix: {name}')
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    return {k: v / total for k, v in weights.items() if v > 0}
+
+
+def _video_url(rng: random.Random, videos: int) -> str:
+    return f'https://www.youtube.com/watch?v={rng.randrange(videos):011d}'
+
+
+def _req_info(rng, videos):
+    return 'GET', f'/info?url={quote(_video_url(rng, videos))}', None
+
+
+def _req_progress(rng, videos):
+    return 'GET', f'/progress?url={quote(_video_url(rng, videos))}', None
+
+
+def _req_download(rng, videos):
+    body = {'url': _video_url(rng, videos), 'format': rng.choice(['audio', 'video']),
+            'quality': '720', 'fps': '30', 'audioQuality': '192'}
+    return 'POST', '/download', json.dumps(body)
+
+
+ENDPOINTS = {'info': _req_info, 'progress': _req_progress, 'download': _req_download}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float | None:
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def run_load(target: str, users: int, duration: float, think: float, mix: Dict[str, float],
+             videos: int, ramp_up: float = 0.0, timeout: float = 120.0, seed: int = 1) -> Dict[str, Any]:
+    """Closed-loop load: each user sends a request, waits for the reply, thinks, repeats."""
+    parsed = urlparse(target)
+    names, weights = list(mix), list(mix.values())
+    samples: Dict[str, List[tuple]] = {name: [] for name in names}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + ramp_up + duration
+
+    def user(n: int):
+        rng = random.Random(seed * 10007 + n)
+        time.sleep(ramp_up * n / max(1, users))
+        conn = None
+        while time.monotonic() < stop_at:
+            name = rng.choices(names, weights)[0]
+            method, path, body = ENDPOINTS[name](rng, videos)
+            headers = {'Content-Type': 'application/json'} if body else {}
+            started = time.perf_counter()
+            ok = False
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=timeout)
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                payload = resp.read()
+                ok = resp.status < 400 and not (resp.headers.get_content_type() == 'application/json'
+                                                and b'"error"' in payload[:200])
+                if resp.will_close:
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                if conn is not None:
+                    conn.close()
+                conn = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples[name].append((elapsed, ok))
+            if think > 0:
+                time.sleep(rng.expovariate(1 / think))
+
+    threads = [threading.Thread(target=user, args=(n,), daemon=True) for n in range(users)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout + ramp_up + duration)
+    wall = time.monotonic() - started
+
+    report = {}
+    for name, rows in list(samples.items()) + [('all', [r for rows in samples.values() for r in rows])]:
+        latencies = sorted(r[0] for r in rows)
+        errors = sum(1 for r in rows if not r[1])
+        report[name] = {
+            'requests': len(rows),
+            'throughput_rps': round(len(rows) / wall, 2) if wall else None,
+            'error_rate': round(errors / len(rows), 4) if rows else None,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1) if rows else None,
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1) if rows else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1) if rows else None,
+            'max_ms': round(latencies[-1] * 1000, 1) if rows else None,
+        }
+    return report
+
+
+def print_report(title: str, report: Dict[str, Any]) -> None:
+    print(f'\n{title}')
+    print(f'{"endpoint":10} {"requests":>9} {"rps":>8} {"errors":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for name, row in report.items():
+        if not row['requests']:
+            continue
+        print(f'{name:10} {row["requests"]:>9} {row["throughput_rps"]:>8} {row["error_rate"]:>7.1%} '
+              f'{row["p50_ms"]:>8} {row["p95_ms"]:>8} {row["p99_ms"]:>8}')
+
+
+def print_comparison(modes: Dict[str, Dict[str, Any]]) -> None:
+    print(f'\n{"mode":12} {"rps":>8} {"errors":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for mode, report in modes.items():
+        row = report['all']
+        if row['requests']:
+            print(f'{mode:12} {row["throughput_rps"]:>8} {row["error_rate"]:>7.1%} '
+                  f'{row["p50_ms"]:>8} {row["p95_ms"]:>8} {row["p99_ms"]:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test web_app2 with a fake yt-dlp')
+    parser.add_argument('--modes', default='threaded', help=f'Comma-separated serving modes to compare: {", ".join(SERVE_MODES)}')
+    parser.add_argument('--target', help='Load an already running server instead of starting one')
+    parser.add_argument('-u', '--users', type=int, default=20, help='Concurrent users (default: 20)')
+    parser.add_argument('-d', '--duration', type=float, default=30, help='Seconds of load per mode (default: 30)')
+    parser.add_argument('--ramp-up', type=float, default=2, help='Seconds to start all users (default: 2)')
+    parser.add_argument('--think', type=float, default=0.5, help='Mean think time between requests in seconds (default: 0.5)')
+    parser.add_argument('--mix', default='info=5,progress=3,download=1', help='Request mix weights')
+    parser.add_argument('--videos', type=int, default=200, help='Distinct video ids (controls metadata cache hits)')
+    parser.add_argument('--workers', type=int, default=4, help='Processes for the processes mode (default: 4)')
+    parser.add_argument('--extract-ms', type=float, default=150, help='Simulated extraction latency (default: 150)')
+    parser.add_argument('--download-bytes', type=int, default=5 * 1024 * 1024, help='Simulated download size')
+    parser.add_argument('--download-bps', type=float, default=20e6, help='Simulated download speed, 0 = unlimited')
+    parser.add_argument('-o', '--output', help='Write the report as JSON')
+    parser.add_argument('--serve', choices=SERVE_MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_app(args.serve, args.port, args.workers)
+        return
+
+    mix = parse_mix(args.mix)
+    fake_env = {'FAKE_YTDLP_EXTRACT_MS': str(args.extract_ms), 'FAKE_YTDLP_BYTES': str(args.download_bytes),
+                'FAKE_YTDLP_BPS': str(args.download_bps)}
+    load = dict(users=args.users, duration=args.duration, think=args.think, mix=mix,
+                videos=args.videos, ramp_up=args.ramp_up)
+    results: Dict[str, Any] = {'config': dict(load, mix=args.mix, **fake_env), 'modes': {}}
+    if args.target:
+        results['modes']['target'] = run_load(args.target, **load)
+        print_report(args.target, results['modes']['target'])
+    else:
+        for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+            if mode not in SERVE_MODES:
+                parser.error(f'unknown mode: {mode}')
+            proc, target = start_server(mode, args.workers, fake_env)
+            try:
+                results['modes'][mode] = run_load(target, **load)
+            finally:
+                proc.terminate()
+                proc.wait(10)
+            print_report(f'{mode} ({args.users} users, {args.duration:g}s)', results['modes'][mode])
+        if len(results['modes']) > 1:
+            print_comparison(results['modes'])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+import os
+import re
+import hashlib
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List
+from downloader import is_throttle_error
+from upstream_health import UpstreamHealth, UPSTREAM
+from proxy_pool import ProxyPool, read_proxy_file
+import tracing
+
+if TYPE_CHECKING:
+    from yt_dlp import YoutubeDL
+
+# Fields kept per format; everything else in the yt-dlp format dict (urls, headers, fragments) is dropped
+LADDER_FIELDS = (
+    'format_id', 'ext', 'protocol', 'width', 'height', 'fps', 'vcodec', 'acodec',
+    'tbr', 'vbr', 'abr', 'asr', 'filesize', 'filesize_approx', 'format_note',
+)
+
+HARVEST_YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'noplaylist': True,
+    'no_color': True,
+}
+
+
+def video_id_from_url(url: str) -> str | None:
+    """Extract the 11-character YouTube id from watch, youtu.be, shorts and embed URLs."""
+    match = re.search(r"(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([\w-]{11})(?:[?&#/]|$)", url or '')
+    return match.group(1) if match else None
+
+
+# yt-dlp options that make an extraction see what a signed-in user sees
+CREDENTIAL_OPTS = ('cookiefile', 'cookiesfrombrowser', 'username', 'password', 'usenetrc', 'netrc_location', 'netrc_cmd')
+
+
+def cache_key(url: str, ydl_opts: Dict[str, Any] | None = None, video_id: str | None = None) -> str:
+    """Cache key for url; extractions made with credentials get their own namespace.
+
+    An authenticated result (age-gated or members-only formats) must never be
+    served to an anonymous caller, nor an anonymous one to a signed-in caller.
+    """
+    key = video_id or video_id_from_url(url) or url
+    creds = {k: v for k, v in (ydl_opts or {}).items() if k in CREDENTIAL_OPTS and v}
+    if creds:
+        digest = hashlib.sha256(json.dumps(creds, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+        key = f'{key}@auth-{digest}'
+    return key
+
+
+def compact_metadata(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Reduce a full yt-dlp info dict to the fields the front ends and analytics use."""
+    return {
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'uploader': info.get('uploader'),
+        'duration': info.get('duration'),
+        'thumbnail': info.get('thumbnail'),
+        'age_limit': info.get('age_limit') or 0,
+        'webpage_url': info.get('webpage_url'),
+        'formats': [
+            {k: f.get(k) for k in LADDER_FIELDS if f.get(k) is not None}
+            for f in (info.get('formats') or []) if f
+        ],
+    }
+
+
+class MetadataCache:
+    """Thread-safe LRU of compact metadata keyed by video id, with TTL and an optional on-disk JSON tier."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, disk_dir: str | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[str, tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, re.sub(r'[^\w-]', '_', key) + '.json')
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                if now - os.path.getmtime(path) < self.ttl:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        value = json.load(f)
+                    self._remember(key, value, os.path.getmtime(path))
+                    with self._lock:
+                        self.hits += 1
+                    return value
+            except (OSError, ValueError):
+                pass
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key: str, value: Dict[str, Any], stored_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        self._remember(key, value, time.time())
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp = path + '.tmp'
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(value, f)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+METADATA_CACHE = MetadataCache(
+    max_entries=int(os.environ.get('METADATA_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('METADATA_CACHE_TTL', '3600')),
+    disk_dir=os.environ.get('METADATA_CACHE_DIR') or None,
+)
+
+_thread_local = threading.local()
+
+
+def _thread_ydl(ydl_opts: Dict[str, Any] | None) -> 'YoutubeDL':
+    # Building a YoutubeDL loads every extractor class; reuse one instance per worker thread and option set
+    key = json.dumps(ydl_opts or {}, sort_keys=True, default=str)
+    instances = getattr(_thread_local, 'ydls', None)
+    if instances is None:
+        instances = _thread_local.ydls = OrderedDict()
+    ydl = instances.get(key)
+    if ydl is None:
+        from yt_dlp import YoutubeDL  # deferred: importing yt-dlp is most of an entry point's startup time
+        ydl = instances[key] = YoutubeDL({**HARVEST_YDL_OPTS, **(ydl_opts or {})})
+        while len(instances) > 16:
+            instances.popitem(last=False)
+    return ydl
+
+
+def _extract(url: str, ydl_opts: Dict[str, Any] | None, proxies: ProxyPool | None) -> Dict[str, Any]:
+    if not proxies:
+        return _thread_ydl(ydl_opts).extract_info(url, download=False)
+    with proxies.lease() as proxy:
+        opts = {**(ydl_opts or {}), 'proxy': proxy.url} if proxy else ydl_opts
+        return _thread_ydl(opts).extract_info(url, download=False)
+
+
+def get_metadata(url: str, ydl_opts: Dict[str, Any] | None = None, cache: MetadataCache | None = METADATA_CACHE,
+                 upstream: UpstreamHealth | None = None, timeout: float | None = None,
+                 proxies: ProxyPool | None = None) -> Dict[str, Any]:
+    """Return compact metadata for url, extracting with yt-dlp only on a cache miss.
+
+    When upstream is given, the extraction waits for a slot from it (up to timeout);
+    when proxies is given, it goes out through the pool's pick.
+    """
+    key = cache_key(url, ydl_opts)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            tracing.current_span().event('metadata.cache_hit', key=key)
+            return cached
+    with tracing.span('metadata.extract', url=url, proxied=bool(proxies)):
+        if upstream is not None:
+            with upstream.slot(timeout):
+                info = _extract(url, ydl_opts, proxies)
+        else:
+            info = _extract(url, ydl_opts, proxies)
+    if not info:
+        raise ValueError(f'No metadata returned for {url}')
+    meta = compact_metadata(info)
+    if cache is not None:
+        cache.put(key, meta)
+        id_key = cache_key(url, ydl_opts, meta['id']) if meta.get('id') else None
+        if id_key and id_key != key:
+            cache.put(id_key, meta)
+    return meta
+
+
+def _harvest_one(url: str, upstream: UpstreamHealth, ydl_opts: Dict[str, Any] | None,
+                 cache: MetadataCache | None, max_attempts: int, proxies: ProxyPool | None,
+                 acquire_timeout: float | None = None) -> Dict[str, Any]:
+    started = time.time()
+    key = cache_key(url, ydl_opts)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return {'url': url, 'status': 'ok', 'cached': True, 'elapsed_sec': 0.0, **cached}
+    last_error = None
+    for _ in range(max_attempts):
+        if not upstream.acquire(acquire_timeout):
+            return {'url': url, 'status': 'error', 'error': 'Upstream is busy or throttling; try again later',
+                    'throttled': True, 'elapsed_sec': round(time.time() - started, 3)}
+        error = None
+        try:
+            meta = get_metadata(url, ydl_opts, cache, proxies=proxies)
+            return {'url': url, 'status': 'ok', 'cached': False,
+                    'elapsed_sec': round(time.time() - started, 3), **meta}
+        except Exception as e:
+            error = last_error = e
+            if not is_throttle_error(e):
+                break
+        finally:
+            upstream.release(error)
+    return {'url': url, 'status': 'error', 'error': str(last_error),
+            'throttled': is_throttle_error(last_error) if last_error else False,
+            'elapsed_sec': round(time.time() - started, 3)}
+
+
+def iter_harvest(urls: Iterable[str], concurrency: int = 16, ydl_opts: Dict[str, Any] | None = None,
+                 cache: MetadataCache | None = METADATA_CACHE, max_attempts: int = 4,
+                 upstream: UpstreamHealth | None = None, proxies: ProxyPool | None = None,
+                 acquire_timeout: float | None = None) -> Iterator[Dict[str, Any]]:
+    """Yield one metadata record per URL in completion order.
+
+    Only a bounded window of URLs is in flight, so this works on arbitrarily long
+    inputs and stops submitting work as soon as the consumer stops iterating.
+    Extractions go through the shared upstream health controller, which backs
+    off and narrows concurrency when upstream throttles. With acquire_timeout,
+    a URL that waits longer than that for a slot is reported as an error
+    instead of waiting indefinitely.
+    """
+    upstream = upstream or UPSTREAM
+    url_iter = iter(urls)
+    window = max(1, concurrency) * 2
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    in_flight = set()
+    try:
+        for url in url_iter:
+            in_flight.add(executor.submit(_harvest_one, url, upstream, ydl_opts, cache, max_attempts, proxies,
+                                          acquire_timeout))
+            if len(in_flight) < window:
+                continue
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def harvest_to_jsonl(urls: List[str], out_path: str, concurrency: int = 16, ydl_opts: Dict[str, Any] | None = None,
+                     cache: MetadataCache | None = METADATA_CACHE,
+                     on_record: Callable[[Dict[str, Any]], None] | None = None,
+                     upstream: UpstreamHealth | None = None, proxies: ProxyPool | None = None) -> Dict[str, int]:
+    """Harvest metadata for urls and append each record to out_path as soon as it completes."""
+    counts = {'ok': 0, 'error': 0}
+    with open(out_path, 'a', encoding='utf-8') as out:
+        for record in iter_harvest(urls, concurrency, ydl_opts, cache, upstream=upstream, proxies=proxies):
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+            if on_record:
+                on_record(record)
+    return counts
+
+
+def _already_harvested(out_path: str) -> set:
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get('status') == 'ok' and rec.get('url'):
+                done.add(rec['url'])
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Harvest YouTube metadata (no downloads) to JSONL")
+    parser.add_argument("urls", help="File with one URL per line")
+    parser.add_argument("-o", "--output", default="metadata.jsonl", help="JSONL output file (appended; default: metadata.jsonl)")
+    parser.add_argument("-j", "--concurrency", type=int, default=16, help="Maximum concurrent extractions (default: 16)")
+    parser.add_argument("--cache-dir", help="Directory for the on-disk metadata cache")
+    parser.add_argument("--proxies", metavar="FILE", help="File with one proxy URL per line (http://, socks5://) to spread requests across")
+    args = parser.parse_args()
+
+    with open(args.urls, 'r', encoding='utf-8') as f:
+        urls = [u.strip() for u in f if u.strip() and not u.startswith('#')]
+    done = _already_harvested(args.output)
+    urls = [u for u in dict.fromkeys(urls) if u not in done]
+    cache = MetadataCache(max_entries=4096, disk_dir=args.cache_dir) if args.cache_dir else METADATA_CACHE
+
+    started = time.time()
+    seen = {'n': 0}
+
+    def report(_record):
+        seen['n'] += 1
+        elapsed = max(time.time() - started, 1e-6)
+        print(f"\r{seen['n']}/{len(urls)} ({seen['n'] * 60 / elapsed:.0f}/min)", end='', flush=True)
+
+    print(f"Harvesting {len(urls)} URLs ({len(done)} already in {args.output}) with up to {args.concurrency} workers")
+    # The CLI owns the whole upstream budget, so its controller starts at the requested concurrency
+    upstream = UpstreamHealth(max_concurrency=args.concurrency, base_delay=1.0, max_delay=60.0)
+    proxies = ProxyPool(read_proxy_file(args.proxies)) if args.proxies else None
+    counts = harvest_to_jsonl(urls, args.output, args.concurrency, cache=cache, on_record=report,
+                              upstream=upstream, proxies=proxies)
+    print(f"\nDone: {counts.get('ok', 0)} ok, {counts.get('error', 0)} errors in {time.time() - started:.1f}s")
+    sys.exit(0 if not counts.get('error') else 1)
+
+
+if __name__ == "__main__":
+    main()
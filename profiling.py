@@ -0,0 +1,186 @@
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN', '')
+MAX_CAPTURE_SEC = float(os.environ.get('DEBUG_PROFILE_MAX_SEC', '60'))
+MIN_INTERVAL_SEC = 0.001
+
+# Leaf frames of threads parked in a wait; dropped with skip_idle so the profile shows work, not waiting
+_IDLE_LEAVES = {
+    ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('queue.py', 'get'),
+    ('selectors.py', 'select'), ('socketserver.py', 'serve_forever'), ('socket.py', 'accept'),
+    ('socket.py', 'readinto'), ('base_events.py', '_run_once'), ('thread.py', '_worker'),
+}
+
+# One capture at a time per process: a second request gets ProfilerBusy instead of doubling the overhead
+_capture_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def debug_enabled() -> bool:
+    return bool(DEBUG_TOKEN)
+
+
+def check_token(supplied: str | None) -> bool:
+    """Constant-time check of a debug token (X-Debug-Token or 'Authorization: Bearer ...')."""
+    if not DEBUG_TOKEN or not supplied:
+        return False
+    if supplied.startswith('Bearer '):
+        supplied = supplied[len('Bearer '):]
+    return hmac.compare_digest(supplied.encode('utf-8'), DEBUG_TOKEN.encode('utf-8'))
+
+
+def clamp_seconds(value: Any, default: float) -> float:
+    try:
+        seconds = float(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        seconds = default
+    return max(0.1, min(seconds, MAX_CAPTURE_SEC))
+
+
+def _label(code, cache: Dict[Any, str]) -> str:
+    label = cache.get(code)
+    if label is None:
+        name = getattr(code, 'co_qualname', code.co_name)
+        label = cache[code] = f'{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ',')
+    return label
+
+
+def sample_stacks(seconds: float, interval: float = 0.005, skip_idle: bool = False) -> Dict[str, Any]:
+    """Sample every thread's Python stack from sys._current_frames() for `seconds`.
+
+    Runs on the calling thread and only reads frames, so the sampled threads are
+    never stopped or traced; the cost is one walk of each stack per interval.
+    Returns collapsed stacks (root first, thread name as the root frame) with counts.
+    """
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusy('A profile or memory capture is already running')
+    try:
+        interval = max(MIN_INTERVAL_SEC, interval)
+        me = threading.get_ident()
+        labels: Dict[Any, str] = {}
+        stacks: Counter = Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                if skip_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame.f_code, labels))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f'thread-{ident}').replace(';', ','))
+                stacks[';'.join(reversed(stack))] += 1
+            # drop frame references right away so sampled frames are not kept alive
+            frames = frame = None
+            samples += 1
+            time.sleep(interval)
+        return {
+            'samples': samples,
+            'elapsed_sec': round(time.monotonic() - started, 3),
+            'interval_sec': interval,
+            'stacks': stacks,
+        }
+    finally:
+        _capture_lock.release()
+
+
+def collapsed(profile: Dict[str, Any]) -> str:
+    """Brendan Gregg's collapsed-stack format: flamegraph.pl, speedscope and inferno read it directly."""
+    return ''.join(f'{stack} {count}\n' for stack, count in profile['stacks'].most_common())
+
+
+def process_memory() -> Dict[str, Any]:
+    info: Dict[str, Any] = {}
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            info['rss_bytes'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        info['open_fds'] = len(os.listdir('/proc/self/fd'))
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        scale = 1 if sys.platform == 'darwin' else 1024
+        info['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    info['threads'] = threading.active_count()
+    return info
+
+
+def _stat_entry(stat, key_type: str) -> Dict[str, Any]:
+    frame = stat.traceback[0]
+    entry = {
+        'file': frame.filename,
+        'line': frame.lineno,
+        'size_diff_bytes': stat.size_diff,
+        'size_bytes': stat.size,
+        'count_diff': stat.count_diff,
+        'count': stat.count,
+    }
+    if key_type == 'traceback':
+        entry['traceback'] = [f'{f.filename}:{f.lineno}' for f in stat.traceback]
+    return entry
+
+
+def memory_diff(seconds: float, top: int = 25, key_type: str = 'lineno', nframes: int = 10) -> Dict[str, Any]:
+    """Top allocation growth between two tracemalloc snapshots taken `seconds` apart.
+
+    tracemalloc is switched on only for the capture window (unless it was already
+    running, e.g. PYTHONTRACEMALLOC), so normal traffic pays nothing for it.
+    Memory allocated before the window is not attributed; growth during it is.
+    """
+    if key_type not in ('lineno', 'filename', 'traceback'):
+        raise ValueError(f'Unknown key type: {key_type}')
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusy('A profile or memory capture is already running')
+    started_here = not tracemalloc.is_tracing()
+    try:
+        if started_here:
+            tracemalloc.start(max(1, nframes) if key_type == 'traceback' else 1)
+        before_mem = process_memory()
+        first = tracemalloc.take_snapshot()
+        time.sleep(seconds)
+        second = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        ignore = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ]
+        stats = second.filter_traces(ignore).compare_to(first.filter_traces(ignore), key_type)
+    finally:
+        if started_here:
+            tracemalloc.stop()
+        _capture_lock.release()
+    growth: List[Any] = [s for s in stats if s.size_diff > 0][:top]
+    return {
+        'seconds': seconds,
+        'key_type': key_type,
+        'tracemalloc_started_for_capture': started_here,
+        'traced_bytes': traced,
+        'traced_peak_bytes': peak,
+        'process_before': before_mem,
+        'process_after': process_memory(),
+        'top_growth': [_stat_entry(s, key_type) for s in growth],
+        'total_growth_bytes': sum(s.size_diff for s in stats),
+    }
@@ -0,0 +1,261 @@
+import os
+import socket
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+from urllib.parse import urlparse
+from downloader import is_throttle_error
+
+# Errors that say something about the route (proxy or our IP), not about the video
+_ROUTE_ERROR_MARKERS = (
+    'timed out', 'timeout', 'connection refused', 'connection reset', 'proxy', 'tunnel',
+    'unable to connect', 'network is unreachable', 'remote end closed', 'eof occurred',
+)
+
+
+def is_route_error(err: BaseException | str) -> bool:
+    msg = str(err).lower()
+    return is_throttle_error(msg) or any(marker in msg for marker in _ROUTE_ERROR_MARKERS)
+
+
+class Proxy:
+    """One egress route with its live load and outcome counters."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.active = 0
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self.healthy = True
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.last_error: str | None = None
+        self.last_check: float | None = None
+        self.check_latency: float | None = None
+
+    def success_rate(self) -> float:
+        # Laplace-smoothed so new proxies are neither favoured nor shunned
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def throughput(self) -> float | None:
+        return self.bytes / self.busy_seconds if self.busy_seconds > 0 else None
+
+    def add_bytes(self, nbytes: int) -> None:
+        if nbytes > 0:
+            self.bytes += nbytes
+
+    def progress_hook(self) -> Any:
+        """A yt-dlp progress hook that counts bytes downloaded through this proxy."""
+        last = {}
+
+        def hook(d):
+            if d.get('status') not in ('downloading', 'finished'):
+                return
+            key = d.get('tmpfilename') or d.get('filename')
+            downloaded = d.get('downloaded_bytes') or 0
+            self.add_bytes(downloaded - last.get(key, 0))
+            last[key] = downloaded
+        return hook
+
+    def to_dict(self) -> Dict[str, Any]:
+        parsed = urlparse(self.url)
+        return {
+            # never expose proxy credentials
+            'proxy': f'{parsed.scheme}://{parsed.hostname}:{parsed.port}',
+            'healthy': self.healthy,
+            'active': self.active,
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'success_rate': round(self.success_rate(), 3),
+            'bytes': self.bytes,
+            'throughput_bps': round(self.throughput() or 0.0, 1),
+            'ejections': self.ejections,
+            'ejected_for_sec': max(0.0, round(self.ejected_until - time.monotonic(), 1)),
+            'check_latency_sec': self.check_latency,
+            'last_error': self.last_error,
+        }
+
+
+class ProxyPool:
+    """Spreads yt-dlp traffic across HTTP/SOCKS proxies.
+
+    Selection is ``least_loaded`` (fewest active jobs, then best success rate) or
+    ``success_rate``. A proxy is ejected after ``eject_after`` consecutive route
+    failures (throttling, timeouts, refused connections) or a failed active
+    health check, and is re-admitted once a health check passes again after
+    ``eject_seconds``. An empty pool hands out ``None`` (direct connection).
+    """
+
+    def __init__(self, urls: List[str], strategy: str = 'least_loaded',
+                 check_url: str = 'https://www.youtube.com/generate_204', check_interval: float = 30.0,
+                 eject_after: int = 3, eject_seconds: float = 60.0, timeout: float = 5.0):
+        if strategy not in ('least_loaded', 'success_rate'):
+            raise ValueError(f'Unknown proxy strategy: {strategy}')
+        self.proxies = [Proxy(u) for u in urls]
+        self.strategy = strategy
+        self.check_url = check_url
+        self.check_interval = check_interval
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._checker: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls) -> 'ProxyPool':
+        urls = [u.strip() for u in os.environ.get('EGRESS_PROXIES', '').split(',') if u.strip()]
+        proxy_file = os.environ.get('EGRESS_PROXIES_FILE')
+        if proxy_file and os.path.exists(proxy_file):
+            urls += read_proxy_file(proxy_file)
+        return cls(
+            urls,
+            strategy=os.environ.get('PROXY_STRATEGY', 'least_loaded'),
+            check_url=os.environ.get('PROXY_CHECK_URL', 'https://www.youtube.com/generate_204'),
+            check_interval=float(os.environ.get('PROXY_CHECK_INTERVAL_SEC', '30')),
+            eject_after=int(os.environ.get('PROXY_EJECT_AFTER', '3')),
+            eject_seconds=float(os.environ.get('PROXY_EJECT_SEC', '60')),
+        )
+
+    def __len__(self) -> int:
+        return len(self.proxies)
+
+    def pick(self) -> Proxy | None:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [p for p in self.proxies if p.healthy and p.ejected_until <= now]
+            if not candidates:
+                # Everything ejected: fall back to the least-bad proxy instead of failing the job
+                candidates = [p for p in self.proxies if p.healthy] or self.proxies
+            if not candidates:
+                return None
+            if self.strategy == 'success_rate':
+                best = max(candidates, key=lambda p: (p.success_rate(), -p.active))
+            else:
+                best = min(candidates, key=lambda p: (p.active, -p.success_rate()))
+            best.active += 1
+            best.requests += 1
+            return best
+
+    def report(self, proxy: Proxy, error: BaseException | str | None = None, busy_seconds: float = 0.0) -> None:
+        with self._lock:
+            proxy.active = max(0, proxy.active - 1)
+            proxy.busy_seconds += busy_seconds
+            if error is None:
+                proxy.successes += 1
+                proxy.consecutive_failures = 0
+                return
+            if not is_route_error(error):
+                # e.g. "video unavailable": not the proxy's fault
+                return
+            proxy.failures += 1
+            proxy.consecutive_failures += 1
+            proxy.last_error = str(error)[:300]
+            if proxy.consecutive_failures >= self.eject_after:
+                self._eject(proxy)
+
+    def _eject(self, proxy: Proxy) -> None:
+        # caller holds self._lock
+        if proxy.healthy:
+            proxy.ejections += 1
+        proxy.healthy = False
+        proxy.ejected_until = time.monotonic() + self.eject_seconds
+
+    @contextmanager
+    def lease(self) -> Iterator[Proxy | None]:
+        """Yield the proxy to use (None = direct) and record the outcome of the work done through it."""
+        if self.proxies:
+            self.start_health_checks()
+        proxy = self.pick()
+        if proxy is None:
+            yield None
+            return
+        started = time.monotonic()
+        try:
+            yield proxy
+        except BaseException as e:
+            self.report(proxy, e, time.monotonic() - started)
+            raise
+        else:
+            self.report(proxy, None, time.monotonic() - started)
+
+    # -- active health checks ------------------------------------------------------
+
+    def check(self, proxy: Proxy) -> bool:
+        started = time.monotonic()
+        try:
+            scheme = urlparse(proxy.url).scheme
+            if scheme.startswith('socks'):
+                _socks5_handshake(proxy.url, self.timeout)
+            else:
+                opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': proxy.url, 'https': proxy.url}))
+                with opener.open(self.check_url, timeout=self.timeout) as resp:
+                    if resp.status >= 400:
+                        raise OSError(f'health check returned HTTP {resp.status}')
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, e
+        with self._lock:
+            proxy.last_check = time.time()
+            proxy.check_latency = round(time.monotonic() - started, 3)
+            if ok:
+                if not proxy.healthy and proxy.ejected_until <= time.monotonic():
+                    proxy.healthy = True
+                    proxy.consecutive_failures = 0
+            else:
+                proxy.last_error = f'health check: {error}'[:300]
+                self._eject(proxy)
+        return ok
+
+    def check_all(self) -> None:
+        for proxy in list(self.proxies):
+            self.check(proxy)
+
+    def _check_loop(self) -> None:
+        while not self._stop.is_set():
+            self.check_all()
+            self._stop.wait(self.check_interval)
+
+    def start_health_checks(self) -> None:
+        with self._lock:
+            if self._checker is not None or not self.proxies or self.check_interval <= 0:
+                return
+            self._checker = threading.Thread(target=self._check_loop, name='proxy-health', daemon=True)
+            self._checker.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'strategy': self.strategy,
+                'healthy': sum(1 for p in self.proxies if p.healthy),
+                'total': len(self.proxies),
+                'proxies': [p.to_dict() for p in self.proxies],
+            }
+
+
+def _socks5_handshake(url: str, timeout: float) -> None:
+    """Minimal liveness check for a SOCKS5 proxy: connect and negotiate 'no auth' or 'user/pass'."""
+    parsed = urlparse(url)
+    with socket.create_connection((parsed.hostname, parsed.port or 1080), timeout=timeout) as sock:
+        sock.sendall(b'\x05\x02\x00\x02')
+        reply = sock.recv(2)
+        if len(reply) != 2 or reply[0] != 5 or reply[1] == 0xFF:
+            raise OSError('SOCKS5 handshake rejected')
+
+
+def read_proxy_file(path: str) -> List[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+PROXIES = ProxyPool.from_env()
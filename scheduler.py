@@ -0,0 +1,351 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List
+from downloader import FormatTable
+from format_select import select_format, select_audio_format
+
+# Relative service weights per priority class (higher = served sooner / larger share)
+PRIORITY_WEIGHTS = {'high': 4.0, 'normal': 1.0, 'low': 0.25}
+
+# Rough bitrates (bits/s) used when yt-dlp reports neither sizes nor bitrates
+_NOMINAL_VIDEO_BPS = {2160: 20e6, 1440: 10e6, 1080: 5e6, 720: 2.5e6, 480: 1.2e6, 360: 0.7e6}
+_NOMINAL_AUDIO_BPS = 160e3
+# MP3 encoding costs CPU time roughly proportional to duration; expressed as equivalent bytes per second of audio
+MP3_ENCODE_COST_PER_SEC = 20_000
+
+
+def parse_priority_classes(spec: str, valid_keys: List[str]) -> Dict[str, str]:
+    """Parse 'key1:high,key2:low' into {key: class}. Valid keys without an entry are 'normal'."""
+    classes = {k: 'normal' for k in valid_keys}
+    for item in (spec or '').split(','):
+        key, _, cls = item.strip().partition(':')
+        if key and cls.strip() in PRIORITY_WEIGHTS:
+            classes[key] = cls.strip()
+    return classes
+
+
+def predict_job_cost(meta: Dict[str, Any], params: Dict[str, Any]) -> float:
+    """Predicted work for a download job, in bytes, from the format ladder and duration."""
+    duration = float(meta.get('duration') or 0)
+    table = FormatTable.from_formats(meta.get('formats') or [], duration or None)
+    if params.get('format') == 'audio':
+        selection = select_audio_format(table)
+        size = selection.get('predicted_bytes') or duration * _NOMINAL_AUDIO_BPS / 8
+        return size + duration * MP3_ENCODE_COST_PER_SEC
+    try:
+        max_height = int(params.get('quality') or 0) or None
+        max_fps = float(params.get('fps') or 0) or None
+    except (TypeError, ValueError):
+        max_height, max_fps = None, None
+    selection = select_format(table, max_height=max_height, max_fps=max_fps)
+    if selection.get('predicted_bytes'):
+        return selection['predicted_bytes']
+    height = selection.get('height') or max_height or 1080
+    nominal = next((bps for h, bps in sorted(_NOMINAL_VIDEO_BPS.items()) if height <= h), _NOMINAL_VIDEO_BPS[2160])
+    return duration * (nominal + _NOMINAL_AUDIO_BPS) / 8
+
+
+class Job:
+    """A queued unit of work with its predicted cost, owner and outcome."""
+
+    def __init__(self, params: Dict[str, Any], client: str, priority: str = 'normal',
+                 cost: float | None = None, job_id: str | None = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.params = params
+        self.client = client
+        self.priority = priority if priority in PRIORITY_WEIGHTS else 'normal'
+        self.cost = float(cost or 0)
+        self.status = 'queued'
+        self.progress = 0.0
+        self.speed = None
+        self.eta = None
+        self.result_path: str | None = None
+        self.error: str | None = None
+        self.work_dir: str | None = None
+        self.submitted_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self._done = threading.Event()
+        self._cancel = threading.Event()
+        self._gate_release: Callable[[BaseException | None], None] | None = None
+        self._callbacks: List[Callable[['Job'], None]] = []
+        self._callbacks_lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def release_gate(self, error: BaseException | None = None) -> None:
+        """Give the scheduler's admission slot back before the job ends; later calls do nothing.
+
+        For a job whose gated part (e.g. talking to the upstream) is over long before
+        the rest of its work is.
+        """
+        with self._callbacks_lock:
+            release, self._gate_release = self._gate_release, None
+        if release is not None:
+            release(error)
+
+    def request_cancel(self) -> None:
+        """Ask a running job to stop; the runner polls cancel_requested and raises."""
+        self._cancel.set()
+
+    def add_done_callback(self, fn: Callable[['Job'], None]) -> None:
+        """Call fn(job) once the job finishes (right away if it already has), like a future.
+
+        Runs on the thread that finishes the job, so fn must be quick and must not block
+        (e.g. ``loop.call_soon_threadsafe`` to wake an asyncio waiter).
+        """
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _mark_done(self) -> None:
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                pass
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'priority': self.priority,
+            'cost_bytes': int(self.cost),
+            'progress': round(self.progress, 1),
+            'speed': self.speed,
+            'eta': self.eta,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobScheduler:
+    """Worker pool that serves jobs by predicted cost instead of arrival order.
+
+    Policies:
+      * ``sjf`` - shortest (cheapest) job first, cost divided by the priority
+        weight, with aging: every second a job waits earns it ``aging_rate``
+        bytes of credit, so a large job is eventually served even under a
+        constant stream of small ones. Because the credit grows at the same
+        rate for every queued job, the ordering key is static
+        (cost / weight + aging_rate * submitted_at) and a heap suffices.
+      * ``wfq`` - weighted fair queuing across clients (self-clocked): each
+        client's jobs get finish tags cost / weight after the client's previous
+        tag, so one client's backlog cannot monopolise the workers.
+    """
+
+    def __init__(self, runner: Callable[[Job], None], workers: int = 2, policy: str = 'sjf',
+                 aging_rate: float = 8 * 1024 * 1024, history: int = 1000, gate: Any = None,
+                 on_finish: Callable[[Job], None] | None = None):
+        if policy not in ('sjf', 'wfq', 'fifo'):
+            raise ValueError(f'Unknown scheduling policy: {policy}')
+        self.runner = runner
+        # Optional admission gate (acquire/release(error)/release_unused), e.g. the upstream health controller:
+        # while it holds workers back, jobs simply stay queued. A runner may hand the slot back early
+        # with job.release_gate(); otherwise it is released when the job ends
+        self.gate = gate
+        # Called (outside the lock) once a job is done, failed or cancelled, e.g. to notify its owner
+        self.on_finish = on_finish
+        self.policy = policy
+        self.aging_rate = aging_rate
+        self.workers = max(1, workers)
+        self.history = history
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._jobs: Dict[str, Job] = {}
+        self._finished_order: List[str] = []
+        self._virtual_time = 0.0
+        self._epoch = time.time()
+        self._client_finish: Dict[str, float] = {}
+        self._running = 0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._completed = 0
+        self._completion_time_total = 0.0
+
+    def start(self) -> 'JobScheduler':
+        with self._cond:
+            if self._threads:
+                return self
+            for n in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f'job-worker-{n}', daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def _key(self, job: Job) -> float:
+        weight = PRIORITY_WEIGHTS[job.priority]
+        if self.policy == 'fifo':
+            return job.submitted_at
+        if self.policy == 'wfq':
+            start = max(self._virtual_time, self._client_finish.get(job.client, 0.0))
+            finish = start + job.cost / weight
+            self._client_finish[job.client] = finish
+            return finish
+        return job.cost / weight + self.aging_rate * (job.submitted_at - self._epoch)
+
+    def submit(self, job: Job) -> Job:
+        with self._cond:
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (self._key(job), next(self._seq), job))
+            self._cond.notify()
+        return job
+
+    def update_cost(self, job_id: str, cost: float) -> bool:
+        """Replace a job's predicted cost, e.g. once it has been estimated in the background.
+
+        A still-queued job is re-keyed under sjf; wfq finish tags are fixed at
+        submission, so there only the reported cost changes.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.cost = float(cost or 0)
+            if self.policy == 'sjf':
+                for idx, (_key, seq, queued) in enumerate(self._heap):
+                    if queued is job:
+                        self._heap[idx] = (self._key(job), seq, job)
+                        heapq.heapify(self._heap)
+                        break
+        return True
+
+    def typical_cost(self, default: float) -> float:
+        """Median predicted cost of known jobs: a neutral stand-in while a job's own cost is unknown."""
+        with self._cond:
+            costs = sorted(j.cost for j in self._jobs.values() if j.cost > 0)
+        return costs[len(costs) // 2] if costs else default
+
+    def restore(self, job: Job) -> Job:
+        """Register an already finished job (e.g. recovered from a journal) so it can be looked up."""
+        with self._cond:
+            self._jobs[job.id] = job
+            self._finished_order.append(job.id)
+            while len(self._finished_order) > self.history:
+                self._jobs.pop(self._finished_order.pop(0), None)
+            job._mark_done()
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job_id: str) -> int | None:
+        with self._cond:
+            ordered = sorted(self._heap)
+            for pos, (_key, _seq, job) in enumerate(ordered):
+                if job.id == job_id:
+                    return pos
+        return None
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not started yet."""
+        with self._cond:
+            for idx, (_key, _seq, job) in enumerate(self._heap):
+                if job.id == job_id:
+                    self._heap.pop(idx)
+                    heapq.heapify(self._heap)
+                    self._finish(job, 'cancelled', 'Cancelled before start')
+                    break
+            else:
+                return False
+        self._notify_finished(job)
+        return True
+
+    def _notify_finished(self, job: Job) -> None:
+        if self.on_finish is None:
+            return
+        try:
+            self.on_finish(job)
+        except Exception:
+            pass
+
+    def _finish(self, job: Job, status: str, error: str | None = None) -> None:
+        # caller holds self._cond
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        if status == 'done':
+            self._completed += 1
+            self._completion_time_total += job.finished_at - job.submitted_at
+        self._finished_order.append(job.id)
+        while len(self._finished_order) > self.history:
+            self._jobs.pop(self._finished_order.pop(0), None)
+        job._mark_done()
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+            if self.gate is not None:
+                self.gate.acquire()
+            with self._cond:
+                if not self._heap:
+                    # another worker took it while we waited for the gate
+                    if self.gate is not None:
+                        self.gate.release_unused()
+                    continue
+                key, _seq, job = heapq.heappop(self._heap)
+                if self.policy == 'wfq':
+                    self._virtual_time = key
+                self._running += 1
+                job.status = 'running'
+                job.started_at = time.time()
+                if self.gate is not None:
+                    job._gate_release = self.gate.release
+            status, error, exc = 'done', None, None
+            try:
+                self.runner(job)
+            except Exception as e:
+                status, error, exc = ('cancelled' if job.cancel_requested else 'failed'), str(e), e
+            # No-op when the runner already released it
+            job.release_gate(exc)
+            with self._cond:
+                self._running -= 1
+                self._finish(job, status, error)
+            self._notify_finished(job)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'policy': self.policy,
+                'workers': self.workers,
+                'running': self._running,
+                'queued': len(self._heap),
+                'queued_bytes': int(sum(j.cost for _k, _s, j in self._heap)),
+                'completed': self._completed,
+                'mean_completion_sec': round(self._completion_time_total / self._completed, 2) if self._completed else None,
+            }
+
+
+def scheduler_from_env(runner: Callable[[Job], None], gate: Any = None,
+                       on_finish: Callable[[Job], None] | None = None) -> JobScheduler:
+    return JobScheduler(
+        runner,
+        gate=gate,
+        on_finish=on_finish,
+        workers=int(os.environ.get('MAX_CONCURRENT_JOBS', '2')),
+        policy=os.environ.get('SCHED_POLICY', 'sjf'),
+        aging_rate=float(os.environ.get('SCHED_AGING_BYTES_PER_SEC', str(8 * 1024 * 1024))),
+    )
@@ -0,0 +1,142 @@
+import os
+import shutil
+import threading
+from typing import Any, Callable, Dict, Iterable, Set
+
+# Fragments + intermediate streams + the merged output can all exist at once
+_MERGE_OVERHEAD = 2.2
+
+
+class ScratchSpace:
+    """RAM-backed staging area (tmpfs, /dev/shm) for yt-dlp's temporary files.
+
+    A job gets a scratch dir only if its predicted size (times the merge
+    overhead) fits both the per-job limit and what is left of the global
+    budget, and the filesystem actually has that much free. Otherwise it
+    spills to disk and stages next to its output as before. Fragments,
+    ``.fNNN`` streams and the ffmpeg merge all happen in the scratch dir and
+    only the final file is moved to the job dir (yt-dlp's ``paths``: temp vs home).
+    """
+
+    def __init__(self, root: str | None, budget_bytes: int = 0, job_max_bytes: int = 0,
+                 overhead: float = _MERGE_OVERHEAD):
+        self.root = root
+        self.budget = max(0, budget_bytes)
+        self.job_max = job_max_bytes or budget_bytes
+        self.overhead = overhead
+        self._reserved: Dict[str, int] = {}
+        self._overrun: Set[str] = set()
+        self._lock = threading.Lock()
+        self.staged = 0
+        self.spilled = 0
+        self.overruns = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root) and self.budget > 0
+
+    def reserve(self, job_id: str, predicted_bytes: float | None) -> str | None:
+        """A scratch dir for the job, or None when it should stage on disk.
+
+        predicted_bytes is the expected download size, None when it is not known.
+        """
+        if not self.enabled:
+            return None
+        need = int((predicted_bytes or 0) * self.overhead)
+        with self._lock:
+            if job_id in self._reserved:
+                return os.path.join(self.root, job_id)
+            try:
+                os.makedirs(self.root, exist_ok=True)
+                free = shutil.disk_usage(self.root).free
+            except OSError:
+                free = 0
+            # unknown size (0) cannot be bounded, so it never gets RAM
+            if need <= 0 or need > self.job_max or need > self.budget - sum(self._reserved.values()) or need > free:
+                self.spilled += 1
+                spill = True
+            else:
+                self._reserved[job_id] = need
+                self.staged += 1
+                spill = False
+        path = os.path.join(self.root, job_id)
+        if spill:
+            # A resumed job may have staged here before the crash; it continues on disk instead
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def progress_hook(self, job_id: str) -> Callable[[Dict[str, Any]], None]:
+        """yt-dlp progress hook that stops the job once its bytes outgrow the reservation.
+
+        overrun(job_id) then tells the caller to release the scratch dir and download
+        again on disk. The merge writes another copy of what was downloaded, so the
+        downloaded bytes may only use half of the reservation.
+        """
+        written: Dict[str, int] = {}
+
+        def hook(d):
+            name = d.get('tmpfilename') or d.get('filename')
+            if d.get('status') != 'downloading' or not name:
+                return
+            written[name] = d.get('downloaded_bytes') or 0
+            with self._lock:
+                need = self._reserved.get(job_id)
+                if not need or sum(written.values()) * 2 <= need:
+                    return
+                if job_id not in self._overrun:
+                    self._overrun.add(job_id)
+                    self.overruns += 1
+            from yt_dlp.utils import DownloadCancelled
+            raise DownloadCancelled('Scratch reservation exceeded')
+        return hook
+
+    def overrun(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._overrun
+
+    def release(self, job_id: str) -> None:
+        with self._lock:
+            self._overrun.discard(job_id)
+            if self._reserved.pop(job_id, None) is None:
+                return
+        shutil.rmtree(os.path.join(self.root, job_id), ignore_errors=True)
+
+    def sweep(self, keep: Iterable[str]) -> int:
+        """Remove scratch dirs left by crashed processes: any not reserved here and not in keep."""
+        if not self.root or not os.path.isdir(self.root):
+            return 0
+        keep = set(keep)
+        with self._lock:
+            keep.update(self._reserved)
+        removed = 0
+        for name in os.listdir(self.root):
+            if name not in keep:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                removed += 1
+        return removed
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'root': self.root,
+                'budget_bytes': self.budget,
+                'reserved_bytes': sum(self._reserved.values()),
+                'jobs': len(self._reserved),
+                'staged_total': self.staged,
+                'spilled_total': self.spilled,
+                'overrun_total': self.overruns,
+            }
+
+
+def _default_root() -> str | None:
+    return '/dev/shm/yt-downloader' if os.path.isdir('/dev/shm') else None
+
+
+SCRATCH = ScratchSpace(
+    os.environ.get('SCRATCH_DIR') or _default_root(),
+    budget_bytes=int(float(os.environ.get('SCRATCH_BUDGET_MB', '0')) * 1024 * 1024),
+    job_max_bytes=int(float(os.environ.get('SCRATCH_JOB_MAX_MB', '0')) * 1024 * 1024),
+)
@@ -0,0 +1,267 @@
+import contextvars
+import glob
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from downloader import DownloadResult, human_size
+import tracing
+
+_task_ids = itertools.count(1)
+_DONE = ('finished', 'error', 'cancelled')
+
+
+def format_eta(d: Dict[str, Any]) -> str:
+    secs = d.get('eta')
+    if isinstance(secs, (int, float)) and secs >= 0:
+        return f"{int(secs) // 60:02d}:{int(secs) % 60:02d}"
+    return d.get('_eta_str') or d.get('eta_str') or 'N/A'
+
+
+def is_age_restricted(message: str) -> bool:
+    message = message.lower()
+    return 'sign in to confirm your age' in message or 'age-restricted' in message
+
+
+class SessionDownloads:
+    """Background yt-dlp downloads for one UI session (a Streamlit session or the desktop GUI).
+
+    Lives as long as the UI does, so in Streamlit it outlives script reruns:
+    widget interaction no longer aborts a running download. Worker threads never
+    touch the UI; their hooks only update the task dicts, which the UI reads via
+    snapshot() on its own schedule.
+
+    pause() stops a download at its next progress callback and keeps the partial
+    files, so resume() continues where it left off; cancel() also deletes them.
+    """
+
+    def __init__(self, workers: int = 3):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='ui-download')
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._opts: Dict[str, Dict[str, Any]] = {}
+        self._control: Dict[str, str] = {}
+        self._partials: Dict[str, set] = {}
+        self.closed = False
+
+    def submit(self, url: str, title: str, ydl_opts: Dict[str, Any]) -> str:
+        task_id = str(next(_task_ids))
+        with self._lock:
+            self._tasks[task_id] = {
+                'id': task_id,
+                'url': url,
+                'title': title,
+                'status': 'queued',
+                'percent': 0,
+                'eta': 'N/A',
+                'speed': '',
+                'path': None,
+                'error': None,
+                'age_restricted': False,
+                'submitted_at': time.time(),
+            }
+            self._opts[task_id] = dict(ydl_opts)
+        self._start(task_id)
+        return task_id
+
+    def _start(self, task_id: str) -> None:
+        # Carry the caller's trace context into the worker thread
+        ctx = contextvars.copy_context()
+        self._pool.submit(ctx.run, self._run, task_id, self._tasks[task_id]['url'], dict(self._opts[task_id]))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(task) for task in self._tasks.values()]
+
+    def active(self) -> bool:
+        with self._lock:
+            return any(task['status'] not in _DONE + ('paused',) for task in self._tasks.values())
+
+    def clear_finished(self) -> None:
+        with self._lock:
+            for task_id in [k for k, t in self._tasks.items() if t['status'] in _DONE]:
+                del self._tasks[task_id]
+                self._opts.pop(task_id, None)
+                self._control.pop(task_id, None)
+                self._partials.pop(task_id, None)
+
+    def pause(self, task_id: str) -> bool:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task['status'] in _DONE + ('paused',):
+                return False
+            self._control[task_id] = 'pause'
+            return True
+
+    def resume(self, task_id: str) -> bool:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task['status'] != 'paused':
+                return False
+            self._control.pop(task_id, None)
+            task.update(status='queued', speed='', error=None)
+        self._start(task_id)
+        return True
+
+    def cancel(self, task_id: str) -> bool:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task['status'] in _DONE:
+                return False
+            self._control[task_id] = 'cancel'
+            paused = task['status'] == 'paused'
+        if paused:
+            # No worker owns it any more, so clean up here
+            self._stopped(task_id, 'cancel')
+        return True
+
+    def shutdown(self) -> None:
+        """Cancel running and queued downloads and stop the pool without waiting for it.
+
+        Running downloads stop at their next progress callback and remove their
+        partial files; paused ones keep theirs for yt-dlp to continue later.
+        """
+        with self._lock:
+            self.closed = True
+            active = [k for k, t in self._tasks.items() if t['status'] not in _DONE + ('paused',)]
+            for task_id in active:
+                self._control[task_id] = 'cancel'
+                if self._tasks[task_id]['status'] == 'queued':
+                    # Its future is dropped below, so no worker will get to mark it
+                    self._tasks[task_id].update(status='cancelled', eta='N/A')
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _update(self, task_id: str, **fields: Any) -> None:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                task.update(fields)
+
+    def _stopped(self, task_id: str, action: str) -> None:
+        if action == 'cancel':
+            with self._lock:
+                partials = self._partials.pop(task_id, set())
+            for name in partials:
+                for leftover in [name, name + '.ytdl'] + glob.glob(glob.escape(name) + '-Frag*'):
+                    try:
+                        os.remove(leftover)
+                    except OSError:
+                        pass
+        self._update(task_id, status='cancelled' if action == 'cancel' else 'paused', speed='', eta='N/A')
+
+    def _run(self, task_id: str, url: str, ydl_opts: Dict[str, Any]) -> None:
+        def progress_hook(d):
+            action = self._control.get(task_id)
+            if action:
+                from yt_dlp.utils import DownloadCancelled
+                raise DownloadCancelled('Paused' if action == 'pause' else 'Cancelled')
+            with self._lock:
+                partials = self._partials.setdefault(task_id, set())
+                partials.update(name for name in (d.get('tmpfilename'), d.get('filename')) if name)
+            if d.get('status') == 'downloading':
+                total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+                downloaded = d.get('downloaded_bytes') or 0
+                percent = int(downloaded * 100 / total) if total else 0
+                speed = d.get('speed')
+                fields = {'status': 'downloading', 'percent': min(max(percent, 0), 100), 'eta': format_eta(d),
+                          'speed': f"{human_size(speed)}/s" if speed else ''}
+                title = (d.get('info_dict') or {}).get('title')
+                if title:
+                    fields['title'] = title
+                self._update(task_id, **fields)
+            elif d.get('status') == 'finished':
+                self._update(task_id, status='processing', percent=100, speed='')
+
+        def postprocessor_hook(d):
+            if d.get('status') == 'started':
+                self._update(task_id, status='post-processing')
+
+        if self._control.get(task_id):
+            # Paused or cancelled while still waiting for a worker
+            self._stopped(task_id, self._control[task_id])
+            return
+        ydl_opts['progress_hooks'] = list(ydl_opts.get('progress_hooks') or []) + [progress_hook]
+        ydl_opts['postprocessor_hooks'] = list(ydl_opts.get('postprocessor_hooks') or []) + [postprocessor_hook]
+        # Several tasks may share an output folder; each one learns its own file from yt-dlp's hooks
+        result = DownloadResult().attach(ydl_opts)
+        self._update(task_id, status='starting')
+        try:
+            with tracing.span('app.download', url=url, format=ydl_opts.get('format')):
+                tracing.instrument_ydl(ydl_opts)
+                # Imported on first use, in the worker, so the UI starts without it
+                from yt_dlp import YoutubeDL
+                with YoutubeDL(ydl_opts) as ydl:
+                    ydl.download([url])
+        except Exception as e:
+            if not self._control.get(task_id):
+                self._update(task_id, status='error', error=str(e), age_restricted=is_age_restricted(str(e)))
+                return
+        # yt-dlp may swallow DownloadCancelled and return normally; a request that
+        # arrives after the file is complete (post hooks ran) is ignored
+        action = self._control.get(task_id)
+        if action and not result.paths:
+            self._stopped(task_id, action)
+        elif result.path:
+            with self._lock:
+                self._partials.pop(task_id, None)
+            self._update(task_id, status='finished', percent=100, speed='', path=result.path)
+        else:
+            self._update(task_id, status='error', error='Could not find the downloaded file.')
+
+
+class SessionReaper:
+    """Shuts down the SessionDownloads of UI sessions that have ended.
+
+    Streamlit has no session-end callback, so a daemon thread polls
+    is_alive(session_id). A session that has been gone for ``grace`` seconds
+    (longer than a reconnect after a tab reload or network blip takes) has its
+    downloads cancelled and its worker pool stopped.
+    """
+
+    def __init__(self, is_alive: Callable[[str], bool], grace: float = 120.0, interval: float = 15.0):
+        self.is_alive = is_alive
+        self.grace = grace
+        self.interval = interval
+        self._sessions: Dict[str, SessionDownloads] = {}
+        self._gone_since: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, session_id: str, downloads: SessionDownloads) -> None:
+        with self._lock:
+            self._sessions[session_id] = downloads
+            self._gone_since.pop(session_id, None)
+
+    def reap(self) -> int:
+        """One pass; returns how many sessions were shut down."""
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.items())
+        ended = []
+        for session_id, downloads in sessions:
+            if self.is_alive(session_id):
+                self._gone_since.pop(session_id, None)
+            elif now - self._gone_since.setdefault(session_id, now) >= self.grace:
+                ended.append((session_id, downloads))
+        for session_id, downloads in ended:
+            with self._lock:
+                if self._sessions.get(session_id) is not downloads:
+                    continue  # re-registered meanwhile
+                del self._sessions[session_id]
+                self._gone_since.pop(session_id, None)
+            downloads.shutdown()
+        return len(ended)
+
+    def start(self) -> 'SessionReaper':
+        threading.Thread(target=self._loop, name='session-reaper', daemon=True).start()
+        return self
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reap()
+            except Exception:
+                pass
@@ -0,0 +1,182 @@
+import mimetypes
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict
+
+
+class ArtifactStore:
+    """Where finished artifacts are parked so any node can serve them.
+
+    ``put`` copies a local file under ``key``; ``url`` returns a URL clients can
+    be redirected to (None if the store can only be served through the app) and
+    ``local_path`` a path this node can send directly (None if remote).
+    """
+
+    name = 'base'
+
+    def put(self, path: str, key: str, digests: Dict[str, Any] | None = None) -> None:
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def url(self, key: str, filename: str | None = None) -> str | None:
+        return None
+
+    def local_path(self, key: str) -> str | None:
+        return None
+
+    def open(self, key: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class LocalStore(ArtifactStore):
+    """A directory, typically a shared mount (NFS, SMB) that every node can read."""
+
+    name = 'local'
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f'Invalid storage key: {key}')
+        return path
+
+    def put(self, path: str, key: str, digests: Dict[str, Any] | None = None) -> None:
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = dest + '.tmp'
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def local_path(self, key: str) -> str | None:
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), 'rb')
+
+    def delete(self, key: str) -> None:
+        path = self._path(key)
+        try:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+
+class S3Store(ArtifactStore):
+    """S3 or any S3-compatible service (MinIO, Ceph, R2, a local moto server via endpoint_url).
+
+    Files larger than ``part_size`` are sent as a multipart upload whose parts
+    are read straight from the file and uploaded by ``concurrency`` threads, so
+    memory use is bounded by concurrency * part_size whatever the file size.
+    Downloads are served by redirecting clients to presigned GET URLs, which
+    moves the egress off the app servers. boto3 is only needed when this
+    backend is used.
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: str | None = None, region: str | None = None,
+                 part_size: int = 16 * 1024 * 1024, concurrency: int = 8, presign_ttl: int = 900):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError('STORAGE_BACKEND=s3 requires boto3 (pip install boto3)') from e
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        # S3 rejects multipart parts under 5 MiB (except the last one)
+        self.part_size = max(5 * 1024 * 1024, part_size)
+        self.concurrency = max(1, concurrency)
+        self.presign_ttl = presign_ttl
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                   config=Config(max_pool_connections=self.concurrency + 2))
+
+    def _key(self, key: str) -> str:
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def put(self, path: str, key: str, digests: Dict[str, Any] | None = None) -> None:
+        size = os.path.getsize(path)
+        extra = {'ContentType': mimetypes.guess_type(path)[0] or 'application/octet-stream'}
+        if digests and digests.get('sha256'):
+            extra['Metadata'] = {'sha256': digests['sha256']}
+        if size <= self.part_size:
+            with open(path, 'rb') as f:
+                self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=f, **extra)
+            return
+        upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=self._key(key), **extra)
+        upload_id = upload['UploadId']
+
+        def send_part(number: int) -> Dict[str, Any]:
+            # each part is read and sent independently, so parts go out in parallel
+            with open(path, 'rb') as f:
+                f.seek((number - 1) * self.part_size)
+                body = f.read(self.part_size)
+            resp = self.client.upload_part(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                                           PartNumber=number, Body=body)
+            return {'PartNumber': number, 'ETag': resp['ETag']}
+
+        parts_total = (size + self.part_size - 1) // self.part_size
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, parts_total),
+                                    thread_name_prefix='s3-upload') as pool:
+                parts = list(pool.map(send_part, range(1, parts_total + 1)))
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                                                  MultipartUpload={'Parts': parts})
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id)
+            raise
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except Exception:
+            return False
+
+    def url(self, key: str, filename: str | None = None) -> str | None:
+        params = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if filename:
+            params['ResponseContentDisposition'] = f'attachment; filename="{filename}"'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.presign_ttl)
+
+    def open(self, key: str) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body']
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+def store_from_env() -> ArtifactStore | None:
+    """The configured artifact store, or None to keep artifacts only in the local job dirs."""
+    backend = os.environ.get('STORAGE_BACKEND', '').lower()
+    if not backend:
+        return None
+    if backend == 'local':
+        return LocalStore(os.environ.get('STORAGE_DIR') or os.path.join(os.path.dirname(__file__), 'artifacts'))
+    if backend == 's3':
+        return S3Store(
+            bucket=os.environ['S3_BUCKET'],
+            prefix=os.environ.get('S3_PREFIX', ''),
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+            region=os.environ.get('S3_REGION') or None,
+            part_size=int(float(os.environ.get('S3_PART_SIZE_MB', '16')) * 1024 * 1024),
+            concurrency=int(os.environ.get('S3_UPLOAD_CONCURRENCY', '8')),
+            presign_ttl=int(os.environ.get('S3_PRESIGN_TTL_SEC', '900')),
+        )
+    raise ValueError(f'Unknown STORAGE_BACKEND: {backend}')
@@ -0,0 +1,72 @@
+import pytest
+
+from bandwidth import BandwidthAllocator, max_min_shares
+
+
+def test_max_min_shares_water_fills():
+    # a only wants 10, so b and c split the remaining 90
+    assert max_min_shares(100, {'a': 10, 'b': None, 'c': None}) == {'a': 10, 'b': 45, 'c': 45}
+    # Everyone satisfied leaves the surplus unallocated
+    assert max_min_shares(100, {'a': 10, 'b': 20}) == {'a': 10, 'b': 20}
+    assert max_min_shares(90, {'a': None, 'b': None, 'c': None}) == {'a': 30, 'b': 30, 'c': 30}
+    # Demands met in rounds: 10 first, then 40 fits the new fair share of 45
+    assert max_min_shares(100, {'a': 10, 'b': 40, 'c': None}) == {'a': 10, 'b': 40, 'c': 50}
+    assert max_min_shares(100, {}) == {}
+
+
+def test_clients_share_equally_regardless_of_transfer_count():
+    link = BandwidthAllocator(1200, min_rate=1)
+    a1, a2, a3 = (link.acquire('a') for _ in range(3))
+    b = link.acquire('b')
+    assert b.rate == 600
+    assert [lease.rate for lease in (a1, a2, a3)] == [200, 200, 200]
+    clients = link.snapshot()['clients']
+    assert clients['a'] == {'transfers': 3, 'rate': 600, 'bytes': 0}
+    assert clients['b']['rate'] == 600
+
+
+def test_release_hands_the_share_back():
+    link = BandwidthAllocator(1000, min_rate=1)
+    a = link.acquire('a')
+    with link.acquire('b') as b:
+        assert a.rate == b.rate == 500
+    assert a.rate == 1000
+    assert link.snapshot()['transfers'] == 1
+
+
+def test_slow_transfer_surplus_goes_to_the_others():
+    link = BandwidthAllocator(1000, min_rate=1)
+    slow, fast = link.acquire('slow'), link.acquire('fast')
+    # Only manages 100 of its 500: it keeps 125 (with headroom) and fast gets the rest
+    slow.report_speed(100)
+    link.rebalance()
+    assert slow.rate == 125
+    assert fast.rate == 875
+
+
+def test_min_rate_floor_and_bound_params():
+    link = BandwidthAllocator(100, min_rate=40)
+    leases = [link.acquire(str(n)) for n in range(4)]
+    assert all(lease.rate == 40 for lease in leases)
+    params = {}
+    leases[0].bind_params(params)
+    assert params['ratelimit'] == 40
+    for lease in leases[1:]:
+        lease.release()
+    assert params['ratelimit'] == 100
+
+
+def test_disabled_allocator_does_not_shape():
+    link = BandwidthAllocator(0)
+    lease = link.acquire('a')
+    assert not link.enabled
+    assert lease.rate is None
+    assert lease.charge(10 * 1024 * 1024) == 0.0
+
+
+@pytest.mark.parametrize('nbytes, expected', [(50, 0.0), (150, 0.5)])
+def test_charge_returns_the_pause_owed(nbytes, expected):
+    lease = BandwidthAllocator(100, min_rate=1).acquire('a')
+    # Start with a full bucket of one second's worth of tokens
+    lease._tokens = 100.0
+    assert lease.charge(nbytes) == pytest.approx(expected, abs=0.01)
@@ -0,0 +1,41 @@
+import urllib.request
+
+import pytest
+
+from file_links import FileLinkServer, base_url_for, verify_token
+
+SECRET = b'test-secret'
+
+
+def test_base_url_defaults_to_loopback_only():
+    assert base_url_for('127.0.0.1', 8502, '') == 'http://127.0.0.1:8502'
+    assert base_url_for('::1', 8502, '') == 'http://[::1]:8502'
+    assert base_url_for('0.0.0.0', 8502, 'https://example.com/dl/') == 'https://example.com/dl'
+    for host in ('0.0.0.0', '::', '192.168.1.10', 'files.example.com'):
+        with pytest.raises(ValueError):
+            base_url_for(host, 8502, '')
+
+
+def test_public_bind_needs_a_base_url():
+    with pytest.raises(ValueError):
+        FileLinkServer('0.0.0.0', 0, SECRET, base_url='')
+    server = FileLinkServer('0.0.0.0', 0, SECRET, base_url='https://example.com/dl')
+    try:
+        assert server.link('/tmp/a b.mp4').startswith('https://example.com/dl/files/')
+    finally:
+        server.server_close()
+
+
+def test_signed_link_serves_ranges(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'0123456789')
+    server = FileLinkServer('127.0.0.1', 0, SECRET, base_url='').start()
+    try:
+        url = server.link(str(path))
+        assert url.startswith(f'http://127.0.0.1:{server.port}/files/')
+        assert verify_token(url.split('/')[-2], SECRET) == str(path)
+        with urllib.request.urlopen(urllib.request.Request(url, headers={'Range': 'bytes=2-4'})) as resp:
+            assert resp.status == 206
+            assert resp.read() == b'234'
+    finally:
+        server.stop()
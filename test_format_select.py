@@ -0,0 +1,108 @@
+import pytest
+
+from downloader import FormatTable
+from format_select import byte_budget, select_audio_format, select_format
+
+MB = 1_000_000
+
+
+def fmt(format_id, ext, vcodec='none', acodec='none', height=None, fps=None, tbr=None, abr=None, filesize=None):
+    return {'format_id': format_id, 'ext': ext, 'vcodec': vcodec, 'acodec': acodec, 'height': height,
+            'fps': fps, 'tbr': tbr, 'abr': abr, 'filesize': filesize}
+
+
+FORMATS = [
+    fmt('sb0', 'mhtml'),  # storyboard: dropped
+    fmt('18', 'mp4', 'avc1.42001E', 'mp4a.40.2', height=360, fps=30, tbr=600, filesize=9 * MB),
+    fmt('134', 'mp4', 'avc1.4d401e', height=360, fps=30, tbr=600, filesize=8 * MB),
+    fmt('136', 'mp4', 'avc1.4d401f', height=720, fps=30, tbr=1500, filesize=20 * MB),
+    fmt('247', 'webm', 'vp9', height=720, fps=30, tbr=1200, filesize=18 * MB),
+    fmt('137', 'mp4', 'avc1.640028', height=1080, fps=30, tbr=4000, filesize=50 * MB),
+    fmt('299', 'mp4', 'avc1.64002a', height=1080, fps=60, tbr=6000, filesize=80 * MB),
+    fmt('140', 'm4a', acodec='mp4a.40.2', abr=128, filesize=4 * MB),
+    fmt('139', 'm4a', acodec='mp4a.40.5', abr=48, filesize=1.5 * MB),
+    fmt('251', 'webm', acodec='opus', abr=160, filesize=5 * MB),
+]
+
+
+@pytest.fixture
+def table():
+    return FormatTable.from_formats(FORMATS, duration=600)
+
+
+def ids(table, rows):
+    return [table.ids[i] for i in rows]
+
+
+def test_table_indexes(table):
+    assert len(table) == 9
+    assert table.heights() == [1080, 720, 360]
+    assert table.fps_values() == [60, 30]
+    assert ids(table, table.by_height[720]) == ['136', '247']
+    assert set(ids(table, table.by_acodec['mp4a'])) == {'18', '140', '139'}
+    assert ids(table, table.by_size)[:2] == ['139', '140']
+    assert ids(table, table.video_rows(max_height=720)) == ['136', '247', '134']
+    assert ids(table, table.video_rows(max_height=720, include_progressive=True, ext='mp4')) == ['136', '18', '134']
+    assert ids(table, table.video_rows(max_fps=30, vcodec='avc1')) == ['137', '136', '134']
+    assert ids(table, table.audio_rows()) == ['251', '140', '139']
+
+
+def test_byte_budget_takes_the_tighter_limit():
+    budget, notes = byte_budget(max_bytes=30 * MB, bandwidth_bps=2_000_000, target_seconds=100)
+    assert budget == 25 * MB
+    assert len(notes) == 2
+    assert byte_budget() == (None, [])
+
+
+def test_no_budget_picks_the_best_pair(table):
+    result = select_format(table)
+    assert result['format'] == '299+140'
+    assert result['within_budget'] is None
+    assert result['needs_transcode'] is False
+
+
+def test_smaller_audio_buys_a_higher_height(table):
+    # 720p + 128k (24 MB) does not fit, but 720p + 48k (21.5 MB) does
+    result = select_format(table, max_bytes=22 * MB)
+    assert result['format'] == '136+139'
+    assert result['height'] == 720
+    assert result['predicted_bytes'] == 21.5 * MB
+    assert result['within_budget'] is True
+
+
+def test_best_audio_when_it_fits(table):
+    assert select_format(table, max_bytes=55 * MB)['format'] == '137+140'
+
+
+def test_height_and_fps_limits(table):
+    assert select_format(table, max_height=720)['format'] == '136+140'
+    assert select_format(table, max_fps=30)['format'] == '137+140'
+
+
+def test_bandwidth_deadline(table):
+    result = select_format(table, bandwidth_bps=8_000_000, target_seconds=30)
+    assert result['format'] == '136+140'
+    assert result['predicted_seconds'] == 24.0
+
+
+def test_transcode_preference(table):
+    assert select_format(table, max_height=720, container='webm')['format'] == '247+251'
+    # Without the preference codecs only break ties, after audio bitrate and size
+    relaxed = select_format(table, max_height=720, container='mp4', prefer_no_transcode=False)
+    assert relaxed['format'] == '247+251'
+    assert relaxed['needs_transcode'] is True
+
+
+def test_nothing_fits_returns_the_smallest_flagged(table):
+    result = select_format(table, max_bytes=1 * MB)
+    # The 9 MB progressive stream undercuts 360p video + 48k audio (9.5 MB)
+    assert result['format'] == '18'
+    assert result['within_budget'] is False
+
+
+def test_audio_selection_under_budget(table):
+    assert select_audio_format(table)['format'] == '251'
+    assert select_audio_format(table, max_bytes=4.5 * MB)['format'] == '140'
+    smallest = select_audio_format(table, max_bytes=1 * MB)
+    assert smallest['format'] == '139'
+    assert smallest['within_budget'] is False
@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+from integrity import DedupStore, IncrementalHasher, artifact_digests, hash_file, read_digests
+
+
+def simulate_download(hasher, path, data, chunk=1000, restart_at=None):
+    """Write data to path + '.part' the way yt-dlp does, calling the hook after every chunk."""
+    hook = hasher.progress_hook()
+    tmp = path + '.part'
+    with open(tmp, 'wb') as f:
+        for offset in range(0, len(data), chunk):
+            if offset == restart_at:
+                # Server ignored the range request: the file is truncated and written from the start
+                f.seek(0)
+                f.truncate()
+                for start in range(0, offset, chunk):
+                    f.write(data[start:start + chunk])
+                    f.flush()
+                    hook({'status': 'downloading', 'filename': path, 'tmpfilename': tmp})
+            f.write(data[offset:offset + chunk])
+            f.flush()
+            hook({'status': 'downloading', 'filename': path, 'tmpfilename': tmp})
+    os.replace(tmp, path)
+    hook({'status': 'finished', 'filename': path})
+
+
+def test_incremental_digests_match_hash_file(tmp_path):
+    data = os.urandom(25_000)
+    path = str(tmp_path / 'video.mp4')
+    hasher = IncrementalHasher()
+    simulate_download(hasher, path, data, chunk=3000)
+    digests = hasher.digests_for(path)
+    assert digests == hash_file(path)
+    assert digests['sha256'] == hashlib.sha256(data).hexdigest()
+    assert digests['size'] == len(data)
+
+
+def test_restarted_download_is_hashed_from_scratch(tmp_path):
+    data = os.urandom(10_000)
+    path = str(tmp_path / 'video.mp4')
+    hasher = IncrementalHasher()
+    simulate_download(hasher, path, data, restart_at=5000)
+    assert hasher.digests_for(path) == hash_file(path)
+
+
+def test_changed_or_moved_files(tmp_path):
+    staged = tmp_path / 'scratch' / 'video.mp4'
+    staged.parent.mkdir()
+    hasher = IncrementalHasher()
+    simulate_download(hasher, str(staged), b'abc' * 1000)
+    final = tmp_path / 'video.mp4'
+    os.replace(staged, final)
+    # Matched by name after being moved out of the staging directory
+    assert hasher.digests_for(str(final)) == hash_file(str(final))
+    final.write_bytes(b'merged by ffmpeg')
+    assert hasher.digests_for(str(final)) is None
+
+
+def test_artifact_digests_writes_and_trusts_the_sidecar(tmp_path):
+    path = tmp_path / 'clip.mp3'
+    path.write_bytes(b'audio')
+    digests = artifact_digests(str(path))
+    assert read_digests(str(path)) == digests
+    assert digests['sha256'] == hashlib.sha256(b'audio').hexdigest()
+    path.write_bytes(b'other audio')
+    assert read_digests(str(path)) is None
+
+
+def test_dedup_links_identical_artifacts(tmp_path):
+    store = DedupStore(str(tmp_path / 'store'))
+    first, second = tmp_path / 'a.mp4', tmp_path / 'b.mp4'
+    first.write_bytes(b'same bytes')
+    second.write_bytes(b'same bytes')
+    assert store.link(str(first), hash_file(str(first))) is False
+    assert store.link(str(second), hash_file(str(second))) is True
+    assert os.path.samefile(first, second)
+    first.unlink()
+    second.unlink()
+    assert store.prune() == 1
@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import job_journal
+from job_journal import JobJournal
+from scheduler import Job
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return JobJournal(str(tmp_path / 'journal.sqlite'), lease_sec=60)
+
+
+@pytest.fixture
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def record(journal, owner, age=0.0, phase='downloading', **params):
+    job = Job(dict(params, url='https://youtu.be/aaaaaaaaaaa'), client='1.2.3.4')
+    journal.record(job)
+    journal._execute('UPDATE jobs SET owner = ?, phase = ?, updated_at = ? WHERE id = ?',
+                     (owner, phase, time.time() - age, job.id))
+    return job.id
+
+
+def claimed_ids(journal):
+    return {row['id'] for row in journal.claim_interrupted()}
+
+
+def test_live_sibling_keeps_its_jobs(journal):
+    sibling = f'{job_journal.NODE_ID}:{os.getppid()}:1'
+    other_node = 'other-host/1:1234:1'
+    record(journal, sibling)
+    record(journal, other_node, age=5, phase='queued')
+    assert claimed_ids(journal) == set()
+
+
+def test_dead_pid_on_this_node_is_claimed_at_once(journal, dead_pid):
+    job_id = record(journal, f'{job_journal.NODE_ID}:{dead_pid}:1')
+    assert claimed_ids(journal) == {job_id}
+    row = journal.load(job_id)
+    assert row['owner'] == job_journal.OWNER_ID
+    assert row['phase'] == 'queued'
+
+
+def test_expired_lease_is_claimed_once(journal):
+    job_id = record(journal, 'other-host/1:1234:1', age=120)
+    assert claimed_ids(journal) == {job_id}
+    assert claimed_ids(journal) == set()
+
+
+def test_heartbeat_renews_only_own_active_jobs(journal):
+    mine = record(journal, job_journal.OWNER_ID, age=300)
+    done = record(journal, job_journal.OWNER_ID, age=300, phase='done')
+    theirs = record(journal, 'other-host/1:1234:1', age=300)
+    assert journal.heartbeat() == 1
+    assert time.time() - journal.load(mine)['updated_at'] < 5
+    assert time.time() - journal.load(done)['updated_at'] > 250
+    assert time.time() - journal.load(theirs)['updated_at'] > 250
+
+
+def test_lease_renewed_after_read_is_not_claimed(journal, monkeypatch):
+    job_id = record(journal, 'other-host/1:1234:1', age=120)
+    real_execute = journal._execute
+
+    def renew_first(sql, args):
+        if sql.startswith('UPDATE jobs SET owner'):
+            # The owner heartbeats between our SELECT and our conditional UPDATE
+            real_execute('UPDATE jobs SET updated_at = ? WHERE id = ?', (time.time(), job_id))
+        return real_execute(sql, args)
+
+    monkeypatch.setattr(journal, '_execute', renew_first)
+    assert claimed_ids(journal) == set()
+    assert journal.load(job_id)['owner'] == 'other-host/1:1234:1'
+
+
+def test_too_many_attempts_fails_the_job(journal):
+    job_id = record(journal, 'other-host/1:1234:1', age=120)
+    journal._execute('UPDATE jobs SET attempts = ? WHERE id = ?', (job_journal.MAX_RESUME_ATTEMPTS, job_id))
+    assert claimed_ids(journal) == set()
+    assert journal.load(job_id)['phase'] == 'failed'
+
+
+def test_rename_client_rekeys_only_that_client(journal):
+    mine = record(journal, job_journal.OWNER_ID)
+    journal._execute('UPDATE jobs SET client = ? WHERE id = ?', ('secret-key', mine))
+    other = record(journal, job_journal.OWNER_ID)
+    assert journal.rename_client('secret-key', 'key-0123') == 1
+    assert journal.load(mine)['client'] == 'key-0123'
+    assert journal.load(other)['client'] == '1.2.3.4'
+
+
+def test_cancelled_jobs_are_neither_claimed_nor_kept(journal):
+    job_id = record(journal, 'other-host/1:1234:1', age=120, phase='cancelled')
+    assert claimed_ids(journal) == set()
+    assert journal.purge(time.time()) == 1
+    assert journal.load(job_id) is None
@@ -0,0 +1,142 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from proxy_pool import ProxyPool
+
+THROTTLED = 'ERROR: [youtube] abc: HTTP Error 429: Too Many Requests'
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    # A forward proxy receives "GET http://host/path"; answering it directly is enough for a health check
+    def do_GET(self):
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def live_proxy():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ProxyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def dead_proxy():
+    # A port that was just free: connections to it are refused
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f'http://127.0.0.1:{port}'
+
+
+def make_pool(urls, **kwargs):
+    kwargs.setdefault('check_interval', 0)  # no background checker; tests call check() themselves
+    return ProxyPool(urls, check_url='http://upstream.invalid/generate_204', timeout=2, **kwargs)
+
+
+def test_empty_pool_is_a_direct_connection():
+    pool = make_pool([])
+    with pool.lease() as proxy:
+        assert proxy is None
+
+
+def test_least_loaded_spreads_concurrent_leases():
+    pool = make_pool(['http://a:1', 'http://b:1', 'http://c:1'])
+    picked = [pool.pick() for _ in range(3)]
+    assert sorted(p.url for p in picked) == ['http://a:1', 'http://b:1', 'http://c:1']
+    for proxy in picked:
+        pool.report(proxy)
+    assert all(p.active == 0 for p in pool.proxies)
+
+
+def test_success_rate_weighting():
+    pool = make_pool(['http://a:1', 'http://b:1'], strategy='success_rate', eject_after=100)
+    a, b = pool.proxies
+    for proxy, outcome in ((a, None), (a, THROTTLED), (a, THROTTLED), (b, None)):
+        proxy.active += 1
+        pool.report(proxy, outcome)
+    assert a.success_rate() < b.success_rate()
+    assert pool.pick() is b
+    # Still preferred while busy: this strategy weighs outcomes over load
+    assert pool.pick() is b
+
+
+def test_ejects_after_consecutive_route_failures():
+    pool = make_pool(['http://a:1', 'http://b:1'], eject_after=2)
+    a, b = pool.proxies
+    a.active += 1
+    pool.report(a, THROTTLED)
+    assert a.healthy
+    a.active += 1
+    pool.report(a, 'Connection refused')
+    assert not a.healthy
+    assert a.ejections == 1
+    assert {pool.pick().url for _ in range(3)} == {'http://b:1'}
+
+
+def test_video_errors_do_not_count_against_the_proxy():
+    pool = make_pool(['http://a:1'], eject_after=1)
+    proxy = pool.pick()
+    pool.report(proxy, 'ERROR: Video unavailable')
+    assert proxy.healthy
+    assert proxy.failures == 0
+
+
+def test_success_resets_the_failure_streak():
+    pool = make_pool(['http://a:1'], eject_after=2)
+    proxy = pool.proxies[0]
+    for outcome in (THROTTLED, None, THROTTLED):
+        proxy.active += 1
+        pool.report(proxy, outcome)
+    assert proxy.healthy
+    assert proxy.consecutive_failures == 1
+
+
+def test_all_ejected_falls_back_instead_of_failing():
+    pool = make_pool(['http://a:1'], eject_after=1)
+    proxy = pool.pick()
+    pool.report(proxy, THROTTLED)
+    assert not proxy.healthy
+    assert pool.pick() is proxy
+
+
+def test_lease_reports_the_outcome():
+    pool = make_pool(['http://a:1'], eject_after=1)
+    with pytest.raises(RuntimeError):
+        with pool.lease():
+            raise RuntimeError('HTTP Error 403: Forbidden')
+    proxy = pool.proxies[0]
+    assert proxy.active == 0
+    assert not proxy.healthy
+
+
+def test_failed_health_check_ejects(dead_proxy):
+    pool = make_pool([dead_proxy])
+    proxy = pool.proxies[0]
+    assert not pool.check(proxy)
+    assert not proxy.healthy
+    assert proxy.last_error.startswith('health check:')
+
+
+def test_passing_health_check_readmits_after_the_ejection_window(live_proxy):
+    pool = make_pool([live_proxy], eject_after=1, eject_seconds=60)
+    proxy = pool.pick()
+    pool.report(proxy, THROTTLED)
+    assert not proxy.healthy
+    # Inside the window a passing check does not re-admit it yet
+    assert pool.check(proxy)
+    assert not proxy.healthy
+    proxy.ejected_until = 0.0
+    assert pool.check(proxy)
+    assert proxy.healthy
+    assert proxy.consecutive_failures == 0
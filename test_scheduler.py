@@ -0,0 +1,127 @@
+import threading
+import time
+
+from scheduler import Job, JobScheduler
+
+
+class RecordingGate:
+    def __init__(self):
+        self.active = 0
+        self.released = []
+
+    def acquire(self):
+        self.active += 1
+
+    def release(self, error=None):
+        self.active -= 1
+        self.released.append(error)
+
+    def release_unused(self):
+        self.active -= 1
+
+
+def make_job(cost=0, client='1.2.3.4', priority='normal', url='https://youtu.be/aaaaaaaaaaa', job_id=None):
+    return Job({'url': url}, client=client, priority=priority, cost=cost, job_id=job_id)
+
+
+def test_runner_can_release_the_gate_early():
+    gate = RecordingGate()
+    slot_held_after_release = []
+    proceed = threading.Event()
+
+    def runner(job):
+        job.release_gate()
+        slot_held_after_release.append(gate.active)
+        proceed.wait(5)
+
+    scheduler = JobScheduler(runner, workers=1, gate=gate).start()
+    job = scheduler.submit(make_job())
+    proceed.set()
+    assert job.wait(5)
+    assert slot_held_after_release == [0]
+    assert gate.released == [None]
+    assert job.status == 'done'
+
+
+def test_gate_sees_the_error_when_the_runner_keeps_the_slot():
+    gate = RecordingGate()
+    error = RuntimeError('HTTP Error 429: Too Many Requests')
+
+    def runner(job):
+        raise error
+
+    scheduler = JobScheduler(runner, workers=1, gate=gate).start()
+    job = scheduler.submit(make_job())
+    assert job.wait(5)
+    assert gate.released == [error]
+    assert gate.active == 0
+    assert job.status == 'failed'
+
+
+def run_order(policy, jobs, **kwargs):
+    """Queue every job before the single worker starts and return the ids in the order they ran."""
+    order = []
+    scheduler = JobScheduler(lambda job: order.append(job.id), workers=1, policy=policy, **kwargs)
+    for job in jobs:
+        scheduler.submit(job)
+    scheduler.start()
+    for job in jobs:
+        assert job.wait(5)
+    return order
+
+
+def test_sjf_serves_the_cheapest_job_first():
+    jobs = [make_job(300, job_id='big'), make_job(100, job_id='small'), make_job(200, job_id='mid')]
+    assert run_order('sjf', jobs, aging_rate=0) == ['small', 'mid', 'big']
+
+
+def test_sjf_priority_divides_the_cost():
+    jobs = [make_job(100, priority='low', job_id='low'), make_job(300, priority='high', job_id='high')]
+    # 300 / 4 beats 100 / 0.25
+    assert run_order('sjf', jobs, aging_rate=0) == ['high', 'low']
+
+
+def test_aging_lets_an_old_large_job_overtake():
+    old, new = make_job(1000, job_id='old'), make_job(100, job_id='new')
+    # Waited 100 s longer: 100 * 10 bytes of credit outweighs the 900 byte difference
+    old.submitted_at = new.submitted_at - 100
+    assert run_order('sjf', [new, old], aging_rate=10) == ['old', 'new']
+
+
+def test_wfq_interleaves_clients():
+    jobs = [make_job(100, client='a', job_id=f'a{n}') for n in range(3)]
+    jobs += [make_job(100, client='b', job_id=f'b{n}') for n in range(2)]
+    assert run_order('wfq', jobs) == ['a0', 'b0', 'a1', 'b1', 'a2']
+
+
+def test_cancel_a_queued_job():
+    finished = []
+    proceed = threading.Event()
+    scheduler = JobScheduler(lambda job: proceed.wait(5), workers=1, on_finish=finished.append).start()
+    running = scheduler.submit(make_job(100))
+    queued = scheduler.submit(make_job(200))
+    while running.status != 'running':
+        time.sleep(0.01)
+    assert scheduler.queue_position(queued.id) == 0
+    assert scheduler.cancel(queued.id)
+    assert queued.finished and queued.status == 'cancelled'
+    assert scheduler.queue_position(queued.id) is None
+    # Only queued jobs can be cancelled this way
+    assert not scheduler.cancel(running.id)
+    assert not scheduler.cancel(queued.id)
+    proceed.set()
+    assert running.wait(5)
+    assert [job.status for job in finished] == ['cancelled', 'done']
+    assert scheduler.stats()['completed'] == 1
+
+
+def test_runner_that_honours_a_cancel_request_ends_cancelled():
+    def runner(job):
+        job.request_cancel()
+        if job.cancel_requested:
+            raise RuntimeError('Cancelled')
+
+    scheduler = JobScheduler(runner, workers=1).start()
+    job = scheduler.submit(make_job())
+    assert job.wait(5)
+    assert job.status == 'cancelled'
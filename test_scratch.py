@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from scratch import ScratchSpace
+
+MIB = 1024 * 1024
+
+
+class Cancelled(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def fake_download_cancelled(monkeypatch):
+    # The hook raises yt-dlp's DownloadCancelled; a stand-in keeps these tests free of yt-dlp
+    utils = pytest.importorskip('yt_dlp.utils')
+    monkeypatch.setattr(utils, 'DownloadCancelled', Cancelled)
+
+
+@pytest.fixture
+def scratch(tmp_path):
+    return ScratchSpace(str(tmp_path / 'shm'), budget_bytes=100 * MIB, job_max_bytes=60 * MIB, overhead=2.0)
+
+
+def test_fitting_job_is_staged_and_released(scratch):
+    path = scratch.reserve('job1', 20 * MIB)
+    assert path == os.path.join(scratch.root, 'job1') and os.path.isdir(path)
+    assert scratch.snapshot()['reserved_bytes'] == 40 * MIB
+    scratch.release('job1')
+    assert not os.path.exists(path)
+    assert scratch.snapshot()['reserved_bytes'] == 0
+    assert scratch.staged == 1
+
+
+@pytest.mark.parametrize('predicted', [None, 0, 31 * MIB])
+def test_unknown_or_oversized_jobs_spill(scratch, predicted):
+    assert scratch.reserve('job1', predicted) is None
+    assert scratch.spilled == 1
+    assert scratch.snapshot()['jobs'] == 0
+
+
+def test_global_budget_is_shared(scratch):
+    assert scratch.reserve('job1', 30 * MIB)
+    assert scratch.reserve('job2', 30 * MIB) is None
+    scratch.release('job1')
+    assert scratch.reserve('job2', 30 * MIB)
+
+
+def test_spilled_resume_removes_its_old_scratch_dir(scratch):
+    stale = os.path.join(scratch.root, 'job1')
+    os.makedirs(stale)
+    assert scratch.reserve('job1', None) is None
+    assert not os.path.exists(stale)
+
+
+def test_hook_stops_a_job_that_outgrows_its_reservation(scratch):
+    scratch.reserve('job1', 10 * MIB)
+    hook = scratch.progress_hook('job1')
+    # Two streams: 8 + 2 MiB is within the 20 MiB reservation with room for the merge
+    hook({'status': 'downloading', 'tmpfilename': 'v.f137.mp4.part', 'downloaded_bytes': 8 * MIB})
+    hook({'status': 'downloading', 'tmpfilename': 'a.f140.m4a.part', 'downloaded_bytes': 2 * MIB})
+    assert not scratch.overrun('job1')
+    with pytest.raises(Cancelled):
+        hook({'status': 'downloading', 'tmpfilename': 'v.f137.mp4.part', 'downloaded_bytes': 9 * MIB})
+    assert scratch.overrun('job1')
+    assert scratch.snapshot()['overrun_total'] == 1
+    scratch.release('job1')
+    assert not scratch.overrun('job1')
+    # Released: the same hook no longer interferes with the download on disk
+    hook({'status': 'downloading', 'tmpfilename': 'v.f137.mp4.part', 'downloaded_bytes': 50 * MIB})
+
+
+def test_sweep_keeps_reserved_and_live_jobs(scratch):
+    scratch.reserve('mine', 10 * MIB)
+    for name in ('live', 'crashed'):
+        os.makedirs(os.path.join(scratch.root, name))
+    assert scratch.sweep({'live'}) == 1
+    assert sorted(os.listdir(scratch.root)) == ['live', 'mine']
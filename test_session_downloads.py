@@ -0,0 +1,42 @@
+import threading
+
+from session_downloads import SessionDownloads, SessionReaper
+
+
+def test_reaper_shuts_down_sessions_gone_past_the_grace_period():
+    alive = {'a': True, 'b': True}
+    reaper = SessionReaper(lambda session_id: alive[session_id], grace=0.0)
+    a, b = SessionDownloads(1), SessionDownloads(1)
+    reaper.register('a', a)
+    reaper.register('b', b)
+    assert reaper.reap() == 0
+    alive['b'] = False
+    assert reaper.reap() == 1
+    assert b.closed and not a.closed
+    # Already forgotten: not shut down twice
+    assert reaper.reap() == 0
+    a.shutdown()
+
+
+def test_reconnect_within_grace_keeps_the_downloads():
+    alive = {'a': False}
+    reaper = SessionReaper(lambda session_id: alive[session_id], grace=3600)
+    downloads = SessionDownloads(1)
+    reaper.register('a', downloads)
+    assert reaper.reap() == 0
+    alive['a'] = True
+    assert reaper.reap() == 0
+    assert not downloads.closed
+    downloads.shutdown()
+
+
+def test_shutdown_cancels_queued_tasks():
+    downloads = SessionDownloads(1)
+    blocker = threading.Event()
+    # Occupy the only worker so the next task stays queued
+    downloads._pool.submit(blocker.wait, 5)
+    task_id = downloads.submit('https://youtu.be/aaaaaaaaaaa', 'clip', {})
+    downloads.shutdown()
+    blocker.set()
+    assert downloads.closed
+    assert [t['status'] for t in downloads.snapshot() if t['id'] == task_id] == ['cancelled']
@@ -0,0 +1,97 @@
+import hashlib
+import threading
+import time
+
+import pytest
+
+from storage import S3Store
+
+# S3Store builds a real boto3 client before the stub replaces it
+pytest.importorskip('boto3')
+
+MIB = 1024 * 1024
+
+
+class StubS3Client:
+    """Records the calls S3Store makes; parts with a lower number are answered later."""
+
+    def __init__(self, fail_part=None):
+        self.fail_part = fail_part
+        self.parts = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _record(self, name, **kwargs):
+        with self.lock:
+            self.calls.append((name, kwargs))
+
+    def put_object(self, Body, **kwargs):
+        self._record('put_object', body=Body.read(), **kwargs)
+
+    def create_multipart_upload(self, **kwargs):
+        self._record('create_multipart_upload', **kwargs)
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, PartNumber, Body, **kwargs):
+        # Finish out of order, so the test can tell submission order from completion order
+        time.sleep(0.05 / PartNumber)
+        if PartNumber == self.fail_part:
+            raise ConnectionError('connection reset')
+        with self.lock:
+            self.parts[PartNumber] = Body
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, **kwargs):
+        self._record('complete_multipart_upload', **kwargs)
+
+    def abort_multipart_upload(self, **kwargs):
+        self._record('abort_multipart_upload', **kwargs)
+
+    def names(self):
+        return [name for name, _kwargs in self.calls]
+
+
+@pytest.fixture
+def artifact(tmp_path):
+    path = tmp_path / 'video.mp4'
+    # Three full parts and a short last one
+    path.write_bytes(bytes(range(256)) * (3 * 5 * MIB // 256) + b'tail')
+    return path
+
+
+def make_store(client, **kwargs):
+    store = S3Store('bucket', prefix='artifacts', region='us-east-1', part_size=5 * MIB, **kwargs)
+    store.client = client
+    return store
+
+
+def test_small_file_is_a_single_put(tmp_path):
+    path = tmp_path / 'clip.mp3'
+    path.write_bytes(b'abc')
+    client = StubS3Client()
+    make_store(client).put(str(path), 'job1/clip.mp3', {'sha256': 'd' * 64})
+    assert client.names() == ['put_object']
+    kwargs = client.calls[0][1]
+    assert kwargs['Key'] == 'artifacts/job1/clip.mp3'
+    assert kwargs['body'] == b'abc'
+    assert kwargs['ContentType'] == 'audio/mpeg'
+    assert kwargs['Metadata'] == {'sha256': 'd' * 64}
+
+
+def test_multipart_parts_are_completed_in_order(artifact):
+    client = StubS3Client()
+    make_store(client, concurrency=4).put(str(artifact), 'job1/video.mp4')
+    assert client.names() == ['create_multipart_upload', 'complete_multipart_upload']
+    parts = client.calls[1][1]['MultipartUpload']['Parts']
+    assert [p['PartNumber'] for p in parts] == [1, 2, 3, 4]
+    assert [p['ETag'] for p in parts] == [f'"{hashlib.md5(client.parts[n]).hexdigest()}"' for n in (1, 2, 3, 4)]
+    assert b''.join(client.parts[n] for n in (1, 2, 3, 4)) == artifact.read_bytes()
+    assert len(client.parts[4]) == 4
+
+
+def test_failed_part_aborts_the_upload(artifact):
+    client = StubS3Client(fail_part=2)
+    with pytest.raises(ConnectionError):
+        make_store(client, concurrency=4).put(str(artifact), 'job1/video.mp4')
+    assert client.names() == ['create_multipart_upload', 'abort_multipart_upload']
+    assert client.calls[1][1] == {'Bucket': 'bucket', 'Key': 'artifacts/job1/video.mp4', 'UploadId': 'upload-1'}
@@ -0,0 +1,140 @@
+import pytest
+
+from upstream_health import UpstreamHealth, UpstreamUnavailable
+
+THROTTLED = 'ERROR: [youtube] abc: HTTP Error 429: Too Many Requests'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class StubUpstream:
+    """Answers each call with the next scripted outcome: None for success, else an error message."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if outcome:
+            raise RuntimeError(outcome)
+        return 'ok'
+
+
+def make_health(**kwargs):
+    clock = FakeClock()
+    # rng() == 1.0 makes the jittered backoff exactly base_delay * 2**(streak - 1)
+    health = UpstreamHealth(clock=clock, rng=lambda: 1.0, **kwargs)
+    return health, clock
+
+
+def call(health, upstream, timeout=0):
+    with health.slot(timeout):
+        return upstream()
+
+
+def test_throttle_halves_concurrency_and_success_adds_it_back():
+    health, clock = make_health(max_concurrency=8, base_delay=2.0, open_after=5)
+    with pytest.raises(RuntimeError):
+        call(health, StubUpstream(THROTTLED))
+    assert health.limit == 4.0
+    assert health.state == 'closed'
+    assert health.snapshot()['backoff_remaining_sec'] == 2.0
+
+    clock.advance(2.0)
+    with pytest.raises(RuntimeError):
+        call(health, StubUpstream(THROTTLED))
+    assert health.limit == 2.0
+    assert health.snapshot()['backoff_remaining_sec'] == 4.0
+
+    clock.advance(4.0)
+    assert call(health, StubUpstream(None)) == 'ok'
+    assert health.limit == 2.5
+    assert health.streak == 0
+
+
+def test_concurrency_never_drops_below_the_minimum():
+    health, clock = make_health(max_concurrency=4, min_concurrency=2, open_after=10)
+    for _ in range(5):
+        clock.advance(600)
+        with pytest.raises(RuntimeError):
+            call(health, StubUpstream(THROTTLED))
+    assert health.limit == 2.0
+
+
+def test_non_throttle_errors_do_not_back_off():
+    health, _clock = make_health(max_concurrency=4)
+    with pytest.raises(RuntimeError):
+        call(health, StubUpstream('ERROR: Video unavailable'))
+    snap = health.snapshot()
+    assert snap['concurrency_limit'] == 4.0
+    assert snap['backoff_remaining_sec'] == 0.0
+    assert snap['failures_total'] == 1
+
+
+def test_open_half_open_closed():
+    health, clock = make_health(base_delay=1.0, open_after=2)
+    upstream = StubUpstream(THROTTLED, THROTTLED, None)
+    for delay in (0, 1.0):
+        clock.advance(delay)
+        with pytest.raises(RuntimeError):
+            call(health, upstream)
+    assert health.state == 'open'
+    assert health.opened == 1
+
+    # Still inside the backoff window: nothing gets through
+    assert not health.acquire(timeout=0)
+    clock.advance(2.0)
+    # First caller after the backoff is the half-open probe; a second one waits for its verdict
+    assert health.acquire(timeout=0)
+    assert health.state == 'half_open'
+    assert not health.acquire(timeout=0)
+    health.release(None)
+    assert health.state == 'closed'
+    assert health.streak == 0
+    assert call(health, upstream) == 'ok'
+
+
+def test_throttled_probe_reopens_with_longer_backoff():
+    health, clock = make_health(base_delay=1.0, open_after=1)
+    with pytest.raises(RuntimeError):
+        call(health, StubUpstream(THROTTLED))
+    assert health.state == 'open'
+    clock.advance(1.0)
+    with pytest.raises(RuntimeError):
+        call(health, StubUpstream(THROTTLED))
+    assert health.state == 'open'
+    assert health.snapshot()['backoff_remaining_sec'] == 2.0
+
+
+def test_slot_raises_upstream_unavailable_while_open():
+    health, clock = make_health(base_delay=30.0, open_after=1)
+    upstream = StubUpstream(THROTTLED)
+    with pytest.raises(RuntimeError):
+        call(health, upstream)
+    with pytest.raises(UpstreamUnavailable):
+        call(health, upstream, timeout=0)
+    assert upstream.calls == 1
+    assert health.active == 0
+    assert health.waiting == 0
+
+
+def test_ydl_overrides_only_while_degraded():
+    health, clock = make_health(base_delay=1.0, open_after=3)
+    assert health.ydl_overrides() == {}
+    with pytest.raises(RuntimeError):
+        call(health, StubUpstream(THROTTLED))
+    assert health.ydl_overrides()['retries'] == 2
+    clock.advance(1.0)
+    call(health, StubUpstream(None))
+    assert health.ydl_overrides() == {}
@@ -0,0 +1,164 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import webhooks
+from webhooks import WebhookSender, callback_url_error, job_signing_key, redact_url, sign_payload
+
+
+def fake_dns(monkeypatch, answers):
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET6 if ':' in a else socket.AF_INET, socket.SOCK_STREAM, 6, '', (a, port))
+                for a in answers[host]]
+    monkeypatch.setattr(webhooks.socket, 'getaddrinfo', getaddrinfo)
+
+
+@pytest.mark.parametrize('address', [
+    '127.0.0.1', '10.1.2.3', '172.16.0.5', '192.168.1.1', '169.254.169.254', '100.64.0.1',
+    '0.0.0.0', '::1', 'fe80::1', 'fd00::1', '::ffff:127.0.0.1', '224.0.0.1',
+])
+def test_internal_addresses_are_rejected(monkeypatch, address):
+    fake_dns(monkeypatch, {'hook.example.com': [address]})
+    assert 'non-public' in callback_url_error('https://hook.example.com/cb')
+
+
+def test_one_internal_answer_is_enough_to_reject(monkeypatch):
+    fake_dns(monkeypatch, {'hook.example.com': ['93.184.216.34', '10.0.0.1']})
+    assert callback_url_error('https://hook.example.com/cb')
+
+
+def test_public_address_is_accepted(monkeypatch):
+    fake_dns(monkeypatch, {'hook.example.com': ['93.184.216.34']})
+    assert callback_url_error('https://hook.example.com/cb') is None
+
+
+@pytest.mark.parametrize('url', ['ftp://hook.example.com/cb', 'https:///cb', 'https://user:pw@hook.example.com/cb', None])
+def test_malformed_urls_are_rejected(url):
+    assert callback_url_error(url)
+
+
+def test_allowlist(monkeypatch):
+    fake_dns(monkeypatch, {'a.hooks.example.com': ['93.184.216.34'], 'evil.com': ['93.184.216.34']})
+    monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOWED_HOSTS', ['.hooks.example.com'])
+    assert callback_url_error('https://a.hooks.example.com/cb') is None
+    assert 'not allowed' in callback_url_error('https://evil.com/cb')
+
+
+def test_job_signing_key_is_stable_and_per_job():
+    assert job_signing_key(b'master', 'job1') == job_signing_key(b'master', 'job1')
+    assert job_signing_key(b'master', 'job1') != job_signing_key(b'master', 'job2')
+    assert job_signing_key(b'other', 'job1') != job_signing_key(b'master', 'job1')
+
+
+def test_signing_key_file_is_created_once(tmp_path, monkeypatch):
+    monkeypatch.delenv('WEBHOOK_SIGNING_KEY', raising=False)
+    path = str(tmp_path / '.webhook_key')
+    key = webhooks.load_signing_key(path)
+    assert key == webhooks.load_signing_key(path)
+    assert (tmp_path / '.webhook_key').stat().st_mode & 0o077 == 0
+
+
+class Receiver:
+    def __init__(self, status=204, location=None):
+        self.requests = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.requests.append((self.path, dict(self.headers), body))
+                self.send_response(status)
+                if location:
+                    self.send_header('Location', location)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_delivery_is_signed(monkeypatch):
+    monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOW_PRIVATE', True)
+    receiver = Receiver()
+    sender = WebhookSender(workers=1)
+    try:
+        sender.send(receiver.url + '/cb?x=1', {'id': 'job1'}, 'secret')
+        assert wait_for(lambda: sender.snapshot()['delivered'] == 1)
+        path, headers, body = receiver.requests[0]
+        assert path == '/cb?x=1'
+        assert json.loads(body) == {'id': 'job1'}
+        assert headers['X-Webhook-Signature'] == sign_payload('secret', headers['X-Webhook-Timestamp'], body)
+    finally:
+        receiver.close()
+
+
+def test_redirects_are_not_followed(monkeypatch):
+    monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOW_PRIVATE', True)
+    target = Receiver()
+    redirector = Receiver(status=307, location=target.url + '/internal')
+    sender = WebhookSender(workers=1, max_attempts=3, base_delay=0.01)
+    try:
+        sender.send(redirector.url + '/cb', {'id': 'job1'})
+        assert wait_for(lambda: sender.snapshot()['failed'] == 1)
+        assert len(redirector.requests) == 1
+        assert target.requests == []
+    finally:
+        target.close()
+        redirector.close()
+
+
+def test_rebinding_after_submission_is_caught_at_send_time(monkeypatch):
+    receiver = Receiver()
+    port = receiver.server.server_address[1]
+    # Passed the submit-time check with a public answer, now resolves to loopback
+    fake_dns(monkeypatch, {'hook.example.com': ['93.184.216.34']})
+    assert callback_url_error(f'http://hook.example.com:{port}/cb') is None
+    fake_dns(monkeypatch, {'hook.example.com': ['127.0.0.1']})
+    sender = WebhookSender(workers=1, max_attempts=3, base_delay=0.01)
+    try:
+        sender.send(f'http://hook.example.com:{port}/cb', {'id': 'job1'})
+        assert wait_for(lambda: sender.snapshot()['failed'] == 1)
+        assert sender.snapshot()['retries'] == 0
+        assert receiver.requests == []
+    finally:
+        receiver.close()
+
+
+def test_redact_url():
+    assert redact_url('https://hooks.example.com/cb/abc?token=s3cret') == 'https://hooks.example.com'
+    assert redact_url('http://user:pw@[::1]:8080/x') == 'http://[::1]:8080'
+    assert redact_url('not a url') == '<invalid url>'
+
+
+def test_last_error_omits_the_callback_path_and_query(monkeypatch):
+    monkeypatch.setattr(webhooks, 'WEBHOOK_ALLOW_PRIVATE', True)
+    receiver = Receiver(status=404)
+    sender = WebhookSender(workers=1)
+    try:
+        sender.send(receiver.url + '/cb/tok3n?key=s3cret', {'id': 'job1'})
+        assert wait_for(lambda: sender.snapshot()['failed'] == 1)
+        assert sender.snapshot()['last_error'].startswith(receiver.url + ': ')
+        assert 's3cret' not in sender.snapshot()['last_error'] and 'tok3n' not in sender.snapshot()['last_error']
+    finally:
+        receiver.close()
@@ -0,0 +1,84 @@
+import io
+import struct
+import zipfile
+
+from zip_stream import stream_zip, unique_arcname
+
+LOCAL_HEADER = b'PK\x03\x04'
+DATA_DESCRIPTOR_FLAG = 0x08
+ZIP64_EXTRA_ID = 0x0001
+
+
+def local_headers(archive):
+    """(name, flag bits, extra field) of every local file header, in order."""
+    headers, pos = [], archive.find(LOCAL_HEADER)
+    while pos != -1:
+        flags, = struct.unpack('<H', archive[pos + 6:pos + 8])
+        name_len, extra_len = struct.unpack('<HH', archive[pos + 26:pos + 30])
+        name = archive[pos + 30:pos + 30 + name_len].decode('utf-8')
+        extra = archive[pos + 30 + name_len:pos + 30 + name_len + extra_len]
+        headers.append((name, flags, extra))
+        pos = archive.find(LOCAL_HEADER, pos + 30 + name_len + extra_len)
+    return headers
+
+
+def extra_ids(extra):
+    ids, pos = [], 0
+    while pos + 4 <= len(extra):
+        header_id, size = struct.unpack('<HH', extra[pos:pos + 4])
+        ids.append(header_id)
+        pos += 4 + size
+    return ids
+
+
+def test_round_trips_through_zipfile(tmp_path):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(bytes(range(256)) * 4096)
+    archive = b''.join(stream_zip([('video.mp4', str(video)), ('errors.txt', b'one failed\n')], chunk_size=64 * 1024))
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ['video.mp4', 'errors.txt']
+        assert zf.read('video.mp4') == video.read_bytes()
+        assert zf.read('errors.txt') == b'one failed\n'
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zf.infolist())
+
+
+def test_entries_use_data_descriptors_and_zip64(tmp_path):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'x' * 1000)
+    archive = b''.join(stream_zip([('video.mp4', str(video)), ('note.txt', b'hi')]))
+    headers = local_headers(archive)
+    assert [name for name, _flags, _extra in headers] == ['video.mp4', 'note.txt']
+    # Sizes and CRCs follow the data, since the output is never seeked back into
+    assert all(flags & DATA_DESCRIPTOR_FLAG for _name, flags, _extra in headers)
+    # Files may outgrow 4 GiB, so their headers carry Zip64 sizes up front
+    assert ZIP64_EXTRA_ID in extra_ids(headers[0][2])
+
+
+def test_streams_lazily_and_reports_each_entry(tmp_path):
+    paths = []
+    for n in range(3):
+        path = tmp_path / f'{n}.mp3'
+        path.write_bytes(bytes([n]) * 300_000)
+        paths.append(str(path))
+    pulled, done = [], []
+
+    def entries():
+        for path in paths:
+            pulled.append(path)
+            yield 'track.mp3', path
+
+    stream = stream_zip(entries(), chunk_size=100_000, on_entry_done=lambda name, source: done.append(source))
+    first = next(stream)
+    # Output starts before later entries have even been produced
+    assert pulled == paths[:1] and done == []
+    archive = first + b''.join(stream)
+    assert done == paths
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert zf.namelist() == ['track.mp3', 'track (2).mp3', 'track (3).mp3']
+
+
+def test_unique_arcname():
+    used = set()
+    assert [unique_arcname(name, used) for name in ('a.mp4', 'a.mp4', 'b', 'a.mp4', 'b')] == \
+        ['a.mp4', 'a (2).mp4', 'b', 'a (3).mp4', 'b (2)']
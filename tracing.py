@@ -0,0 +1,410 @@
+import atexit
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+TRACE_FORMATS = ('jsonl', 'otlp')
+SERVICE_NAME = 'yt-downloader'
+
+_current: contextvars.ContextVar = contextvars.ContextVar('trace_span', default=None)
+
+
+class Span:
+    """One timed operation in a trace; use as a context manager or call end() explicitly.
+
+    Unsampled spans are still created so their children inherit the decision, but
+    are never exported.
+    """
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'sampled', 'start_ns', 'end_ns',
+                 'attributes', 'events', 'error', '_token', '_lock')
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, sampled: bool, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+        self.attributes = attributes
+        self.events: List[Dict[str, Any]] = []
+        self.error: str | None = None
+        self._token = None
+        self._lock = threading.Lock()
+
+    def set(self, **attributes) -> 'Span':
+        with self._lock:
+            self.attributes.update(attributes)
+        return self
+
+    def add(self, key: str, amount: float = 1) -> None:
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def event(self, name: str, **attributes) -> None:
+        with self._lock:
+            self.events.append({'name': name, 'time_ns': time.time_ns(), 'attributes': attributes})
+
+    def fail(self, error: Any) -> None:
+        self.error = str(error) or type(error).__name__
+
+    def traceparent(self) -> str:
+        """W3C trace context header value, for handing the trace to another thread, process or service."""
+        return f'00-{self.trace_id}-{self.span_id}-{"01" if self.sampled else "00"}'
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled and EXPORTER is not None:
+            EXPORTER.export(self)
+
+    def __enter__(self) -> 'Span':
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc is not None and self.error is None:
+            self.fail(exc)
+        _current.reset(self._token)
+        self.end()
+
+
+class _NoopSpan:
+    """Returned while tracing is disabled: every operation is a no-op."""
+
+    def __bool__(self) -> bool:
+        return False
+
+    def set(self, **attributes) -> '_NoopSpan':
+        return self
+
+    def add(self, key: str, amount: float = 1) -> None:
+        pass
+
+    def event(self, name: str, **attributes) -> None:
+        pass
+
+    def fail(self, error: Any) -> None:
+        pass
+
+    def traceparent(self) -> None:
+        return None
+
+    def end(self) -> None:
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP = _NoopSpan()
+
+
+class _RemoteParent:
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id, self.span_id, self.sampled = trace_id, span_id, sampled
+
+
+def parse_traceparent(value: str | None) -> _RemoteParent | None:
+    parts = (value or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return _RemoteParent(parts[1], parts[2], sampled)
+
+
+def span(name: str, parent: Any = None, **attributes) -> Span | _NoopSpan:
+    """Start a span under parent (a Span, a traceparent string, or by default the current span).
+
+    With no parent a new trace starts, sampled with probability TRACE_SAMPLE_RATE.
+    """
+    if EXPORTER is None:
+        return NOOP
+    if isinstance(parent, str):
+        parent = parse_traceparent(parent)
+    elif parent is None or parent is NOOP:
+        parent = _current.get()
+    if parent is None:
+        return Span(name, '%032x' % random.getrandbits(128), None, random.random() < SAMPLE_RATE, attributes)
+    return Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+
+
+def current_span() -> Span | _NoopSpan:
+    return _current.get() or NOOP
+
+
+def traceparent() -> str | None:
+    """traceparent of the current span, or None when tracing is off or no span is active."""
+    current = _current.get()
+    return current.traceparent() if current is not None else None
+
+
+def traced(name: str | None = None, **attributes) -> Callable:
+    """Decorator: run the function inside a span (skipped entirely while tracing is off)."""
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if EXPORTER is None:
+                return fn(*args, **kwargs)
+            with span(label, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# -- yt-dlp instrumentation -------------------------------------------------------------
+
+class _YdlTracer:
+    """Progress/postprocessor hooks and logger that turn yt-dlp callbacks into spans.
+
+    Bound to its parent span up front, because yt-dlp calls the hooks from its own
+    fragment download threads where no span is current.
+    """
+
+    def __init__(self, parent: Span, fragment_batch: int):
+        self.parent = parent
+        self.fragment_batch = max(1, fragment_batch)
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._pp: Dict[str, Span] = {}
+        self._lock = threading.Lock()
+
+    def _file_state(self, key: str, d: Dict[str, Any]) -> Dict[str, Any]:
+        state = self._files.get(key)
+        if state is None:
+            info = d.get('info_dict') or {}
+            file_span = span('ydl.download_file', parent=self.parent,
+                             format_id=info.get('format_id'), ext=info.get('ext'),
+                             file=os.path.basename(d.get('filename') or key),
+                             fragment_count=d.get('fragment_count'))
+            state = self._files[key] = {'span': file_span, 'batch': None, 'batch_start_bytes': 0}
+        return state
+
+    def _close_batch(self, state: Dict[str, Any], downloaded: int) -> None:
+        batch = state['batch']
+        if batch is not None:
+            batch.set(bytes=downloaded - state['batch_start_bytes'])
+            batch.end()
+            state['batch'] = None
+
+    def progress_hook(self, d: Dict[str, Any]) -> None:
+        status = d.get('status')
+        key = d.get('filename') or d.get('tmpfilename') or ''
+        downloaded = d.get('downloaded_bytes') or 0
+        with self._lock:
+            state = self._file_state(key, d)
+            if status == 'downloading':
+                index = d.get('fragment_index')
+                if index is not None:
+                    first = max(index - 1, 0) // self.fragment_batch * self.fragment_batch + 1
+                    batch = state['batch']
+                    if batch is None or batch.attributes.get('first_fragment') != first:
+                        self._close_batch(state, downloaded)
+                        state['batch'] = span('ydl.fragments', parent=state['span'], first_fragment=first,
+                                              last_fragment=first + self.fragment_batch - 1)
+                        state['batch_start_bytes'] = downloaded
+                return
+            self._files.pop(key, None)
+            self._close_batch(state, downloaded)
+        file_span = state['span']
+        file_span.set(bytes=d.get('total_bytes') or downloaded, elapsed_sec=d.get('elapsed'))
+        if status == 'error':
+            file_span.fail('download error')
+        file_span.end()
+
+    def postprocessor_hook(self, d: Dict[str, Any]) -> None:
+        name = d.get('postprocessor') or 'postprocessor'
+        with self._lock:
+            if d.get('status') == 'started':
+                self._pp[name] = span('ydl.postprocess', parent=self.parent, postprocessor=name)
+                return
+            pp_span = self._pp.pop(name, None)
+        if pp_span is not None:
+            filepath = (d.get('info_dict') or {}).get('filepath')
+            if filepath and os.path.exists(filepath):
+                pp_span.set(output_bytes=os.path.getsize(filepath))
+            pp_span.end()
+
+    # yt-dlp logger interface: prints like yt-dlp would, and counts retries on the parent span
+    def debug(self, msg: str) -> None:
+        if not msg.startswith('[debug] '):
+            print(msg)
+
+    def info(self, msg: str) -> None:
+        print(msg)
+
+    def warning(self, msg: str) -> None:
+        if 'Retrying' in msg or 'retry' in msg.lower():
+            self.parent.add('fragment_retries' if 'fragment' in msg.lower() else 'retries')
+            self.parent.event('retry', message=msg[:200])
+        print(f'WARNING: {msg}', file=sys.stderr)
+
+    def error(self, msg: str) -> None:
+        self.parent.event('error', message=msg[:500])
+        print(msg, file=sys.stderr)
+
+
+def instrument_ydl(ydl_opts: Dict[str, Any], parent: Span | None = None, logger: bool = True) -> Dict[str, Any]:
+    """Add tracing hooks (and, unless the caller set one, a retry-counting logger) to yt-dlp options.
+
+    Spans hang off parent, by default the current span. Does nothing while tracing is off.
+    """
+    parent = parent or _current.get()
+    if EXPORTER is None or parent is None or not parent.sampled:
+        return ydl_opts
+    tracer = _YdlTracer(parent, int(ydl_opts.get('concurrent_fragment_downloads') or 1) * FRAGMENT_BATCH)
+    ydl_opts.setdefault('progress_hooks', []).append(tracer.progress_hook)
+    ydl_opts.setdefault('postprocessor_hooks', []).append(tracer.postprocessor_hook)
+    if logger and 'logger' not in ydl_opts and not ydl_opts.get('quiet'):
+        ydl_opts['logger'] = tracer
+    return ydl_opts
+
+
+# -- exporters ------------------------------------------------------------------------------
+
+def _jsonl_record(s: Span) -> Dict[str, Any]:
+    return {
+        'trace_id': s.trace_id,
+        'span_id': s.span_id,
+        'parent_id': s.parent_id,
+        'name': s.name,
+        'start': s.start_ns / 1e9,
+        'duration_ms': round((s.end_ns - s.start_ns) / 1e6, 3),
+        'attributes': {k: v for k, v in s.attributes.items() if v is not None},
+        'events': [{'name': e['name'], 'time': e['time_ns'] / 1e9, 'attributes': e['attributes']} for e in s.events],
+        'error': s.error,
+    }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{'key': k, 'value': _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+def _otlp_record(spans: List[Span]) -> Dict[str, Any]:
+    # One OTLP/JSON ExportTraceServiceRequest per line, as written by the collector's file exporter
+    return {'resourceSpans': [{
+        'resource': {'attributes': _otlp_attributes({'service.name': SERVICE_NAME})},
+        'scopeSpans': [{
+            'scope': {'name': SERVICE_NAME},
+            'spans': [{
+                'traceId': s.trace_id,
+                'spanId': s.span_id,
+                'parentSpanId': s.parent_id or '',
+                'name': s.name,
+                'kind': 1,
+                'startTimeUnixNano': str(s.start_ns),
+                'endTimeUnixNano': str(s.end_ns),
+                'attributes': _otlp_attributes(s.attributes),
+                'events': [{'timeUnixNano': str(e['time_ns']), 'name': e['name'],
+                            'attributes': _otlp_attributes(e['attributes'])} for e in s.events],
+                'status': {'code': 2, 'message': s.error} if s.error else {'code': 1},
+            } for s in spans],
+        }],
+    }]}
+
+
+class FileExporter:
+    """Appends finished spans to a file from a background thread, in batches.
+
+    ``jsonl``: one span per line. ``otlp``: one OTLP/JSON request per batch per line,
+    readable by the OpenTelemetry collector's ``otlpjsonfile`` receiver.
+    """
+
+    def __init__(self, path: str, fmt: str = 'jsonl', max_batch: int = 256, flush_interval: float = 1.0):
+        if fmt not in TRACE_FORMATS:
+            raise ValueError(f'Unknown TRACE_EXPORT: {fmt}')
+        self.path = path
+        self.fmt = fmt
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.exported = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def export(self, s: Span) -> None:
+        try:
+            self._queue.put_nowait(s)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, batch: List[Span]) -> None:
+        if self.fmt == 'otlp':
+            lines = [json.dumps(_otlp_record(batch))]
+        else:
+            lines = [json.dumps(_jsonl_record(s), default=str) for s in batch]
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.exported += len(batch)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._write(batch)
+                    return
+                batch.append(item)
+            try:
+                self._write(batch)
+            except OSError as e:
+                self.dropped += len(batch)
+                print(f'Trace export failed: {e}', file=sys.stderr)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(5)
+
+
+def exporter_from_env() -> FileExporter | None:
+    fmt = os.environ.get('TRACE_EXPORT', '').strip().lower()
+    if not fmt:
+        return None
+    default = 'traces.otlp.jsonl' if fmt == 'otlp' else 'traces.jsonl'
+    return FileExporter(os.environ.get('TRACE_FILE') or default, fmt)
+
+
+SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1'))
+# Fragments per 'ydl.fragments' span, per concurrent fragment download
+FRAGMENT_BATCH = int(os.environ.get('TRACE_FRAGMENT_BATCH', '4'))
+EXPORTER = exporter_from_env()
@@ -0,0 +1,186 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+from downloader import is_throttle_error
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when a caller gives up waiting for the upstream circuit to close."""
+
+
+class UpstreamHealth:
+    """Shared view of upstream health that every extraction and download goes through.
+
+    * Concurrency is AIMD: each throttling signal (429/403, "Sign in to confirm
+      you're not a bot") halves the allowed number of concurrent upstream calls,
+      each success adds back about one slot per round trip.
+    * Every throttling signal also pauses new calls for a jittered exponential
+      backoff (base_delay * 2**streak, capped at max_delay).
+    * After ``open_after`` consecutive throttles the circuit opens: callers wait
+      (they are queued, not failed) until the backoff expires, then a single
+      probe is let through (half-open). A successful probe closes the circuit;
+      a throttled one re-opens it with a longer backoff.
+
+    ``clock`` and ``rng`` are injectable so the state machine can be driven
+    deterministically against a stub server.
+    """
+
+    def __init__(self, max_concurrency: int = 8, min_concurrency: int = 1, base_delay: float = 2.0,
+                 max_delay: float = 300.0, open_after: int = 3,
+                 clock: Callable[[], float] = time.monotonic, rng: Callable[[], float] = random.random):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.open_after = max(1, open_after)
+        self.clock = clock
+        self.rng = rng
+        self.state = 'closed'
+        self.limit = float(self.max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.streak = 0
+        self.successes = 0
+        self.failures = 0
+        self.throttled = 0
+        self.opened = 0
+        self.last_throttle_error: str | None = None
+        self._resume_at = 0.0
+        self._probe_in_flight = False
+        self._cond = threading.Condition()
+
+    # -- admission -----------------------------------------------------------------
+
+    def _try_admit(self, now: float) -> bool:
+        if self.state == 'open':
+            if now < self._resume_at:
+                return False
+            self.state = 'half_open'
+        if self.state == 'half_open':
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            self.active += 1
+            return True
+        if now < self._resume_at or self.active >= int(self.limit):
+            return False
+        self.active += 1
+        return True
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """Wait for an upstream slot; returns False if timeout expires first."""
+        deadline = None if timeout is None else self.clock() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = self.clock()
+                    if self._try_admit(now):
+                        return True
+                    waits = [self._resume_at - now] if self._resume_at > now else []
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        waits.append(deadline - now)
+                    self._cond.wait(timeout=min(waits) if waits else None)
+            finally:
+                self.waiting -= 1
+
+    def release_unused(self) -> None:
+        """Return a slot that was acquired but never used for an upstream call."""
+        with self._cond:
+            self.active = max(0, self.active - 1)
+            self._probe_in_flight = False
+            self._cond.notify_all()
+
+    def release(self, error: BaseException | str | None = None) -> None:
+        """Return a slot, classifying the outcome from the error (None = success)."""
+        throttled = error is not None and is_throttle_error(error)
+        with self._cond:
+            self.active = max(0, self.active - 1)
+            was_probe = self._probe_in_flight
+            self._probe_in_flight = False
+            if throttled:
+                self._on_throttle(str(error))
+            else:
+                if error is None:
+                    self.successes += 1
+                else:
+                    self.failures += 1
+                if error is None or was_probe:
+                    # Any non-throttled answer proves upstream is serving us again
+                    self.streak = 0
+                    if self.state != 'closed':
+                        self.state = 'closed'
+                    self.limit = min(float(self.max_concurrency), self.limit + 1.0 / max(self.limit, 1.0))
+            self._cond.notify_all()
+
+    def _on_throttle(self, message: str) -> None:
+        # caller holds self._cond
+        self.throttled += 1
+        self.streak += 1
+        self.last_throttle_error = message[:300]
+        self.limit = max(float(self.min_concurrency), self.limit / 2)
+        delay = min(self.max_delay, self.base_delay * (2 ** (self.streak - 1)))
+        jittered = delay * (0.5 + 0.5 * self.rng())
+        self._resume_at = max(self._resume_at, self.clock() + jittered)
+        if self.streak >= self.open_after or self.state == 'half_open':
+            if self.state != 'open':
+                self.opened += 1
+            self.state = 'open'
+
+    @contextmanager
+    def slot(self, timeout: float | None = None) -> Iterator[None]:
+        if not self.acquire(timeout):
+            raise UpstreamUnavailable('Upstream is throttling requests; try again later')
+        try:
+            yield
+        except BaseException as e:
+            self.release(e)
+            raise
+        else:
+            self.release(None)
+
+    # -- tuning for yt-dlp ---------------------------------------------------------
+
+    def ydl_overrides(self) -> Dict[str, Any]:
+        """yt-dlp retry settings for the current health: fewer, slower retries while throttled."""
+        with self._cond:
+            degraded = self.state != 'closed' or self.streak > 0
+        if not degraded:
+            return {}
+        return {
+            'retries': 2,
+            'fragment_retries': 3,
+            'extractor_retries': 1,
+            'retry_sleep_functions': {'http': lambda n: min(30.0, 2.0 * 2 ** n),
+                                      'fragment': lambda n: min(30.0, 1.0 * 2 ** n)},
+            'sleep_interval_requests': 1,
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'state': self.state,
+                'concurrency_limit': round(self.limit, 2),
+                'active': self.active,
+                'waiting': self.waiting,
+                'throttle_streak': self.streak,
+                'throttled_total': self.throttled,
+                'successes_total': self.successes,
+                'failures_total': self.failures,
+                'opened_total': self.opened,
+                'backoff_remaining_sec': max(0.0, round(self._resume_at - self.clock(), 2)),
+                'last_throttle_error': self.last_throttle_error,
+            }
+
+
+UPSTREAM = UpstreamHealth(
+    max_concurrency=int(os.environ.get('UPSTREAM_MAX_CONCURRENCY', '8')),
+    base_delay=float(os.environ.get('UPSTREAM_BACKOFF_BASE_SEC', '2')),
+    max_delay=float(os.environ.get('UPSTREAM_BACKOFF_MAX_SEC', '300')),
+    open_after=int(os.environ.get('UPSTREAM_OPEN_AFTER', '3')),
+)
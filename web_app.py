@@ -1,7 +1,6 @@
 from flask import Flask, render_template_string, request, send_file, jsonify
 import os
 import tempfile
-from yt_dlp import YoutubeDL
 
 # Configure ffmpeg path
 ffmpeg_path = os.path.join(os.path.dirname(__file__), 'ffmpeg-master-latest-win64-gpl', 'bin', 'ffmpeg.exe')
@@ -13,9 +12,9 @@ from flask import Flask, render_template_string, request, send_file, jsonify, Re
 import os
 import tempfile
 import json
-from yt_dlp import YoutubeDL
 from threading import Thread
 import queue
+from downloader import DownloadResult
 
 app = Flask(__name__)
 
@@ -188,6 +187,8 @@ def get_info():
     
     try:
         ydl_opts = {'quiet': True}
+        # yt-dlp loads on the first request rather than at startup
+        from yt_dlp import YoutubeDL
         with YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=False)
             return jsonify({
@@ -220,18 +221,17 @@ def download():
             }],
         }
         
+        result = DownloadResult().attach(ydl_opts)
+        from yt_dlp import YoutubeDL
         with YoutubeDL(ydl_opts) as ydl:
             ydl.download([url])
             
-        # Find the downloaded file
-        for file in os.listdir(temp_dir):
-            if file.endswith('.mp4'):
-                file_path = os.path.join(temp_dir, file)
-                return send_file(
-                    file_path,
-                    as_attachment=True,
-                    download_name=file
-                )
+        if result.path:
+            return send_file(
+                result.path,
+                as_attachment=True,
+                download_name=os.path.basename(result.path)
+            )
         
         return 'Download failed', 500
     except Exception as e:
@@ -1,26 +1,62 @@
 from flask import Flask, render_template_string, request, send_file, jsonify, Response, redirect, url_for, session
 import os
-import tempfile
 import json
 import time
 from collections import deque
-from yt_dlp import YoutubeDL
 from downloader import apply_common_ydl_hardening
-from threading import Thread
+from downloader import DownloadResult, FormatTable
+from metadata import METADATA_CACHE, cache_key, get_metadata, iter_harvest, video_id_from_url
+from format_select import select_format, select_audio_format
+from scheduler import Job, parse_priority_classes, predict_job_cost, scheduler_from_env
+from bandwidth import INGRESS, EGRESS
+from upstream_health import UPSTREAM, UpstreamUnavailable
+from proxy_pool import PROXIES
+from job_journal import FINISHED_PHASES, JobJournal
+from webhooks import WEBHOOKS, WEBHOOK_SECRETS, callback_url_error, job_signing_key, load_signing_key
+from zip_stream import stream_zip
+from integrity import DedupStore, IncrementalHasher, artifact_digests, http_headers
+from storage import store_from_env
+from delivery import Delivery, parse_redirect_map
+from scratch import SCRATCH
+import tracing
+import profiling
+from werkzeug.wsgi import ClosingIterator
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 import queue
 import sqlite3
-from flask_session import Session
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request as GoogleRequest
-from google.oauth2 import id_token
-import google.auth.transport.requests
+from flask.sessions import SessionInterface
 import pathlib
+import shutil
+import functools
+import hashlib
+import ipaddress
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev-secret')
 app.config['SESSION_TYPE'] = 'filesystem'
-Session(app)
+
+class LazySession(SessionInterface):
+    """Flask-Session's server-side sessions, set up by the first request instead of at import."""
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = Lock()
+
+    def _interface(self):
+        with self._lock:
+            if self.app.session_interface is self:
+                from flask_session import Session
+                Session(self.app)  # installs the real interface on the app
+        return self.app.session_interface
+
+    def open_session(self, app, request):
+        return self._interface().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        return self._interface().save_session(app, session, response)
+
+app.session_interface = LazySession(app)
 
 # OAuth2 Configuration
 CLIENT_SECRETS_FILE = os.path.join(os.path.dirname(__file__), 
@@ -34,6 +70,44 @@ SCOPES = [
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'  # TODO: Remove this in production
 
+# OAuth and Google API modules are imported by the routes that use them, not at startup
+@functools.lru_cache(maxsize=None)
+def _client_config(client_secrets_file):
+    with open(client_secrets_file, 'r') as f:
+        return json.load(f)
+
+def oauth_flow(client_secrets_file, scopes, **kwargs):
+    """OAuth flow from a client secrets file that is read once per process."""
+    from google_auth_oauthlib.flow import Flow
+    return Flow.from_client_config(_client_config(client_secrets_file), scopes=scopes, **kwargs)
+
+@functools.lru_cache(maxsize=None)
+def google_request():
+    """One shared transport (and HTTP session) for token refresh and ID token checks."""
+    import google.auth.transport.requests
+    return google.auth.transport.requests.Request()
+
+def verify_id_token(credentials):
+    from google.oauth2 import id_token
+    return id_token.verify_oauth2_token(credentials.id_token, google_request(), credentials.client_id)
+
+def credentials_from_dict(credentials_dict):
+    from google.oauth2.credentials import Credentials
+    return Credentials(
+        token=credentials_dict['token'],
+        refresh_token=credentials_dict['refresh_token'],
+        token_uri=credentials_dict['token_uri'],
+        client_id=credentials_dict['client_id'],
+        client_secret=credentials_dict['client_secret'],
+        scopes=credentials_dict['scopes']
+    )
+
+def warm_imports():
+    """Import yt-dlp on a daemon thread once the server is up, so the first
+    download does not pay for it and startup does not wait for it."""
+    if os.environ.get('WARM_IMPORTS', '1') != '0':
+        Thread(target=lambda: __import__('yt_dlp'), name='warm-imports', daemon=True).start()
+
 def credentials_to_dict(credentials):
     return {
         'token': credentials.token,
@@ -54,13 +128,64 @@ VALID_API_KEYS = [k.strip() for k in os.environ.get('API_KEYS', '').split(',') i
 RATE_LIMIT_MAX = int(os.environ.get('RATE_LIMIT_MAX', '3'))
 RATE_LIMIT_WINDOW_SEC = int(os.environ.get('RATE_LIMIT_WINDOW_SEC', str(10 * 60)))
 RATE_LIMIT_COOLDOWN_SEC = int(os.environ.get('RATE_LIMIT_COOLDOWN_SEC', '30'))
+# Reverse proxies whose X-Forwarded-For is believed (IPs or CIDRs); anyone else could spoof it to dodge the rate limit
+TRUSTED_PROXIES = [ipaddress.ip_network(n.strip(), strict=False)
+                   for n in os.environ.get('TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if n.strip()]
+BULK_INFO_MAX_CONCURRENCY = int(os.environ.get('BULK_INFO_MAX_CONCURRENCY', '32'))
+BULK_INFO_MAX_URLS = int(os.environ.get('BULK_INFO_MAX_URLS', '1000'))
+# A bulk request costs one rate-limit token per this many URLs (rounded up)
+BULK_INFO_URLS_PER_TOKEN = int(os.environ.get('BULK_INFO_URLS_PER_TOKEN', '500'))
+UPSTREAM_INFO_WAIT_SEC = float(os.environ.get('UPSTREAM_INFO_WAIT_SEC', '15'))
+# Queue cost of a job whose metadata is not cached yet and no other job's cost is known (about 10 min of 1080p)
+JOB_DEFAULT_COST_BYTES = float(os.environ.get('JOB_DEFAULT_COST_BYTES', str(400 * 1024 * 1024)))
+JOB_COST_WORKERS = int(os.environ.get('JOB_COST_WORKERS', '2'))
 DB_PATH = os.path.join(os.path.dirname(__file__), 'rate_limit.sqlite')
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(os.path.dirname(__file__), 'jobs'))
+JOB_JOURNAL_PATH = os.environ.get('JOB_JOURNAL_PATH', os.path.join(JOBS_DIR, 'journal.sqlite'))
+JOB_RETENTION_SEC = int(os.environ.get('JOB_RETENTION_SEC', str(24 * 3600)))
+# Active jobs are leased: the owner renews every JOB_HEARTBEAT_SEC, other processes take over after JOB_LEASE_SEC
+JOB_HEARTBEAT_SEC = float(os.environ.get('JOB_HEARTBEAT_SEC', '15'))
+JOB_LEASE_SEC = float(os.environ.get('JOB_LEASE_SEC', '60'))
+JOB_RETENTION_CHECK_SEC = float(os.environ.get('JOB_RETENTION_CHECK_SEC', '600'))
+STORAGE_DELETE_LOCAL = os.environ.get('STORAGE_DELETE_LOCAL', '0') == '1'
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', '50'))
+BATCH_WINDOW = int(os.environ.get('BATCH_WINDOW', '3'))
 
 def _db_conn():
     conn = sqlite3.connect(DB_PATH)
     conn.execute('PRAGMA journal_mode=WAL;')
     return conn
 
+def _trusted_proxy(addr):
+    try:
+        ip = ipaddress.ip_address((addr or '').strip())
+    except ValueError:
+        return False
+    return any(ip in net for net in TRUSTED_PROXIES)
+
+def forwarded_client_ip(remote_addr, forwarded_for):
+    """Client address for rate limiting and fair sharing.
+
+    X-Forwarded-For is only read when the peer is a trusted proxy, and then from the
+    right: the first hop that is not itself a trusted proxy is the client.
+    """
+    if not forwarded_for or not _trusted_proxy(remote_addr):
+        return remote_addr
+    hops = [h.strip() for h in forwarded_for.split(',') if h.strip()]
+    for hop in reversed(hops):
+        if not _trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else remote_addr
+
+def client_ip():
+    return forwarded_client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+
+def client_id(api_key, ip):
+    """Who a job or transfer belongs to: a digest for API-key callers, so keys never show up in metrics."""
+    if api_key:
+        return 'key-' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    return ip
+
 def init_db():
     conn = _db_conn()
     try:
@@ -77,7 +202,7 @@ def init_db():
 
 @app.route('/login')
 def login():
-    flow = Flow.from_client_secrets_file(
+    flow = oauth_flow(
         CLIENT_SECRETS_FILE,
         scopes=SCOPES,
         redirect_uri=url_for('oauth2callback', _external=True)
@@ -95,7 +220,7 @@ def oauth2callback():
     if not state:
         return redirect(url_for('index'))
 
-    flow = Flow.from_client_secrets_file(
+    flow = oauth_flow(
         CLIENT_SECRETS_FILE,
         scopes=SCOPES,
         state=state,
@@ -107,9 +232,7 @@ def oauth2callback():
     credentials = flow.credentials
 
     try:
-        request_session = google.auth.transport.requests.Request()
-        id_info = id_token.verify_oauth2_token(
-            credentials.id_token, request_session, credentials.client_id)
+        id_info = verify_id_token(credentials)
         
         conn = _db_conn()
         try:
@@ -137,7 +260,8 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
-def is_rate_limited(ip: str) -> tuple[bool, str]:
+def is_rate_limited(ip: str, cost: int = 1) -> tuple[bool, str]:
+    """Check and record `cost` requests for ip; a batch counts one request per URL."""
     now = int(time.time())
     window_start = now - RATE_LIMIT_WINDOW_SEC
     conn = _db_conn()
@@ -151,7 +275,9 @@ def is_rate_limited(ip: str) -> tuple[bool, str]:
                 return True, f"Too many requests. Please wait {wait}s before starting another download."
         if len(rows) >= RATE_LIMIT_MAX:
             return True, "Rate limit exceeded. Try again later."
-        conn.execute('INSERT INTO request_log (ip, ts) VALUES (?, ?)', (ip, now))
+        if len(rows) + cost > RATE_LIMIT_MAX:
+            return True, f"Rate limit exceeded: {cost} downloads requested, {RATE_LIMIT_MAX - len(rows)} remaining."
+        conn.executemany('INSERT INTO request_log (ip, ts) VALUES (?, ?)', [(ip, now)] * cost)
         conn.commit()
         return False, ''
     finally:
@@ -407,19 +533,11 @@ def get_youtube_client():
     if 'credentials' not in session:
         return None
     
-    credentials_dict = session['credentials']
-    credentials = Credentials(
-        token=credentials_dict['token'],
-        refresh_token=credentials_dict['refresh_token'],
-        token_uri=credentials_dict['token_uri'],
-        client_id=credentials_dict['client_id'],
-        client_secret=credentials_dict['client_secret'],
-        scopes=credentials_dict['scopes']
-    )
+    credentials = credentials_from_dict(session['credentials'])
     
     if not credentials or not credentials.valid:
         if credentials and credentials.expired and credentials.refresh_token:
-            credentials.refresh(GoogleRequest())
+            credentials.refresh(google_request())
             session['credentials'] = credentials_to_dict(credentials)
     return credentials
 
@@ -443,23 +561,114 @@ def get_info():
                 'cookiesfrombrowser': ('chrome',),
             })
 
-        with YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(url, download=False)
+        try:
+            info = get_metadata(url, ydl_opts, upstream=UPSTREAM, timeout=UPSTREAM_INFO_WAIT_SEC, proxies=PROXIES)
+            return jsonify(info_summary(info))
+        except Exception as e:
+            if 'age-restricted' in str(e).lower() and not credentials:
                 return jsonify({
-                    'title': info.get('title'),
-                    'channel': info.get('uploader'),
-                    'duration': info.get('duration'),
-                    'thumbnail': info.get('thumbnail'),
-                    'age_restricted': info.get('age_limit', 0) > 0
+                    'error': 'This video is age-restricted. Please sign in with Google to access it.',
+                    'requires_auth': True
                 })
-            except Exception as e:
-                if 'age-restricted' in str(e).lower() and not credentials:
-                    return jsonify({
-                        'error': 'This video is age-restricted. Please sign in with Google to access it.',
-                        'requires_auth': True
-                    })
-                raise
+            raise
+    except UpstreamUnavailable as e:
+        return jsonify({'error': str(e), 'retry_after': UPSTREAM.snapshot()['backoff_remaining_sec']}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+def info_summary(info):
+    return {
+        'title': info.get('title'),
+        'channel': info.get('uploader'),
+        'duration': info.get('duration'),
+        'thumbnail': info.get('thumbnail'),
+        'age_restricted': info.get('age_limit', 0) > 0
+    }
+
+@app.route('/info/bulk', methods=['POST'])
+def get_info_bulk():
+    """Extract metadata for many URLs concurrently, streamed back as JSON lines as each one completes."""
+    data = request.get_json(force=True, silent=True) or {}
+    error, urls, concurrency = admit_bulk_info(data, request.headers.get('X-API-Key'), client_ip())
+    if error:
+        return error
+
+    def generate():
+        for record in iter_harvest(urls, concurrency=concurrency, proxies=PROXIES,
+                                   acquire_timeout=UPSTREAM_INFO_WAIT_SEC):
+            yield json.dumps(record) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+def admit_bulk_info(data, header_api_key, client_ip):
+    """Checks for /info/bulk; returns (error response or None, urls, concurrency)."""
+    api_key = data.get('apiKey') or header_api_key
+    if VALID_API_KEYS and api_key not in VALID_API_KEYS:
+        return ('Unauthorized: invalid API key', 401), None, None
+
+    urls = [u.strip() for u in (data.get('urls') or []) if isinstance(u, str) and u.strip()]
+    if not urls:
+        return ('No URLs provided', 400), None, None
+    if len(urls) > BULK_INFO_MAX_URLS:
+        return (f'Too many URLs (max {BULK_INFO_MAX_URLS})', 400), None, None
+    try:
+        concurrency = int(data.get('concurrency') or 8)
+    except (TypeError, ValueError):
+        return ('Invalid concurrency', 400), None, None
+    # Leave at least half of the upstream slots to interactive /info and downloads
+    concurrency = max(1, min(concurrency, BULK_INFO_MAX_CONCURRENCY, UPSTREAM.max_concurrency // 2))
+
+    limited, msg = is_rate_limited(client_ip, -(-len(urls) // max(1, BULK_INFO_URLS_PER_TOKEN)))
+    if limited:
+        return (msg, 429), None, None
+    return None, urls, concurrency
+
+def _float_param(value):
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def select_for_request(url, format_type, quality, fps, max_bytes=None, bandwidth=None, target_seconds=None,
+                       ydl_opts=None, **metadata_kwargs):
+    """Run the size/bandwidth-aware selector when the client sent any constraint, else return None."""
+    if not (max_bytes or (bandwidth and target_seconds)):
+        return None
+    meta = get_metadata(url, ydl_opts, **metadata_kwargs)
+    table = FormatTable.from_formats(meta.get('formats') or [], meta.get('duration'))
+    if format_type == 'audio':
+        return select_audio_format(table, max_bytes, bandwidth, target_seconds)
+    return select_format(
+        table,
+        max_height=int(quality) if quality else None,
+        max_fps=float(fps) if fps else None,
+        max_bytes=max_bytes,
+        bandwidth_bps=bandwidth,
+        target_seconds=target_seconds,
+    )
+
+@app.route('/select')
+def get_selection():
+    """Preview which formats /download would pick for the given size/time constraints."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'No URL provided'})
+    try:
+        selection = select_for_request(
+            url,
+            request.args.get('format', 'video'),
+            request.args.get('quality'),
+            request.args.get('fps'),
+            max_bytes=_float_param(request.args.get('maxBytes')),
+            bandwidth=_float_param(request.args.get('bandwidth')),
+            target_seconds=_float_param(request.args.get('targetSeconds')),
+            upstream=UPSTREAM, timeout=UPSTREAM_INFO_WAIT_SEC, proxies=PROXIES,
+        )
+        if selection is None:
+            return jsonify({'error': 'Provide maxBytes, or bandwidth (bits/s) with targetSeconds'})
+        return jsonify(selection)
+    except UpstreamUnavailable as e:
+        return jsonify({'error': str(e), 'retry_after': UPSTREAM.snapshot()['backoff_remaining_sec']}), 503
     except Exception as e:
         return jsonify({'error': str(e)})
 
@@ -469,7 +678,7 @@ def auth_login():
     client_secrets = os.environ.get('GOOGLE_OAUTH_CLIENT_SECRETS')
     if not client_secrets or not os.path.exists(client_secrets):
         return 'Server not configured for Google OAuth. Set GOOGLE_OAUTH_CLIENT_SECRETS to a client_secret.json path.', 500
-    flow = Flow.from_client_secrets_file(
+    flow = oauth_flow(
         client_secrets,
         scopes=['openid', 'https://www.googleapis.com/auth/userinfo.profile', 'https://www.googleapis.com/auth/userinfo.email']
     )
@@ -484,7 +693,7 @@ def auth_callback():
     if not client_secrets or not os.path.exists(client_secrets):
         return 'Server not configured for Google OAuth.', 500
     state = session.get('oauth_state')
-    flow = Flow.from_client_secrets_file(
+    flow = oauth_flow(
         client_secrets,
         scopes=['openid', 'https://www.googleapis.com/auth/userinfo.profile', 'https://www.googleapis.com/auth/userinfo.email'],
         state=state
@@ -510,144 +719,827 @@ def get_progress():
         return jsonify({'error': 'No URL provided'})
     
     try:
-        with YoutubeDL() as ydl:
-            video_id = ydl.extract_info(url, download=False)['id']
-            return jsonify({
-                'progress': download_progress.get(video_id, 0),
-                'speed': download_speed.get(video_id, 'N/A'),
-                'eta': download_eta.get(video_id, 'N/A')
-            })
+        # Polled every second: resolve the id from the URL (or the metadata cache), never by re-extracting
+        video_id = video_id_from_url(url) or get_metadata(url)['id']
+        return jsonify({
+            'progress': download_progress.get(video_id, 0),
+            'speed': download_speed.get(video_id, 'N/A'),
+            'eta': download_eta.get(video_id, 'N/A')
+        })
     except Exception as e:
         return jsonify({'error': str(e)})
 
-@app.route('/download', methods=['POST'])
-def download():
-    # Check authentication for age-restricted videos
-    credentials = get_youtube_client()
-    
-    # Handle form-data
+def parse_download_request():
+    """Read download parameters from multipart form-data or a JSON body."""
     if request.content_type and 'multipart/form-data' in request.content_type:
-        url = request.form.get('url')
-        format_type = request.form.get('format')
-        quality = request.form.get('quality')
-        fps = request.form.get('fps')
-        audio_quality = request.form.get('audioQuality')
-        api_key = request.form.get('apiKey')
+        data = request.form
     else:
         data = request.get_json(force=True, silent=True) or {}
-        url = data.get('url')
-        format_type = data.get('format')
-        quality = data.get('quality')
-        fps = data.get('fps')
-        audio_quality = data.get('audioQuality')
-        api_key = data.get('apiKey')
-    
-    # Set up cookies for authenticated requests
-    cookies_file = None
-    if credentials:
-        cookies_file = os.path.join(os.path.dirname(__file__), 'youtube.com_cookies.txt')
+    return download_params(data)
 
-    # API key check
-    if VALID_API_KEYS and api_key not in VALID_API_KEYS:
+def download_params(data):
+    return {
+        'url': data.get('url'),
+        'format': data.get('format'),
+        'quality': data.get('quality'),
+        'fps': data.get('fps'),
+        'audioQuality': data.get('audioQuality'),
+        'apiKey': data.get('apiKey'),
+        'maxBytes': _float_param(data.get('maxBytes')),
+        'bandwidth': _float_param(data.get('bandwidth')),
+        'targetSeconds': _float_param(data.get('targetSeconds')),
+        'callbackUrl': data.get('callbackUrl') or None,
+        'callbackSecret': data.get('callbackSecret') or None,
+        'callbackSecretRef': data.get('callbackSecretRef') or None,
+    }
+
+def local_cookie_opts():
+    """yt-dlp cookie options for the server's own browser profile, if one exists."""
+    try:
+        # Prefer Chrome Default profile when available
+        local = os.environ.get('LOCALAPPDATA') or ''
+        chrome_profiles = os.path.join(local, 'Google', 'Chrome', 'User Data')
+        if os.path.isdir(chrome_profiles):
+            return {'cookiesfrombrowser': ('chrome', 'Default')}
+        # Try other Chromium-based or Firefox profiles
+        roaming = os.environ.get('APPDATA') or ''
+        if os.path.isdir(os.path.join(roaming, 'Mozilla', 'Firefox', 'Profiles')):
+            return {'cookiesfrombrowser': ('firefox',)}
+        if os.path.isdir(os.path.join(local, 'Microsoft', 'Edge', 'User Data')):
+            return {'cookiesfrombrowser': ('edge', 'Default')}
+    except Exception:
+        pass
+    return {}
+
+def run_download_job(job):
+    """Scheduler runner: download job.params['url'] into the job's work dir and journal each phase."""
+    # Continues the submitting request's trace, also after a restart (traceparent is journaled)
+    with tracing.span('job.run', parent=job.params.get('traceparent'), job_id=job.id, priority=job.priority,
+                      cost_bytes=int(job.cost), queue_wait_sec=round(time.time() - job.submitted_at, 3)):
+        try:
+            _run_download_job(job)
+        except Exception as e:
+            JOURNAL.set_phase(job.id, 'failed', error=str(e))
+            raise
+        JOURNAL.set_phase(job.id, 'done', result_path=job.result_path)
+
+def _run_download_job(job):
+    params = job.params
+    url = params['url']
+    format_type = params.get('format')
+    quality = params.get('quality')
+    fps = params.get('fps')
+    audio_quality = params.get('audioQuality')
+    selection = params.get('selection')
+
+    # Persistent per-job dir: after a crash the job re-runs here and yt-dlp continues
+    # from its .part/.ytdl files and already finished formats
+    temp_dir = job.work_dir = job.work_dir or os.path.join(JOBS_DIR, job.id)
+    os.makedirs(temp_dir, exist_ok=True)
+    JOURNAL.set_phase(job.id, 'downloading', work_dir=temp_dir)
+    ffmpeg_path = os.path.join(os.path.dirname(__file__), 'ffmpeg-master-latest-win64-gpl', 'bin')
+    cookiefile_path = None
+    # If Google OAuth session has credentials, we rely on authenticated cookies via yt-dlp later (cookiesfrombrowser)
+
+    # Use local browser cookies if available (fixes age-restricted videos)
+    with tracing.span('cookies.detect') as cookie_span:
+        cookie_opts = local_cookie_opts()
+        cookie_span.set(browser=(cookie_opts.get('cookiesfrombrowser') or (None,))[0])
+
+    # Size/bandwidth-aware selection, made here rather than at submission so POST /jobs never waits on
+    # an extraction; the scheduler's upstream gate holds this job's slot until its first bytes arrive
+    if 'selection' not in params:
+        with tracing.span('format.select') as sp:
+            selection = params['selection'] = select_for_request(
+                url, format_type, quality, fps, params.get('maxBytes'), params.get('bandwidth'),
+                params.get('targetSeconds'), ydl_opts=cookie_opts, proxies=PROXIES,
+            )
+            sp.set(format_id=(selection or {}).get('format'))
+    # The exact ids go first, the usual chain stays as fallback
+    selected_format = selection['format'] + '/' if selection and selection.get('format') else ''
+
+    # Fragments, intermediate streams and the merge go to RAM when the job fits the scratch budget;
+    # yt-dlp then moves only the final file into the job dir
+    scratch_dir = SCRATCH.reserve(job.id, predicted_job_bytes(job, cookie_opts))
+    paths = {'home': temp_dir, 'temp': scratch_dir} if scratch_dir else {'home': temp_dir}
+
+    def job_progress_hook(d):
+        if job.cancel_requested:
+            from yt_dlp.utils import DownloadCancelled
+            raise DownloadCancelled('Cancelled')
+        progress_hook(d)
+        if d['status'] == 'downloading':
+            # Extraction succeeded and media is flowing: the upstream slot is for the next job's
+            # extraction, not for the rest of this transfer (or a half-open probe would be a whole download)
+            job.release_gate()
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            job.progress = (d.get('downloaded_bytes', 0) / total * 100) if total else 0.0
+            job.speed = d.get('speed_str', d.get('_speed_str'))
+            job.eta = d.get('eta_str', d.get('_eta_str'))
+        elif d['status'] == 'finished':
+            job.progress = 100.0
+
+    def job_postprocessor_hook(d):
+        if job.cancel_requested:
+            from yt_dlp.utils import DownloadCancelled
+            raise DownloadCancelled('Cancelled')
+        if d['status'] == 'started' and job.status != 'postprocessing':
+            job.status = 'postprocessing'
+            JOURNAL.set_phase(job.id, 'postprocessing')
+
+    if format_type == 'audio':
+        output_template = '%(title)s.%(ext)s'
+        ydl_opts = {
+            'format': selected_format + 'bestaudio',
+            'ffmpeg_location': ffmpeg_path,
+            'outtmpl': output_template,
+            'paths': paths,
+            'quiet': False,
+            'progress_hooks': [job_progress_hook],
+            'postprocessor_hooks': [job_postprocessor_hook],
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': audio_quality,
+            }],
+        }
+    else:
+        output_template = '%(title)s_%(height)sp%(fps)s.%(ext)s'
+        # Create format string based on quality and fps
+        format_str = selected_format + (
+            f'bestvideo[height<={quality}][fps<={fps}][ext=mp4]+'
+            'bestaudio[ext=m4a]/'
+            f'bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/'
+            f'best[height<={quality}]'
+        )
+
+        ydl_opts = {
+            'format': format_str,
+            'ffmpeg_location': ffmpeg_path,
+            'outtmpl': output_template,
+            'paths': paths,
+            'quiet': False,
+            'progress_hooks': [job_progress_hook],
+            'postprocessor_hooks': [job_postprocessor_hook],
+            'merge_output_format': 'mp4',
+            'postprocessors': [{
+                'key': 'FFmpegVideoConvertor',
+                'preferedformat': 'mp4',
+            }],
+        }
+    # Common hardening + aria2c (server-side: enable if available)
+    ydl_opts = apply_common_ydl_hardening(ydl_opts, ffmpeg_path, cookiefile_path, use_aria2c=True)
+    # Fewer, slower retries while upstream is throttling us
+    ydl_opts.update(UPSTREAM.ydl_overrides())
+    # The final path comes from yt-dlp's hooks, so concurrent jobs never scan for files
+    result = DownloadResult().attach(ydl_opts)
+    # Hash bytes as they are written; aria2c writes out of order, so it gets one hash pass at the end
+    hasher = IncrementalHasher()
+    if not ydl_opts.get('external_downloader'):
+        ydl_opts['progress_hooks'].append(hasher.progress_hook())
+    ydl_opts.update(cookie_opts)
+    if scratch_dir:
+        ydl_opts['progress_hooks'].append(SCRATCH.progress_hook(job.id))
+
+    # Per-client fair share of the uplink, re-balanced as jobs start and finish
+    lease = INGRESS.acquire(job.client)
+    try:
+        if INGRESS.enabled:
+            ydl_opts['progress_hooks'].append(lease.progress_hook())
+        # Spread jobs across the egress proxy pool (direct connection when none is configured)
+        with PROXIES.lease() as proxy:
+            if proxy:
+                ydl_opts['proxy'] = proxy.url
+                ydl_opts['progress_hooks'].append(proxy.progress_hook())
+            download_span = tracing.span('ydl.download', format=ydl_opts['format'], proxy=bool(proxy),
+                                         scratch=bool(scratch_dir), downloader=ydl_opts.get('external_downloader') or 'native')
+            tracing.instrument_ydl(ydl_opts, parent=download_span)
+            with download_span:
+                # Building YoutubeDL loads the extractors and any browser cookies
+                with tracing.span('ydl.init'):
+                    from yt_dlp import YoutubeDL
+                    ydl = YoutubeDL(ydl_opts)
+                with ydl:
+                    lease.bind_params(ydl.params)
+                    try:
+                        ydl.download([url])
+                    except Exception:
+                        if not SCRATCH.overrun(job.id):
+                            raise
+                if SCRATCH.overrun(job.id):
+                    # Bigger than predicted: drop what was staged in RAM and download again on disk
+                    SCRATCH.release(job.id)
+                    ydl_opts['paths'] = {'home': temp_dir}
+                    download_span.set(scratch=False, scratch_overrun=True)
+                    with YoutubeDL(ydl_opts) as ydl:
+                        lease.bind_params(ydl.params)
+                        ydl.download([url])
+    finally:
+        lease.release()
+        SCRATCH.release(job.id)
+
+    # Hashing, dedup and the storage upload do not touch the upstream
+    job.release_gate()
+    # yt-dlp can swallow DownloadCancelled and return normally
+    if job.cancel_requested:
+        raise RuntimeError('Cancelled')
+    job.result_path = result.path
+    if not job.result_path:
+        raise RuntimeError('Download failed')
+    # Stored next to the artifact; identical outputs share one copy on disk
+    with tracing.span('artifact.digests') as sp:
+        digests = artifact_digests(job.result_path, hasher)
+        sp.set(bytes=digests['size'])
+    # Batch artifacts and uploads that are deleted locally do not stay on disk, and a
+    # .by-digest link would keep their bytes around until the next prune
+    if not params.get('batch') and not (STORAGE is not None and STORAGE_DELETE_LOCAL):
+        with tracing.span('artifact.dedup') as sp:
+            sp.set(shared=DEDUP.link(job.result_path, digests))
+    # Park the artifact in shared storage so any node (or the object store itself) can serve it;
+    # batch artifacts are streamed and deleted right away, so they skip this
+    if STORAGE is not None and not params.get('batch'):
+        with tracing.span('storage.put', backend=type(STORAGE).__name__, bytes=digests['size']):
+            STORAGE.put(job.result_path, storage_key(job), digests)
+        if STORAGE_DELETE_LOCAL:
+            os.remove(job.result_path)
+
+def predicted_job_bytes(job, cookie_opts):
+    """Expected download size from the job's selection or cached metadata, None when unknown.
+
+    Unlike job.cost this is never the scheduler's neutral stand-in, so it can size a RAM reservation.
+    """
+    selection = job.params.get('selection') or {}
+    if selection.get('predicted_bytes'):
+        return selection['predicted_bytes']
+    cached = METADATA_CACHE.get(cache_key(job.params['url'], cookie_opts))
+    if not cached:
+        return None
+    try:
+        return predict_job_cost(cached, job.params) or None
+    except Exception:
+        return None
+
+def storage_key(job):
+    return f'{job.id}/{os.path.basename(job.result_path)}'
+
+os.makedirs(JOBS_DIR, exist_ok=True)
+JOURNAL = JobJournal(JOB_JOURNAL_PATH, lease_sec=JOB_LEASE_SEC)
+WEBHOOK_KEY = load_signing_key(os.path.join(JOBS_DIR, '.webhook_key'))
+DEDUP = DedupStore(os.path.join(JOBS_DIR, '.by-digest'))
+STORAGE = store_from_env()
+DELIVERY = Delivery(
+    os.environ.get('DELIVERY_MODE', 'send_file'),
+    parse_redirect_map(os.environ.get('ACCEL_REDIRECT_MAP', f'{JOBS_DIR}=/_jobs/')),
+)
+def on_job_finished(job):
+    """Scheduler finish hook, for every terminal status: journal it, then send the webhook."""
+    # A job cancelled while queued never reaches run_download_job; left 'queued', it would be resumed
+    JOURNAL.set_phase(job.id, job.status, error=job.error, result_path=job.result_path)
+    notify_job_callback(job)
+
+def notify_job_callback(job):
+    """Queue the job's completion/failure webhook, if the client asked for one."""
+    callback_url = job.params.get('callbackUrl')
+    if not callback_url:
+        return
+    payload = {
+        'id': job.id,
+        'status': job.status,
+        'url': job.params.get('url'),
+        'error': job.error,
+        'file_url': job.params.get('fileUrl') if job.status == 'done' else None,
+        'filename': os.path.basename(job.result_path) if job.result_path else None,
+        'bytes': os.path.getsize(job.result_path) if job.result_path and os.path.exists(job.result_path) else None,
+        'submitted_at': job.submitted_at,
+        'finished_at': job.finished_at,
+    }
+    WEBHOOKS.send(callback_url, payload, callback_secret(job))
+
+def callback_secret(job):
+    """Webhook signing secret: the named server-side secret, else one derived from the job id."""
+    ref = job.params.get('callbackSecretRef')
+    return WEBHOOK_SECRETS.get(ref) if ref else job_signing_key(WEBHOOK_KEY, job.id)
+
+def callback_secret_fields(job):
+    """What the submitter needs to verify its webhook; the derived key is only ever handed out here."""
+    if not job.params.get('callbackUrl') or job.params.get('callbackSecretRef'):
+        return {}
+    return {'callback_secret': callback_secret(job)}
+
+DOWNLOAD_SCHEDULER = scheduler_from_env(run_download_job, gate=UPSTREAM, on_finish=on_job_finished)
+API_KEY_PRIORITIES = parse_priority_classes(os.environ.get('API_KEY_PRIORITIES', ''), VALID_API_KEYS)
+
+COST_ESTIMATOR = ThreadPoolExecutor(max_workers=max(1, JOB_COST_WORKERS), thread_name_prefix='job-cost')
+
+def estimate_job_cost(job):
+    """Background: extract the job's metadata through the upstream gate and proxies, then re-key it.
+
+    On failure the job keeps its neutral cost, so a broken or unavailable URL never
+    jumps the queue; yt-dlp reports the real error when the job runs.
+    """
+    with tracing.span('job.estimate', parent=job.params.get('traceparent'), job_id=job.id) as sp:
+        try:
+            meta = get_metadata(job.params['url'], local_cookie_opts(), upstream=UPSTREAM,
+                                timeout=UPSTREAM_INFO_WAIT_SEC, proxies=PROXIES)
+            cost = predict_job_cost(meta, job.params)
+        except Exception as e:
+            sp.set(error=str(e))
+            return
+        sp.set(cost_bytes=int(cost))
+    if cost and DOWNLOAD_SCHEDULER.update_cost(job.id, cost):
+        JOURNAL.set_cost(job.id, cost)
+
+def submit_download_job(params, client_ip, file_url=None):
+    """Pick the job's priority class and queue it on the shared scheduler without extracting anything.
+
+    The cost comes from cached metadata when there is some; otherwise the job is
+    queued at the median cost of known jobs and estimated in the background.
+    file_url(job_id) gives the absolute artifact URL for webhooks; defaults to this app's url_for.
+    """
+    params = dict(params)
+    api_key = params.pop('apiKey', None)
+    params.pop('callbackSecret', None)
+    cached = METADATA_CACHE.get(cache_key(params['url'], local_cookie_opts()))
+    try:
+        cost = predict_job_cost(cached, params) if cached else 0
+    except Exception:
+        cost = 0
+    job = Job(params, client=client_id(api_key, client_ip), priority=API_KEY_PRIORITIES.get(api_key, 'normal'),
+              cost=cost or DOWNLOAD_SCHEDULER.typical_cost(JOB_DEFAULT_COST_BYTES))
+    job.work_dir = os.path.join(JOBS_DIR, job.id)
+    if tracing.traceparent():
+        params['traceparent'] = tracing.traceparent()
+    if params.get('callbackUrl'):
+        params['fileUrl'] = file_url(job.id) if file_url else url_for('job_file', job_id=job.id, _external=True)
+    # Journal before queueing so a crash can never lose an accepted job
+    JOURNAL.record(job)
+    DOWNLOAD_SCHEDULER.start().submit(job)
+    if not cost:
+        COST_ESTIMATOR.submit(estimate_job_cost, job)
+    return job
+
+_JOURNAL_STATUS = {'queued': 'queued', 'downloading': 'running', 'postprocessing': 'postprocessing',
+                   'done': 'done', 'failed': 'failed', 'cancelled': 'cancelled'}
+
+def _job_from_journal(row):
+    job = Job(row['params'], client=row['client'], priority=row['priority'], cost=row['cost'], job_id=row['id'])
+    job.work_dir = row['work_dir']
+    job.submitted_at = row['created_at']
+    if row['phase'] in FINISHED_PHASES:
+        job.status = _JOURNAL_STATUS[row['phase']]
+        job.result_path = row['result_path']
+        job.error = row['error']
+        job.progress = 100.0 if row['phase'] == 'done' else 0.0
+        job.finished_at = row['updated_at']
+    return job
+
+def lookup_job(job_id):
+    """A job from this process's scheduler, else from the journal (e.g. owned by another worker process)."""
+    job = DOWNLOAD_SCHEDULER.get(job_id)
+    if job:
+        return job
+    row = JOURNAL.load(job_id)
+    if not row:
+        return None
+    job = _job_from_journal(row)
+    job.status = _JOURNAL_STATUS.get(row['phase'], row['phase'])
+    return job
+
+def _purge_stored_artifact(row):
+    if STORAGE is not None and row['result_path']:
+        STORAGE.delete(f"{row['id']}/{os.path.basename(row['result_path'])}")
+
+def artifact_available(job):
+    if job.result_path and os.path.exists(job.result_path):
+        return True
+    return STORAGE is not None and bool(job.result_path) and STORAGE.exists(storage_key(job))
+
+def enforce_retention():
+    """Drop finished jobs older than JOB_RETENTION_SEC, digest links nothing uses any more
+    and scratch dirs of jobs no process owns."""
+    JOURNAL.purge(time.time() - JOB_RETENTION_SEC, on_purge=_purge_stored_artifact)
+    DEDUP.prune()
+    SCRATCH.sweep(JOURNAL.active_ids())
+
+def requeue_interrupted():
+    """Re-queue jobs whose owner died (its lease expired, or its PID is gone on this node)."""
+    resumed = 0
+    for row in JOURNAL.claim_interrupted():
+        if row['params'].get('batch'):
+            # The ZIP stream that would have consumed it is gone with its process
+            JOURNAL.set_phase(row['id'], 'failed', error='Batch download interrupted')
+            if row['work_dir']:
+                shutil.rmtree(row['work_dir'], ignore_errors=True)
+            continue
+        DOWNLOAD_SCHEDULER.start().submit(_job_from_journal(row))
+        resumed += 1
+    if resumed:
+        print(f'Resuming {resumed} interrupted download job(s)')
+    return resumed
+
+def resume_journaled_jobs():
+    """Startup recovery: drop expired jobs, re-register finished artifacts and re-queue interrupted jobs."""
+    # Journals written before webhook secrets were derived per job held them in plaintext,
+    # and jobs were owned by the raw API key
+    JOURNAL.drop_param('callbackSecret')
+    for api_key in VALID_API_KEYS:
+        JOURNAL.rename_client(api_key, client_id(api_key, None))
+    enforce_retention()
+    for row in JOURNAL.completed():
+        job = _job_from_journal(row)
+        if artifact_available(job):
+            DOWNLOAD_SCHEDULER.restore(job)
+    requeue_interrupted()
+    start_job_maintenance()
+
+def _job_maintenance_loop():
+    next_retention = time.monotonic() + JOB_RETENTION_CHECK_SEC
+    while True:
+        time.sleep(JOB_HEARTBEAT_SEC)
+        try:
+            JOURNAL.heartbeat()
+            # Picks up jobs of a sibling process or node that died after this one started
+            requeue_interrupted()
+            if time.monotonic() >= next_retention:
+                next_retention = time.monotonic() + JOB_RETENTION_CHECK_SEC
+                enforce_retention()
+        except Exception as e:
+            print(f'Job maintenance failed: {e}')
+
+_maintenance_thread = None
+_maintenance_lock = Lock()
+
+def start_job_maintenance():
+    """Lease heartbeats, takeover of dead owners' jobs and retention, for as long as the process lives."""
+    global _maintenance_thread
+    with _maintenance_lock:
+        if _maintenance_thread is None:
+            _maintenance_thread = Thread(target=_job_maintenance_loop, name='job-maintenance', daemon=True)
+            _maintenance_thread.start()
+
+_recovery_lock = Lock()
+_recovered = False
+
+@app.before_request
+def _recover_jobs_once():
+    # Runs in the process that actually serves requests (not the reloader parent),
+    # under any WSGI server
+    global _recovered
+    if _recovered:
+        return
+    with _recovery_lock:
+        if not _recovered:
+            _recovered = True
+            resume_journaled_jobs()
+            warm_imports()
+
+def send_job_file(job, client):
+    # Ends when the server has finished sending the body, not when this function returns
+    send_span = tracing.span('http.send', job_id=job.id)
+    response = _send_job_file(job, client, send_span)
+    send_span.set(status=response.status_code, bytes=response.content_length)
+    if send_span and response.direct_passthrough:
+        # call_on_close is skipped for passthrough bodies (send_file); close the span with the body instead.
+        # Only while tracing, as it hides the file wrapper from servers that would sendfile() it
+        response.response = ClosingIterator(response.response, send_span.end)
+    elif response.is_streamed:
+        response.call_on_close(send_span.end)
+    else:
+        send_span.end()
+    return response
+
+def _send_job_file(job, client, send_span):
+    path = job.result_path
+    filename = os.path.basename(job.result_path)
+    if STORAGE is not None and not job.params.get('batch'):
+        redirect_url = STORAGE.url(storage_key(job), filename)
+        if redirect_url:
+            # The object store serves the bytes; the app only hands out a short-lived URL
+            send_span.set(mode='storage_redirect')
+            return redirect(redirect_url, code=302)
+        if not os.path.exists(path):
+            path = STORAGE.local_path(storage_key(job))
+    # Cheap when the sidecar is current; re-hashes (and so re-verifies) a file that changed on disk
+    digests = artifact_digests(path)
+    headers = http_headers(digests)
+    if request.if_none_match.contains(digests['sha256']):
+        return Response(status=304, headers=headers)
+    # Authorized: let the front proxy stream the file when configured to
+    response = DELIVERY.response(path, filename)
+    send_span.set(mode=DELIVERY.mode if response is not None else ('egress' if EGRESS.enabled else 'send_file'))
+    if response is None and EGRESS.enabled:
+        # Paced stream sharing the egress capacity fairly between clients
+        response = Response(EGRESS.stream_file(path, client), mimetype='application/octet-stream')
+        response.headers['Content-Length'] = str(os.path.getsize(path))
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    elif response is None:
+        response = send_file(
+            path,
+            as_attachment=True,
+            download_name=filename,
+            etag=False,
+        )
+    response.headers.update(headers)
+    selection = job.params.get('selection')
+    if selection:
+        response.headers['X-Format-Selection'] = json.dumps({
+            k: selection.get(k) for k in ('format', 'predicted_bytes', 'predicted_seconds', 'within_budget')
+        })
+    return response
+
+def _admit_download(params):
+    """API key and rate limit checks shared by /download and /jobs; returns an error response or None."""
+    return admit_download(params, client_ip())
+
+def admit_download(params, client_ip, count=1):
+    if VALID_API_KEYS and params.get('apiKey') not in VALID_API_KEYS:
         return 'Unauthorized: invalid API key', 401
 
-    # Rate limiting by IP
-    client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-    limited, msg = is_rate_limited(client_ip)
+    # Rate limiting by IP, one token per download
+    limited, msg = is_rate_limited(client_ip, count)
     if limited:
         return msg, 429
-    
-    if not url:
+
+    if not params.get('url'):
         return 'No URL provided', 400
-    
-    try:
-        temp_dir = tempfile.mkdtemp()
-        ffmpeg_path = os.path.join(os.path.dirname(__file__), 'ffmpeg-master-latest-win64-gpl', 'bin')
-        cookiefile_path = None
-        # If Google OAuth session has credentials, we rely on authenticated cookies via yt-dlp later (cookiesfrombrowser)
-        
-        if format_type == 'audio':
-            output_template = os.path.join(temp_dir, '%(title)s.%(ext)s')
-            ydl_opts = {
-                'format': 'bestaudio',
-                'ffmpeg_location': ffmpeg_path,
-                'outtmpl': output_template,
-                'quiet': False,
-                'progress_hooks': [progress_hook],
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': audio_quality,
-                }],
-            }
-        else:
-            output_template = os.path.join(temp_dir, '%(title)s_%(height)sp%(fps)s.%(ext)s')
-            # Create format string based on quality and fps
-            format_str = (
-                f'bestvideo[height<={quality}][fps<={fps}][ext=mp4]+'
-                'bestaudio[ext=m4a]/'
-                f'bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/'
-                f'best[height<={quality}]'
-            )
-            
-            ydl_opts = {
-                'format': format_str,
-                'ffmpeg_location': ffmpeg_path,
-                'outtmpl': output_template,
-                'quiet': False,
-                'progress_hooks': [progress_hook],
-                'merge_output_format': 'mp4',
-                'postprocessors': [{
-                    'key': 'FFmpegVideoConvertor',
-                    'preferedformat': 'mp4',
-                }],
-            }
-        # Common hardening + aria2c (server-side: enable if available)
-        ydl_opts = apply_common_ydl_hardening(ydl_opts, ffmpeg_path, cookiefile_path, use_aria2c=True)
-        # Use local browser cookies if available (fixes age-restricted videos)
+    callback_error = params.get('callbackUrl') and callback_url_error(params['callbackUrl'])
+    if callback_error:
+        return f'Invalid callbackUrl: {callback_error}', 400
+    if params.get('callbackSecret'):
+        # Never journaled: sign with the per-job callback_secret from the response, or a server-side secret
+        return 'callbackSecret is not accepted; use the callback_secret returned for the job or callbackSecretRef', 400
+    if params.get('callbackSecretRef') and params['callbackSecretRef'] not in WEBHOOK_SECRETS:
+        return 'Unknown callbackSecretRef', 400
+    return None
+
+@app.route('/download', methods=['POST'])
+def download():
+    # Check authentication for age-restricted videos
+    get_youtube_client()
+
+    params = parse_download_request()
+    with tracing.span('http.download', parent=request.headers.get('traceparent'),
+                      url=params.get('url'), format=params.get('format')) as sp:
+        error = _admit_download(params)
+        if error:
+            sp.set(rejected=error[1])
+            return error
+
         try:
-            # Prefer Chrome Default profile when available
-            local = os.environ.get('LOCALAPPDATA') or ''
-            chrome_profiles = os.path.join(local, 'Google', 'Chrome', 'User Data')
-            if os.path.isdir(chrome_profiles):
-                ydl_opts['cookiesfrombrowser'] = ('chrome', 'Default')
-            else:
-                # Try other Chromium-based or Firefox profiles
-                roaming = os.environ.get('APPDATA') or ''
-                if os.path.isdir(os.path.join(roaming, 'Mozilla', 'Firefox', 'Profiles')):
-                    ydl_opts['cookiesfrombrowser'] = ('firefox',)
-                elif os.path.isdir(os.path.join(local, 'Microsoft', 'Edge', 'User Data')):
-                    ydl_opts['cookiesfrombrowser'] = ('edge', 'Default')
-        except Exception:
-            pass
-        
-        # Configure ffmpeg path
-        ffmpeg_path = os.path.join(os.path.dirname(__file__), 'ffmpeg-master-latest-win64-gpl', 'bin')
-        ydl_opts['ffmpeg_location'] = ffmpeg_path
-        
-        with YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-            
-        # Find the downloaded file
-        downloaded_file = None
-        for file in os.listdir(temp_dir):
-            if format_type == 'audio' and file.endswith('.mp3'):
-                downloaded_file = os.path.join(temp_dir, file)
-                break
-            elif format_type == 'video' and file.endswith('.mp4'):
-                downloaded_file = os.path.join(temp_dir, file)
-                break
-        
-        if downloaded_file and os.path.exists(downloaded_file):
-            return send_file(
-                downloaded_file,
-                as_attachment=True,
-                download_name=os.path.basename(downloaded_file)
-            )
-        
-        return 'Download failed', 500
+            job = submit_download_job(params, client_ip())
+            sp.set(job_id=job.id)
+            job.wait()
+            if job.status == 'done' and artifact_available(job):
+                response = send_job_file(job, job.client)
+                if 'callback_secret' in callback_secret_fields(job):
+                    response.headers['X-Webhook-Secret'] = callback_secret(job)
+                return response
+            sp.fail(job.error or 'Download failed')
+            return job.error or 'Download failed', 500
+        except Exception as e:
+            sp.fail(e)
+            return str(e), 500
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a download and return immediately; poll /jobs/<id> and fetch /jobs/<id>/file when done."""
+    get_youtube_client()
+    params = parse_download_request()
+    error = _admit_download(params)
+    if error:
+        return error
+    try:
+        with tracing.span('http.jobs.create', parent=request.headers.get('traceparent'), url=params.get('url')):
+            job = submit_download_job(params, client_ip())
     except Exception as e:
         return str(e), 500
+    body = job.to_dict()
+    body.update(callback_secret_fields(job))
+    body['queue_position'] = DOWNLOAD_SCHEDULER.queue_position(job.id)
+    body['status_url'] = url_for('job_status', job_id=job.id)
+    body['file_url'] = url_for('job_file', job_id=job.id)
+    return jsonify(body), 202
+
+@app.route('/jobs', methods=['GET'])
+def jobs_stats():
+    return jsonify(DOWNLOAD_SCHEDULER.stats())
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = lookup_job(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    body = job.to_dict()
+    if job.status == 'queued':
+        body['queue_position'] = DOWNLOAD_SCHEDULER.queue_position(job.id)
+    return jsonify(body)
+
+@app.route('/jobs/<job_id>/file')
+def job_file(job_id):
+    job = lookup_job(job_id)
+    if not job:
+        return 'Unknown job', 404
+    if job.status != 'done':
+        return f'Job is {job.status}', 409
+    if not artifact_available(job):
+        return 'Artifact no longer available', 410
+    return send_job_file(job, client_ip())
+
+@app.route('/download/batch', methods=['POST'])
+def download_batch():
+    """Download many URLs with the same options and stream the results back as one ZIP."""
+    get_youtube_client()
+    data = request.get_json(force=True, silent=True) or {}
+    urls, base = batch_params(data)
+    if len(urls) > BATCH_MAX_URLS:
+        return f'Too many URLs (max {BATCH_MAX_URLS})', 400
+    error = admit_download(dict(base, url=urls[0] if urls else None), client_ip(), count=len(urls))
+    if error:
+        return error
+    response = Response(batch_zip(urls, base, client_ip()), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="batch.zip"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def batch_params(data):
+    urls = [u.strip() for u in (data.get('urls') or []) if isinstance(u, str) and u.strip()]
+    base = {
+        'batch': True,
+        'format': data.get('format') or 'audio',
+        'quality': data.get('quality'),
+        'fps': data.get('fps'),
+        'audioQuality': data.get('audioQuality'),
+        'apiKey': data.get('apiKey'),
+        'maxBytes': _float_param(data.get('maxBytes')),
+        'bandwidth': _float_param(data.get('bandwidth')),
+        'targetSeconds': _float_param(data.get('targetSeconds')),
+    }
+    return urls, base
+
+def batch_zip(urls, base, client_ip):
+    """ZIP stream of the batch's artifacts in completion order, ending with batch_report.json."""
+    # Only BATCH_WINDOW jobs are queued or unsent at any time, and each artifact is deleted
+    # once it has been written to the stream, so disk use does not grow with the batch
+    pending = list(urls)
+    in_flight = []
+    report = []
+
+    def fill_window():
+        while pending and len(in_flight) < max(1, BATCH_WINDOW):
+            url = pending.pop(0)
+            try:
+                in_flight.append(submit_download_job(dict(base, url=url), client_ip))
+            except Exception as e:
+                report.append({'url': url, 'status': 'failed', 'error': str(e)})
+
+    def finished_files():
+        fill_window()
+        while in_flight:
+            done = next((j for j in in_flight if j.finished), None)
+            if done is None:
+                in_flight[0].wait(0.25)
+                continue
+            in_flight.remove(done)
+            fill_window()
+            entry = {'url': done.params['url'], 'status': done.status, 'error': done.error}
+            report.append(entry)
+            try:
+                if done.status == 'done' and done.result_path and os.path.exists(done.result_path):
+                    entry['file'] = os.path.basename(done.result_path)
+                    yield entry['file'], done.result_path
+            finally:
+                # Also when the client disconnects while this file is being streamed
+                discard_work_dir(done)
+        yield 'batch_report.json', json.dumps(report, indent=2).encode('utf-8')
+
+    lease = EGRESS.acquire(client_ip) if EGRESS.enabled else None
+    try:
+        for chunk in stream_zip(finished_files()):
+            if lease:
+                lease.consume(len(chunk))
+            yield chunk
+    finally:
+        if lease:
+            lease.release()
+        # Client went away: drop jobs that have not started, stop the running ones, and
+        # remove each job's files once it has actually finished
+        for job in in_flight:
+            if not DOWNLOAD_SCHEDULER.cancel(job.id):
+                job.request_cancel()
+            job.add_done_callback(discard_work_dir)
+
+def discard_work_dir(job):
+    if job.work_dir:
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+@app.route('/metrics/upstream')
+def upstream_metrics():
+    return jsonify(UPSTREAM.snapshot())
+
+@app.route('/metrics/proxies')
+def proxy_metrics():
+    return jsonify(PROXIES.snapshot())
+
+@app.route('/metrics/webhooks')
+def webhook_metrics():
+    denied = metrics_denied(request.headers)
+    if denied:
+        return denied
+    return jsonify(WEBHOOKS.snapshot())
+
+@app.route('/metrics/scratch')
+def scratch_metrics():
+    return jsonify(SCRATCH.snapshot())
+
+@app.route('/metrics/bandwidth')
+def bandwidth_metrics():
+    denied = metrics_denied(request.headers)
+    if denied:
+        return denied
+    return jsonify({'ingress': INGRESS.snapshot(), 'egress': EGRESS.snapshot()})
+
+def metrics_denied(headers):
+    """None if the caller may read per-client metrics: a valid API key or DEBUG_TOKEN.
+
+    Open only when the server has neither configured, like the download routes.
+    """
+    if profiling.check_token(headers.get('X-Debug-Token') or headers.get('Authorization')):
+        return None
+    if VALID_API_KEYS and headers.get('X-API-Key') in VALID_API_KEYS:
+        return None
+    if not VALID_API_KEYS and not profiling.debug_enabled():
+        return None
+    return 'Unauthorized', 401
+
+def debug_denied(headers):
+    """None if the debug endpoints are enabled and the request carries DEBUG_TOKEN, else an error reply."""
+    if not profiling.debug_enabled():
+        return 'Not found', 404
+    if not profiling.check_token(headers.get('X-Debug-Token') or headers.get('Authorization')):
+        return 'Unauthorized', 401
+    return None
+
+def debug_gauges():
+    """Sizes of the process-wide maps and caches, to put next to a memory diff."""
+    return {
+        'download_progress': len(download_progress),
+        'download_speed': len(download_speed),
+        'download_eta': len(download_eta),
+        'metadata_cache': METADATA_CACHE.stats(),
+        'scheduler': DOWNLOAD_SCHEDULER.stats(),
+        'scratch': SCRATCH.snapshot(),
+        'jobs_dir_entries': len(os.listdir(JOBS_DIR)) if os.path.isdir(JOBS_DIR) else 0,
+        'process': profiling.process_memory(),
+    }
+
+def capture_profile(args):
+    """Run the sampling profiler per ?seconds=&interval_ms=&include_idle=; returns (collapsed text, headers)."""
+    try:
+        interval = float(args.get('interval_ms') or 5) / 1000
+    except ValueError:
+        interval = 0.005
+    profile = profiling.sample_stacks(profiling.clamp_seconds(args.get('seconds'), 10), interval,
+                                      skip_idle=args.get('include_idle', '0') != '1')
+    headers = {
+        'Content-Disposition': 'attachment; filename="profile.collapsed"',
+        'X-Profile-Samples': str(profile['samples']),
+        'X-Profile-Elapsed-Sec': str(profile['elapsed_sec']),
+    }
+    return profiling.collapsed(profile), headers
+
+def capture_memory(args):
+    """tracemalloc growth over ?seconds= (default 10), top ?top= entries grouped by ?key=."""
+    try:
+        top = max(1, min(int(args.get('top') or 25), 500))
+    except ValueError:
+        top = 25
+    result = profiling.memory_diff(profiling.clamp_seconds(args.get('seconds'), 10), top,
+                                   args.get('key') or 'lineno')
+    result['gauges'] = debug_gauges()
+    return result
+
+@app.route('/debug/profile')
+def debug_profile():
+    denied = debug_denied(request.headers)
+    if denied:
+        return denied
+    try:
+        body, headers = capture_profile(request.args)
+    except profiling.ProfilerBusy as e:
+        return str(e), 409
+    return Response(body, mimetype='text/plain', headers=headers)
+
+@app.route('/debug/memory')
+def debug_memory():
+    denied = debug_denied(request.headers)
+    if denied:
+        return denied
+    try:
+        return jsonify(capture_memory(request.args))
+    except profiling.ProfilerBusy as e:
+        return str(e), 409
+    except ValueError as e:
+        return str(e), 400
 
 if __name__ == '__main__':
     # Configure ffmpeg path
@@ -0,0 +1,614 @@
+# Asyncio (ASGI) serving mode for web_app2: the same routes on Quart, so an idle
+# progress stream or a slow file transfer costs a coroutine instead of an OS thread.
+# Jobs, journal, storage and rate limiting are shared with web_app2; only the
+# request handling is async. Run with `hypercorn web_app_async:app` or
+# `python web_app_async.py` (one process, one event loop).
+import asyncio
+import contextvars
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, Response, jsonify, redirect, render_template_string, request, send_file, session, url_for
+from quart.wrappers.response import FileBody
+import web_app2 as core
+from bandwidth import EGRESS, INGRESS
+from integrity import artifact_digests, http_headers
+from metadata import get_metadata, iter_harvest, video_id_from_url
+from proxy_pool import PROXIES
+from scratch import SCRATCH
+from upstream_health import UPSTREAM, UpstreamUnavailable
+from webhooks import WEBHOOKS
+import tracing
+import profiling
+
+ASYNC_BLOCKING_WORKERS = int(os.environ.get('ASYNC_BLOCKING_WORKERS', '64'))
+PROGRESS_STREAM_INTERVAL_SEC = float(os.environ.get('PROGRESS_STREAM_INTERVAL_SEC', '1'))
+FILE_CHUNK = 256 * 1024
+
+# Metadata extraction, SQLite, OAuth calls, hashing and file reads. Downloads (and the
+# ffmpeg/aria2c processes yt-dlp starts) run on the job scheduler's own worker threads.
+BLOCKING = ThreadPoolExecutor(ASYNC_BLOCKING_WORKERS, thread_name_prefix='async-blocking')
+_END = object()
+_open_streams = {'progress': 0, 'transfers': 0}
+
+
+class _FileBody(FileBody):
+    # Quart reads files through aiofiles one buffer at a time; 8 KiB means a thread hop per 8 KiB
+    buffer_size = FILE_CHUNK
+    # Ended once the body has been sent
+    trace_span = tracing.NOOP
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await super().__aexit__(exc_type, exc_value, tb)
+        self.trace_span.end()
+
+
+class _Response(Response):
+    file_body_class = _FileBody
+
+
+app = Quart(__name__)
+app.response_class = _Response
+app.secret_key = core.app.secret_key
+# Downloads and progress streams legitimately stay open for a long time
+app.config['RESPONSE_TIMEOUT'] = None
+
+
+async def blocking(fn, *args, **kwargs):
+    # Carry contextvars (the current trace span) over to the executor thread
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(BLOCKING, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+async def iterate_blocking(iterator):
+    """Consume a blocking iterator from the event loop, one next() per executor call.
+
+    If the client goes away the generator is closed (running its cleanup) on the
+    executor, after any next() still in progress has returned.
+    """
+    pending = None
+    try:
+        while True:
+            pending = BLOCKING.submit(next, iterator, _END)
+            item = await asyncio.wrap_future(pending)
+            if item is _END:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            if pending is None or pending.done():
+                BLOCKING.submit(close)
+            else:
+                pending.add_done_callback(lambda _f: BLOCKING.submit(close))
+
+
+async def wait_job(job):
+    """Wait for a scheduler job without tying up a thread."""
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def wake(_job):
+        loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+    job.add_done_callback(wake)
+    await done
+
+
+def client_ip():
+    return core.forwarded_client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+
+
+def job_file_url():
+    root = request.host_url.rstrip('/')
+    return lambda job_id: f'{root}/jobs/{job_id}/file'
+
+
+def sse(data):
+    return f'data: {json.dumps(data)}\n\n'
+
+
+@app.before_serving
+async def startup():
+    await blocking(core.init_db)
+    await blocking(core.resume_journaled_jobs)
+    core.warm_imports()
+
+
+@app.route('/')
+async def home():
+    return await render_template_string(core.HTML_TEMPLATE, session=session)
+
+
+@app.route('/login')
+async def login():
+    flow = core.oauth_flow(
+        core.CLIENT_SECRETS_FILE,
+        scopes=core.SCOPES,
+        redirect_uri=url_for('oauth2callback', _external=True)
+    )
+    authorization_url, state = flow.authorization_url(
+        access_type='offline',
+        include_granted_scopes='true'
+    )
+    session['state'] = state
+    return redirect(authorization_url)
+
+
+def _complete_login(flow, authorization_response):
+    flow.fetch_token(authorization_response=authorization_response)
+    credentials = flow.credentials
+    id_info = core.verify_id_token(credentials)
+    conn = core._db_conn()
+    try:
+        conn.execute(
+            'INSERT OR REPLACE INTO user_auth (user_id, email, name, credentials) VALUES (?, ?, ?, ?)',
+            (id_info['sub'], id_info['email'], id_info.get('name'), json.dumps(core.credentials_to_dict(credentials)))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return id_info, credentials
+
+
+@app.route('/oauth2callback')
+async def oauth2callback():
+    state = session.get('state')
+    if not state:
+        return redirect(url_for('home'))
+
+    flow = core.oauth_flow(
+        core.CLIENT_SECRETS_FILE,
+        scopes=core.SCOPES,
+        state=state,
+        redirect_uri=url_for('oauth2callback', _external=True)
+    )
+    try:
+        id_info, credentials = await blocking(_complete_login, flow, request.url)
+    except Exception as e:
+        print(f"Error in OAuth callback: {str(e)}")
+        return redirect(url_for('home'))
+
+    session['user_id'] = id_info['sub']
+    session['email'] = id_info['email']
+    session['name'] = id_info.get('name')
+    session['credentials'] = core.credentials_to_dict(credentials)
+    return redirect(url_for('home'))
+
+
+@app.route('/logout')
+async def logout():
+    session.clear()
+    return redirect(url_for('home'))
+
+
+async def get_youtube_client():
+    if 'credentials' not in session:
+        return None
+
+    credentials = core.credentials_from_dict(session['credentials'])
+
+    if not credentials or not credentials.valid:
+        if credentials and credentials.expired and credentials.refresh_token:
+            await blocking(credentials.refresh, core.google_request())
+            session['credentials'] = core.credentials_to_dict(credentials)
+    return credentials
+
+
+@app.route('/info')
+async def get_info():
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'No URL provided'})
+
+    try:
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+        }
+
+        # If user is authenticated, add their credentials
+        credentials = await get_youtube_client()
+        if credentials:
+            ydl_opts.update({
+                'cookiefile': 'youtube.com_cookies.txt',
+                'cookiesfrombrowser': ('chrome',),
+            })
+
+        try:
+            info = await blocking(get_metadata, url, ydl_opts, upstream=UPSTREAM,
+                                  timeout=core.UPSTREAM_INFO_WAIT_SEC, proxies=PROXIES)
+            return jsonify(core.info_summary(info))
+        except Exception as e:
+            if 'age-restricted' in str(e).lower() and not credentials:
+                return jsonify({
+                    'error': 'This video is age-restricted. Please sign in with Google to access it.',
+                    'requires_auth': True
+                })
+            raise
+    except UpstreamUnavailable as e:
+        return jsonify({'error': str(e), 'retry_after': UPSTREAM.snapshot()['backoff_remaining_sec']}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+
+@app.route('/info/bulk', methods=['POST'])
+async def get_info_bulk():
+    """Extract metadata for many URLs concurrently, streamed back as JSON lines as each one completes."""
+    data = await request.get_json(force=True, silent=True) or {}
+    error, urls, concurrency = await blocking(core.admit_bulk_info, data, request.headers.get('X-API-Key'),
+                                              client_ip())
+    if error:
+        return error
+
+    async def generate():
+        async for record in iterate_blocking(iter_harvest(urls, concurrency=concurrency, proxies=PROXIES,
+                                                          acquire_timeout=core.UPSTREAM_INFO_WAIT_SEC)):
+            yield json.dumps(record) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/select')
+async def get_selection():
+    """Preview which formats /download would pick for the given size/time constraints."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'No URL provided'})
+    try:
+        selection = await blocking(
+            core.select_for_request,
+            url,
+            request.args.get('format', 'video'),
+            request.args.get('quality'),
+            request.args.get('fps'),
+            max_bytes=core._float_param(request.args.get('maxBytes')),
+            bandwidth=core._float_param(request.args.get('bandwidth')),
+            target_seconds=core._float_param(request.args.get('targetSeconds')),
+            upstream=UPSTREAM, timeout=core.UPSTREAM_INFO_WAIT_SEC, proxies=PROXIES,
+        )
+        if selection is None:
+            return jsonify({'error': 'Provide maxBytes, or bandwidth (bits/s) with targetSeconds'})
+        return jsonify(selection)
+    except UpstreamUnavailable as e:
+        return jsonify({'error': str(e), 'retry_after': UPSTREAM.snapshot()['backoff_remaining_sec']}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+
+async def _video_id(url):
+    return video_id_from_url(url) or (await blocking(get_metadata, url))['id']
+
+
+def _progress(video_id):
+    return {
+        'progress': core.download_progress.get(video_id, 0),
+        'speed': core.download_speed.get(video_id, 'N/A'),
+        'eta': core.download_eta.get(video_id, 'N/A')
+    }
+
+
+@app.route('/progress')
+async def get_progress():
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'No URL provided'})
+
+    try:
+        return jsonify(_progress(await _video_id(url)))
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+
+@app.route('/progress/stream')
+async def progress_stream():
+    """Server-sent events with the download progress for a URL, instead of polling /progress."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'No URL provided'}), 400
+    try:
+        video_id = await _video_id(url)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    async def generate():
+        _open_streams['progress'] += 1
+        try:
+            last = None
+            while True:
+                state = _progress(video_id)
+                if state != last:
+                    yield sse(state)
+                    last = state
+                if state['progress'] >= 100:
+                    return
+                await asyncio.sleep(PROGRESS_STREAM_INTERVAL_SEC)
+        finally:
+            _open_streams['progress'] -= 1
+
+    return _event_stream(generate())
+
+
+def _event_stream(body):
+    response = Response(body, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def parse_download_request():
+    """Read download parameters from multipart form-data or a JSON body."""
+    if request.content_type and 'multipart/form-data' in request.content_type:
+        data = await request.form
+    else:
+        data = await request.get_json(force=True, silent=True) or {}
+    return core.download_params(data)
+
+
+async def paced_file(path, client, send_span=tracing.NOOP):
+    """A file's bytes paced by an egress lease, read on the executor and slept on the event loop."""
+    lease = EGRESS.acquire(client)
+    _open_streams['transfers'] += 1
+    try:
+        with open(path, 'rb') as fh:
+            while True:
+                chunk = await blocking(fh.read, FILE_CHUNK)
+                if not chunk:
+                    break
+                delay = lease.charge(len(chunk))
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield chunk
+    finally:
+        _open_streams['transfers'] -= 1
+        lease.release()
+        send_span.end()
+
+
+def _traced_send(send_span, response, owner=None):
+    """Record the response on the http.send span; it ends when owner finishes sending the body, else now."""
+    send_span.set(status=response.status_code, bytes=response.content_length)
+    if owner is None:
+        send_span.end()
+    return response
+
+
+async def send_job_file(job, client):
+    send_span = tracing.span('http.send', job_id=job.id)
+    path = job.result_path
+    filename = os.path.basename(job.result_path)
+    if core.STORAGE is not None and not job.params.get('batch'):
+        redirect_url = await blocking(core.STORAGE.url, core.storage_key(job), filename)
+        if redirect_url:
+            # The object store serves the bytes; the app only hands out a short-lived URL
+            send_span.set(mode='storage_redirect')
+            return _traced_send(send_span, redirect(redirect_url, code=302))
+        if not os.path.exists(path):
+            path = core.STORAGE.local_path(core.storage_key(job))
+    digests = await blocking(artifact_digests, path)
+    headers = http_headers(digests)
+    if request.if_none_match.contains(digests['sha256']):
+        return _traced_send(send_span, Response(status=304, headers=headers))
+    offload = core.DELIVERY.headers(path, filename)
+    send_span.set(mode=core.DELIVERY.mode if offload is not None else ('egress' if EGRESS.enabled else 'send_file'))
+    owner = None
+    if offload is not None:
+        response = Response(status=200, headers=offload)
+    elif EGRESS.enabled:
+        owner = paced_file(path, client, send_span)
+        response = Response(owner, mimetype='application/octet-stream')
+        response.headers['Content-Length'] = str(os.path.getsize(path))
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    else:
+        response = await send_file(path, as_attachment=True, attachment_filename=filename,
+                                   add_etags=False, conditional=True)
+        owner = response.response
+        owner.trace_span = send_span
+    response.headers.update(headers)
+    selection = job.params.get('selection')
+    if selection:
+        response.headers['X-Format-Selection'] = json.dumps({
+            k: selection.get(k) for k in ('format', 'predicted_bytes', 'predicted_seconds', 'within_budget')
+        })
+    return _traced_send(send_span, response, owner)
+
+
+@app.route('/download', methods=['POST'])
+async def download():
+    # Check authentication for age-restricted videos
+    await get_youtube_client()
+
+    params = await parse_download_request()
+    with tracing.span('http.download', parent=request.headers.get('traceparent'),
+                      url=params.get('url'), format=params.get('format')) as sp:
+        error = await blocking(core.admit_download, params, client_ip())
+        if error:
+            sp.set(rejected=error[1])
+            return error
+
+        try:
+            job = await blocking(core.submit_download_job, params, client_ip(), job_file_url())
+            sp.set(job_id=job.id)
+            await wait_job(job)
+            if job.status == 'done' and await blocking(core.artifact_available, job):
+                response = await send_job_file(job, job.client)
+                if 'callback_secret' in core.callback_secret_fields(job):
+                    response.headers['X-Webhook-Secret'] = core.callback_secret(job)
+                return response
+            sp.fail(job.error or 'Download failed')
+            return job.error or 'Download failed', 500
+        except Exception as e:
+            sp.fail(e)
+            return str(e), 500
+
+
+@app.route('/jobs', methods=['POST'])
+async def create_job():
+    """Queue a download and return immediately; poll /jobs/<id> (or stream /jobs/<id>/events) and fetch /jobs/<id>/file."""
+    await get_youtube_client()
+    params = await parse_download_request()
+    error = await blocking(core.admit_download, params, client_ip())
+    if error:
+        return error
+    try:
+        with tracing.span('http.jobs.create', parent=request.headers.get('traceparent'), url=params.get('url')):
+            job = await blocking(core.submit_download_job, params, client_ip(), job_file_url())
+    except Exception as e:
+        return str(e), 500
+    body = job.to_dict()
+    body.update(core.callback_secret_fields(job))
+    body['queue_position'] = core.DOWNLOAD_SCHEDULER.queue_position(job.id)
+    body['status_url'] = url_for('job_status', job_id=job.id)
+    body['events_url'] = url_for('job_events', job_id=job.id)
+    body['file_url'] = url_for('job_file', job_id=job.id)
+    return jsonify(body), 202
+
+
+@app.route('/jobs', methods=['GET'])
+async def jobs_stats():
+    return jsonify(core.DOWNLOAD_SCHEDULER.stats())
+
+
+@app.route('/jobs/<job_id>')
+async def job_status(job_id):
+    job = await blocking(core.lookup_job, job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    body = job.to_dict()
+    if job.status == 'queued':
+        body['queue_position'] = core.DOWNLOAD_SCHEDULER.queue_position(job.id)
+    return jsonify(body)
+
+
+@app.route('/jobs/<job_id>/events')
+async def job_events(job_id):
+    """Server-sent events with the job's state whenever it changes; ends when the job finishes."""
+    job = await blocking(core.lookup_job, job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    async def generate():
+        _open_streams['progress'] += 1
+        try:
+            last = None
+            while True:
+                finished = job.finished
+                body = job.to_dict()
+                if job.status == 'queued':
+                    body['queue_position'] = core.DOWNLOAD_SCHEDULER.queue_position(job.id)
+                if body != last:
+                    yield sse(body)
+                    last = body
+                if finished:
+                    return
+                await asyncio.sleep(PROGRESS_STREAM_INTERVAL_SEC)
+        finally:
+            _open_streams['progress'] -= 1
+
+    return _event_stream(generate())
+
+
+@app.route('/jobs/<job_id>/file')
+async def job_file(job_id):
+    job = await blocking(core.lookup_job, job_id)
+    if not job:
+        return 'Unknown job', 404
+    if job.status != 'done':
+        return f'Job is {job.status}', 409
+    if not await blocking(core.artifact_available, job):
+        return 'Artifact no longer available', 410
+    return await send_job_file(job, client_ip())
+
+
+@app.route('/download/batch', methods=['POST'])
+async def download_batch():
+    """Download many URLs with the same options and stream the results back as one ZIP."""
+    await get_youtube_client()
+    data = await request.get_json(force=True, silent=True) or {}
+    urls, base = core.batch_params(data)
+    if len(urls) > core.BATCH_MAX_URLS:
+        return f'Too many URLs (max {core.BATCH_MAX_URLS})', 400
+    error = await blocking(core.admit_download, dict(base, url=urls[0] if urls else None), client_ip(), len(urls))
+    if error:
+        return error
+    # The ZIP writer waits for jobs and reads files synchronously, so it runs on the executor
+    response = Response(iterate_blocking(core.batch_zip(urls, base, client_ip())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="batch.zip"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/metrics/upstream')
+async def upstream_metrics():
+    return jsonify(UPSTREAM.snapshot())
+
+
+@app.route('/metrics/proxies')
+async def proxy_metrics():
+    return jsonify(PROXIES.snapshot())
+
+
+@app.route('/metrics/webhooks')
+async def webhook_metrics():
+    denied = core.metrics_denied(request.headers)
+    if denied:
+        return denied
+    return jsonify(WEBHOOKS.snapshot())
+
+
+@app.route('/metrics/scratch')
+async def scratch_metrics():
+    return jsonify(SCRATCH.snapshot())
+
+
+@app.route('/metrics/bandwidth')
+async def bandwidth_metrics():
+    denied = core.metrics_denied(request.headers)
+    if denied:
+        return denied
+    return jsonify({'ingress': INGRESS.snapshot(), 'egress': EGRESS.snapshot()})
+
+
+@app.route('/metrics/async')
+async def async_metrics():
+    return jsonify({
+        'open_progress_streams': _open_streams['progress'],
+        'open_paced_transfers': _open_streams['transfers'],
+        'tasks': len(asyncio.all_tasks()),
+        'blocking_workers': ASYNC_BLOCKING_WORKERS,
+    })
+
+
+@app.route('/debug/profile')
+async def debug_profile():
+    denied = core.debug_denied(request.headers)
+    if denied:
+        return denied
+    # The sampler sleeps between samples, so it runs off the event loop like any other blocking call
+    try:
+        body, headers = await blocking(core.capture_profile, request.args)
+    except profiling.ProfilerBusy as e:
+        return str(e), 409
+    return Response(body, mimetype='text/plain', headers=headers)
+
+
+@app.route('/debug/memory')
+async def debug_memory():
+    denied = core.debug_denied(request.headers)
+    if denied:
+        return denied
+    try:
+        result = await blocking(core.capture_memory, request.args)
+    except profiling.ProfilerBusy as e:
+        return str(e), 409
+    except ValueError as e:
+        return str(e), 400
+    result['gauges']['async'] = {'tasks': len(asyncio.all_tasks()), 'open_streams': dict(_open_streams)}
+    return jsonify(result)
+
+
+if __name__ == '__main__':
+    ffmpeg_path = os.path.join(os.path.dirname(__file__), 'ffmpeg-master-latest-win64-gpl', 'bin')
+    os.environ["PATH"] = ffmpeg_path + os.pathsep + os.environ["PATH"]
+    app.run(port=8501, use_reloader=False)
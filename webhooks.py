@@ -0,0 +1,274 @@
+import hashlib
+import hmac
+import heapq
+import http.client
+import ipaddress
+import itertools
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
+# Optional allowlist: exact hosts, or '.example.com' for the domain and its subdomains
+WEBHOOK_ALLOWED_HOSTS = [h.strip().lower() for h in os.environ.get('WEBHOOK_ALLOWED_HOSTS', '').split(',') if h.strip()]
+# Allow loopback/private/link-local receivers (local development only)
+WEBHOOK_ALLOW_PRIVATE = os.environ.get('WEBHOOK_ALLOW_PRIVATE', '0') == '1'
+# Server-side secrets a client can name with callbackSecretRef, e.g. 'billing=s3cr3t,ops=...'
+WEBHOOK_SECRETS = {k.strip(): v.strip() for k, _, v in (item.partition('=') for item in os.environ.get('WEBHOOK_SECRETS', '').split(','))
+                   if k.strip() and v.strip()}
+
+
+class CallbackRejected(ValueError):
+    """The callback URL points somewhere the server must not send requests to."""
+
+
+class WebhookHTTPError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f'HTTP {code}')
+        self.code = code
+
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    """HMAC-SHA256 over '<timestamp>.<body>', hex encoded (sent as 'sha256=<hex>')."""
+    mac = hmac.new(secret.encode('utf-8'), timestamp.encode('ascii') + b'.' + body, hashlib.sha256)
+    return 'sha256=' + mac.hexdigest()
+
+
+def load_signing_key(path: str) -> bytes:
+    """WEBHOOK_SIGNING_KEY, else a random key kept in path so restarts (and resumed jobs) keep signing alike."""
+    if os.environ.get('WEBHOOK_SIGNING_KEY'):
+        return os.environ['WEBHOOK_SIGNING_KEY'].encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    key = os.urandom(32).hex().encode('ascii')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            return f.read()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def job_signing_key(master: bytes, job_id: str) -> str:
+    """Per-job webhook secret, derived on demand so it is never stored with the job."""
+    return hmac.new(master, b'webhook:' + job_id.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _host_allowed(host: str) -> bool:
+    if not WEBHOOK_ALLOWED_HOSTS:
+        return True
+    host = host.lower().rstrip('.')
+    return any(host == h or (h.startswith('.') and (host == h[1:] or host.endswith(h))) for h in WEBHOOK_ALLOWED_HOSTS)
+
+
+def _public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_callback_url(url: str | None) -> None:
+    """Raise CallbackRejected unless url is http(s) to an allowed host name."""
+    parsed = urlparse(url or '')
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise CallbackRejected('must be an http(s) URL')
+    if parsed.username or parsed.password:
+        raise CallbackRejected('must not carry credentials')
+    if not _host_allowed(parsed.hostname):
+        raise CallbackRejected(f'host {parsed.hostname} is not allowed')
+
+
+def resolve_callback(host: str, port: int) -> str:
+    """One public address for host, or CallbackRejected if any of its addresses is internal.
+
+    Called for every delivery attempt and the connection goes to the address
+    checked here, so a DNS answer that changes after submission (rebinding)
+    cannot redirect a callback into the internal network.
+    """
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    addresses = [info[4][0] for info in infos]
+    if not WEBHOOK_ALLOW_PRIVATE:
+        blocked = [a for a in addresses if not _public_address(a)]
+        if blocked:
+            raise CallbackRejected(f'{host} resolves to a non-public address ({blocked[0]})')
+    return addresses[0]
+
+
+def callback_url_error(url: str | None) -> str | None:
+    """Why url cannot be used as a callback (checked again on every delivery), or None."""
+    try:
+        check_callback_url(url)
+        parsed = urlparse(url)
+        resolve_callback(parsed.hostname, parsed.port or (443 if parsed.scheme == 'https' else 80))
+    except CallbackRejected as e:
+        return str(e)
+    except (OSError, ValueError):
+        return 'host does not resolve'
+    return None
+
+
+def redact_url(url: str) -> str:
+    """scheme://host[:port] only: paths and queries of callback URLs often carry tokens."""
+    try:
+        parsed = urlparse(url)
+        port = f':{parsed.port}' if parsed.port else ''
+    except ValueError:
+        return '<invalid url>'
+    host = f'[{parsed.hostname}]' if parsed.hostname and ':' in parsed.hostname else parsed.hostname
+    return f'{parsed.scheme}://{host}{port}' if host else '<invalid url>'
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """Connects to an already vetted address while keeping the URL's host for the Host header."""
+
+    def __init__(self, host: str, port: int, address: str, timeout: float):
+        super().__init__(host, port, timeout=timeout)
+        self._address = address
+
+    def connect(self) -> None:
+        self.sock = socket.create_connection((self._address, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host: str, port: int, address: str, timeout: float):
+        super().__init__(host, port, timeout=timeout, context=ssl.create_default_context())
+        self._address = address
+
+    def connect(self) -> None:
+        sock = socket.create_connection((self._address, self.port), self.timeout)
+        # Certificate is still verified against the host name from the URL
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class WebhookSender:
+    """Small pool of sender threads that POSTs JSON callbacks with retry and backoff.
+
+    ``send`` only enqueues, so a slow or dead receiver never holds up the caller
+    (e.g. a download worker). A delivery is retried on network errors, 5xx and
+    429 with exponential backoff (base_delay * 2**attempt, capped at max_delay)
+    up to ``max_attempts``; other 4xx answers are final. Retries wait in a
+    time-ordered heap, so a backing-off delivery does not occupy a sender.
+    Redirects are not followed, and a URL that resolves to an internal address
+    is dropped without a request.
+    """
+
+    def __init__(self, workers: int = 4, max_attempts: int = 5, base_delay: float = 1.0,
+                 max_delay: float = 60.0, timeout: float = 10.0):
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_error: str | None = None
+
+    def start(self) -> 'WebhookSender':
+        with self._cond:
+            if self._threads:
+                return self
+            for n in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f'webhook-{n}', daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def send(self, url: str, payload: Dict[str, Any], secret: str | None = None) -> None:
+        self.start()
+        delivery = {'url': url, 'body': json.dumps(payload).encode('utf-8'), 'secret': secret, 'attempt': 0}
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic(), next(self._seq), delivery))
+            self._cond.notify()
+
+    def _post(self, delivery: Dict[str, Any]) -> None:
+        timestamp = str(int(time.time()))
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'yt-downloader-webhook/1',
+            'X-Webhook-Timestamp': timestamp,
+            'X-Webhook-Attempt': str(delivery['attempt'] + 1),
+        }
+        if delivery['secret']:
+            headers['X-Webhook-Signature'] = sign_payload(delivery['secret'], timestamp, delivery['body'])
+        check_callback_url(delivery['url'])
+        parsed = urlparse(delivery['url'])
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        address = resolve_callback(parsed.hostname, port)
+        conn_cls = _PinnedHTTPSConnection if parsed.scheme == 'https' else _PinnedHTTPConnection
+        conn = conn_cls(parsed.hostname, port, address, self.timeout)
+        try:
+            path = (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else '')
+            conn.request('POST', path, body=delivery['body'], headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+        finally:
+            conn.close()
+        if resp.status >= 300:
+            # 3xx included: following a redirect would bypass the address check
+            raise WebhookHTTPError(resp.status)
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        _due, _seq, delivery = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(timeout=self._heap[0][0] - now if self._heap else None)
+            try:
+                self._post(delivery)
+            except Exception as e:
+                if isinstance(e, CallbackRejected):
+                    retryable = False
+                elif isinstance(e, WebhookHTTPError):
+                    retryable = e.code >= 500 or e.code == 429
+                else:
+                    retryable = True
+                delivery['attempt'] += 1
+                with self._cond:
+                    self.last_error = f'{redact_url(delivery["url"])}: {e}'[:300]
+                    if retryable and delivery['attempt'] < self.max_attempts:
+                        self.retries += 1
+                        delay = min(self.max_delay, self.base_delay * 2 ** (delivery['attempt'] - 1))
+                        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), delivery))
+                        self._cond.notify()
+                    else:
+                        self.failed += 1
+            else:
+                with self._cond:
+                    self.delivered += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'pending': len(self._heap),
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'retries': self.retries,
+                'last_error': self.last_error,
+            }
+
+
+WEBHOOKS = WebhookSender(
+    workers=int(os.environ.get('WEBHOOK_WORKERS', '4')),
+    max_attempts=int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '5')),
+    base_delay=float(os.environ.get('WEBHOOK_BACKOFF_BASE_SEC', '1')),
+    max_delay=float(os.environ.get('WEBHOOK_BACKOFF_MAX_SEC', '60')),
+    timeout=float(os.environ.get('WEBHOOK_TIMEOUT_SEC', '10')),
+)
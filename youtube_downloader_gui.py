@@ -1,176 +1,236 @@
 import os
-import threading
+import subprocess
+import sys
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from pytube import YouTube
-from pytube.exceptions import RegexMatchError, VideoUnavailable
+from downloader import apply_common_ydl_hardening, is_aria2c_available
+from session_downloads import SessionDownloads
+
+FFMPEG_BIN_DIR = os.path.join(os.path.dirname(__file__), 'ffmpeg-master-latest-win64-gpl', 'bin')
+GUI_DOWNLOAD_WORKERS = int(os.environ.get('GUI_DOWNLOAD_WORKERS', '3'))
+# Worker threads only update task dicts; the UI reads them at this rate, however fast bytes arrive
+POLL_INTERVAL_MS = int(os.environ.get('GUI_POLL_INTERVAL_MS', '250'))
+
+STATUS_LABELS = {
+    'queued': 'Queued',
+    'starting': 'Starting',
+    'downloading': 'Downloading',
+    'processing': 'Processing',
+    'post-processing': 'Processing',
+    'paused': 'Paused',
+    'finished': 'Done',
+    'cancelled': 'Cancelled',
+    'error': 'Error',
+}
+
+
+def build_ydl_opts(output_dir, mode, max_height, use_aria):
+    """Same format chains and hardening as the web and Streamlit front ends."""
+    if mode == "Audio Only (MP3)":
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '320',
+            }],
+        }
+    else:
+        ydl_opts = {
+            'format': (
+                f"bestvideo[height<={max_height}][ext=mp4]+bestaudio[ext=m4a]/"
+                f"bestvideo[height<={max_height}]+bestaudio/"
+                f"best[height<={max_height}]"
+            ),
+            'merge_output_format': 'mp4',
+            'outtmpl': os.path.join(output_dir, '%(title)s_%(height)sp%(fps)s.%(ext)s'),
+        }
+    ydl_opts.update({'noplaylist': True, 'quiet': True, 'no_warnings': True, 'noprogress': True})
+    # Parallel fragment downloads for DASH/HLS, or segmented aria2c for progressive files
+    return apply_common_ydl_hardening(ydl_opts, FFMPEG_BIN_DIR, None, use_aria)
 
 
 class YouTubeDownloaderApp:
-    def __init__(self, root):
+    def __init__(self, root, workers=GUI_DOWNLOAD_WORKERS):
         self.root = root
         self.root.title("YouTube Downloader")
-        self.root.geometry("600x400")
+        self.root.geometry("820x480")
         self.root.resizable(True, True)
         self.root.configure(padx=20, pady=20)
-        
+        self.downloads = SessionDownloads(workers)
+        # Last values written to each row, so a poll only touches rows that changed
+        self._rows = {}
+
         # Set style
         self.style = ttk.Style()
         self.style.configure('TButton', font=('Arial', 10))
         self.style.configure('TLabel', font=('Arial', 11))
         self.style.configure('TEntry', font=('Arial', 10))
-        
+
         # URL input
-        ttk.Label(root, text="YouTube URL:", style='TLabel').grid(row=0, column=0, sticky=tk.W, pady=5)
+        ttk.Label(root, text="YouTube URL(s):", style='TLabel').grid(row=0, column=0, sticky=tk.W, pady=5)
         self.url_var = tk.StringVar()
         self.url_entry = ttk.Entry(root, textvariable=self.url_var, width=50, style='TEntry')
-        self.url_entry.grid(row=0, column=1, columnspan=2, sticky=tk.W+tk.E, pady=5, padx=5)
-        
+        self.url_entry.grid(row=0, column=1, columnspan=3, sticky=tk.W+tk.E, pady=5, padx=5)
+        self.url_entry.bind('<Return>', lambda _e: self.add_downloads())
+
         # Output directory selection
         ttk.Label(root, text="Save to:", style='TLabel').grid(row=1, column=0, sticky=tk.W, pady=5)
         self.output_var = tk.StringVar(value=os.path.join(os.path.expanduser("~"), "Downloads"))
         self.output_entry = ttk.Entry(root, textvariable=self.output_var, width=40, style='TEntry')
-        self.output_entry.grid(row=1, column=1, sticky=tk.W+tk.E, pady=5, padx=5)
-        
+        self.output_entry.grid(row=1, column=1, columnspan=2, sticky=tk.W+tk.E, pady=5, padx=5)
+
         self.browse_btn = ttk.Button(root, text="Browse", command=self.browse_directory)
-        self.browse_btn.grid(row=1, column=2, sticky=tk.W, pady=5, padx=5)
-        
-        # Video info frame
-        self.info_frame = ttk.LabelFrame(root, text="Video Information")
-        self.info_frame.grid(row=2, column=0, columnspan=3, sticky=tk.W+tk.E+tk.N+tk.S, pady=10, padx=0)
-        self.info_frame.grid_columnconfigure(1, weight=1)
-        
-        # Video info labels
-        ttk.Label(self.info_frame, text="Title:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=2)
-        self.title_var = tk.StringVar(value="")
-        ttk.Label(self.info_frame, textvariable=self.title_var, wraplength=400).grid(row=0, column=1, sticky=tk.W, padx=5, pady=2)
-        
-        ttk.Label(self.info_frame, text="Channel:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=2)
-        self.channel_var = tk.StringVar(value="")
-        ttk.Label(self.info_frame, textvariable=self.channel_var).grid(row=1, column=1, sticky=tk.W, padx=5, pady=2)
-        
-        ttk.Label(self.info_frame, text="Duration:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=2)
-        self.duration_var = tk.StringVar(value="")
-        ttk.Label(self.info_frame, textvariable=self.duration_var).grid(row=2, column=1, sticky=tk.W, padx=5, pady=2)
-        
-        # Action buttons
-        self.fetch_btn = ttk.Button(root, text="Fetch Video Info", command=self.fetch_video_info)
-        self.fetch_btn.grid(row=3, column=0, sticky=tk.W, pady=10)
-        
-        self.download_btn = ttk.Button(root, text="Download Video", command=self.start_download, state=tk.DISABLED)
-        self.download_btn.grid(row=3, column=1, sticky=tk.W, pady=10, padx=5)
-        
-        # Progress bar
-        self.progress_var = tk.DoubleVar(value=0.0)
-        self.progress = ttk.Progressbar(root, orient=tk.HORIZONTAL, length=580, variable=self.progress_var, mode='determinate')
-        self.progress.grid(row=4, column=0, columnspan=3, sticky=tk.W+tk.E, pady=5)
-        
+        self.browse_btn.grid(row=1, column=3, sticky=tk.W, pady=5, padx=5)
+
+        # Format options
+        options = ttk.Frame(root)
+        options.grid(row=2, column=0, columnspan=4, sticky=tk.W, pady=5)
+        self.mode_var = tk.StringVar(value="Video")
+        ttk.Combobox(options, textvariable=self.mode_var, values=["Video", "Audio Only (MP3)"],
+                     state='readonly', width=18).pack(side=tk.LEFT)
+        ttk.Label(options, text="Max resolution:").pack(side=tk.LEFT, padx=(15, 5))
+        self.height_var = tk.StringVar(value="1080")
+        ttk.Combobox(options, textvariable=self.height_var, values=["2160", "1440", "1080", "720", "480"],
+                     state='readonly', width=6).pack(side=tk.LEFT)
+        self.aria_var = tk.BooleanVar(value=is_aria2c_available())
+        ttk.Checkbutton(options, text="Use aria2c if available", variable=self.aria_var).pack(side=tk.LEFT, padx=15)
+        self.add_btn = ttk.Button(options, text="Add to Queue", command=self.add_downloads)
+        self.add_btn.pack(side=tk.LEFT)
+
+        # Download queue, one row per item
+        columns = ('status', 'progress', 'speed', 'eta')
+        self.tree = ttk.Treeview(root, columns=columns, selectmode='extended')
+        self.tree.heading('#0', text="Title")
+        self.tree.column('#0', width=360, stretch=True)
+        for name, label, width in (('status', "Status", 100), ('progress', "Progress", 80),
+                                   ('speed', "Speed", 100), ('eta', "ETA", 70)):
+            self.tree.heading(name, text=label)
+            self.tree.column(name, width=width, stretch=False, anchor=tk.CENTER)
+        self.tree.grid(row=3, column=0, columnspan=4, sticky=tk.W+tk.E+tk.N+tk.S, pady=10)
+        scrollbar = ttk.Scrollbar(root, orient=tk.VERTICAL, command=self.tree.yview)
+        scrollbar.grid(row=3, column=4, sticky=tk.N+tk.S, pady=10)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+
+        # Per-item actions on the selected rows
+        actions = ttk.Frame(root)
+        actions.grid(row=4, column=0, columnspan=4, sticky=tk.W)
+        for label, command in (("Pause", self.pause_selected), ("Resume", self.resume_selected),
+                               ("Cancel", self.cancel_selected), ("Clear Finished", self.clear_finished),
+                               ("Open Folder", self.open_folder)):
+            ttk.Button(actions, text=label, command=command).pack(side=tk.LEFT, padx=(0, 5))
+
         # Status label
         self.status_var = tk.StringVar(value="Ready")
         self.status_label = ttk.Label(root, textvariable=self.status_var, style='TLabel')
-        self.status_label.grid(row=5, column=0, columnspan=3, sticky=tk.W, pady=5)
-        
+        self.status_label.grid(row=5, column=0, columnspan=4, sticky=tk.W, pady=5)
+
         # Configure grid
         root.grid_columnconfigure(1, weight=1)
-        root.grid_rowconfigure(2, weight=1)
-        
-        # Video object
-        self.yt = None
-        
+        root.grid_rowconfigure(3, weight=1)
+
+        self.root.after(POLL_INTERVAL_MS, self.poll)
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
+
+    def on_close(self):
+        if self.downloads.active() and not messagebox.askokcancel(
+                "Quit", "Downloads are still running. Cancel them and quit?"):
+            return
+        # The pool's threads are not daemons: stop them, or the process outlives the window
+        self.downloads.shutdown()
+        self.root.destroy()
+
     def browse_directory(self):
         directory = filedialog.askdirectory(initialdir=self.output_var.get())
         if directory:
             self.output_var.set(directory)
-    
-    def progress_callback(self, stream, chunk, bytes_remaining):
-        total_size = stream.filesize
-        bytes_downloaded = total_size - bytes_remaining
-        percentage = bytes_downloaded / total_size * 100
-        self.progress_var.set(percentage)
-        self.status_var.set(f"Downloading: {percentage:.1f}%")
-        self.root.update_idletasks()
-    
-    def fetch_video_info(self):
-        url = self.url_var.get()
-        if not url:
+
+    def add_downloads(self):
+        urls = self.url_var.get().split()
+        if not urls:
             messagebox.showerror("Error", "Please enter a YouTube URL")
             return
-        
-        self.status_var.set("Fetching video information...")
-        self.fetch_btn.configure(state=tk.DISABLED)
-        
-        def fetch_thread():
-            try:
-                self.yt = YouTube(url)
-                
-                # Update UI with video info
-                self.title_var.set(self.yt.title)
-                self.channel_var.set(self.yt.author)
-                self.duration_var.set(f"{self.yt.length // 60}:{self.yt.length % 60:02d}")
-                
-                # Enable download button
-                self.download_btn.configure(state=tk.NORMAL)
-                self.status_var.set("Ready to download")
-            
-            except RegexMatchError:
-                messagebox.showerror("Error", "Invalid YouTube URL.")
-                self.status_var.set("Error: Invalid URL")
-            except VideoUnavailable:
-                messagebox.showerror("Error", "The video is unavailable.")
-                self.status_var.set("Error: Video unavailable")
-            except Exception as e:
-                messagebox.showerror("Error", f"An error occurred: {str(e)}")
-                self.status_var.set(f"Error: {str(e)}")
-            finally:
-                self.fetch_btn.configure(state=tk.NORMAL)
-        
-        threading.Thread(target=fetch_thread, daemon=True).start()
-    
-    def start_download(self):
-        if not self.yt:
-            messagebox.showerror("Error", "Please fetch video information first")
+        output_dir = self.output_var.get()
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+        except OSError as e:
+            messagebox.showerror("Error", f"Invalid save folder: {e}")
             return
-        
-        output_path = self.output_var.get()
-        self.download_btn.configure(state=tk.DISABLED)
-        self.fetch_btn.configure(state=tk.DISABLED)
-        self.status_var.set("Starting download...")
-        self.progress_var.set(0)
-        
-        def download_thread():
-            try:
-                # Register progress callback
-                self.yt.register_on_progress_callback(self.progress_callback)
-                
-                # Filter for mp4 streams with 1080p resolution
-                streams = self.yt.streams.filter(file_extension='mp4', res='1080p', progressive=False)
-                if not streams:
-                    streams = self.yt.streams.filter(file_extension='mp4', progressive=True)
-                    self.status_var.set("1080p MP4 not available. Downloading highest quality available.")
-                
-                video_stream = streams.order_by('resolution').desc().first()
-                
-                if not video_stream:
-                    messagebox.showerror("Error", "No suitable video stream found.")
-                    self.status_var.set("Error: No suitable video stream found")
-                    return
-                
-                # Download the video
-                out_file = video_stream.download(output_path=output_path)
-                self.status_var.set(f"Download complete! Saved to: {os.path.basename(out_file)}")
-                messagebox.showinfo("Success", f"Download complete!\nSaved to: {out_file}")
-            
-            except Exception as e:
-                messagebox.showerror("Error", f"An error occurred: {str(e)}")
-                self.status_var.set(f"Error: {str(e)}")
-            finally:
-                self.download_btn.configure(state=tk.NORMAL)
-                self.fetch_btn.configure(state=tk.NORMAL)
-        
-        threading.Thread(target=download_thread, daemon=True).start()
+        ydl_opts = build_ydl_opts(output_dir, self.mode_var.get(), self.height_var.get(), self.aria_var.get())
+        for url in urls:
+            self.downloads.submit(url, url, ydl_opts)
+        self.url_var.set("")
+        self.poll(reschedule=False)
+
+    def _selected(self):
+        return list(self.tree.selection())
+
+    def pause_selected(self):
+        for task_id in self._selected():
+            self.downloads.pause(task_id)
+
+    def resume_selected(self):
+        for task_id in self._selected():
+            self.downloads.resume(task_id)
+
+    def cancel_selected(self):
+        for task_id in self._selected():
+            self.downloads.cancel(task_id)
+
+    def clear_finished(self):
+        self.downloads.clear_finished()
+        self.poll(reschedule=False)
+
+    def open_folder(self):
+        selected = set(self._selected())
+        paths = [t['path'] for t in self.downloads.snapshot() if t['id'] in selected and t['path']]
+        folder = os.path.dirname(paths[0]) if paths else self.output_var.get()
+        try:
+            if os.name == 'nt':
+                os.startfile(folder)
+            elif sys.platform == 'darwin':
+                subprocess.Popen(['open', folder])
+            else:
+                subprocess.Popen(['xdg-open', folder])
+        except Exception:
+            pass
+
+    def poll(self, reschedule=True):
+        """Copy worker state into the tree; runs on the Tk thread only."""
+        tasks = self.downloads.snapshot()
+        seen = set()
+        for task in tasks:
+            task_id = task['id']
+            seen.add(task_id)
+            status = STATUS_LABELS.get(task['status'], task['status'])
+            if task['status'] == 'error':
+                status = "Age-restricted" if task['age_restricted'] else status
+            values = (status, f"{task['percent']}%", task['speed'], task['eta'] if task['status'] == 'downloading' else '')
+            row = (task['title'], values)
+            if self._rows.get(task_id) == row:
+                continue
+            if task_id in self._rows:
+                self.tree.item(task_id, text=task['title'], values=values)
+            else:
+                self.tree.insert('', tk.END, iid=task_id, text=task['title'], values=values)
+            self._rows[task_id] = row
+        for task_id in [k for k in self._rows if k not in seen]:
+            self.tree.delete(task_id)
+            del self._rows[task_id]
+
+        running = sum(1 for t in tasks if t['status'] in ('starting', 'downloading', 'processing', 'post-processing'))
+        queued = sum(1 for t in tasks if t['status'] == 'queued')
+        failed = [t for t in tasks if t['status'] == 'error']
+        summary = f"{running} downloading, {queued} queued, {sum(1 for t in tasks if t['status'] == 'finished')} done"
+        if failed:
+            summary += f" - last error: {failed[-1]['error']}"
+        self.status_var.set(summary if tasks else "Ready")
+        if reschedule:
+            self.root.after(POLL_INTERVAL_MS, self.poll)
 
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = YouTubeDownloaderApp(root)
-    root.mainloop() 
\ No newline at end of file
+    root.mainloop()
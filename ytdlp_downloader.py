@@ -1,29 +1,44 @@
 import os
 import sys
+import json
+import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+from downloader import human_size
+from proxy_pool import ProxyPool, read_proxy_file
 
-def download_video(url, output_path=None):
-    """Download YouTube video in 720p 60fps MP4 format."""
-    if not output_path:
-        output_path = os.getcwd()
-    
-    # Output template
-    output_template = os.path.join(output_path, '%(title)s_720p60fps.%(ext)s')
-    
-    # yt-dlp options for 720p60fps, merging if needed
-    ydl_opts = {
-        'format': 'bestvideo[height=720][fps=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height=720][fps=60]+bestaudio/best[height=720][fps=60]/best',
-        'outtmpl': output_template,
-        'progress_hooks': [progress_hook],
-        'quiet': False,
-        'no_warnings': False,
+# Stand-in pool when no proxies are given: lease() yields None (direct connection)
+NO_PROXIES = ProxyPool([])
+
+FORMAT_720P60 = 'bestvideo[height=720][fps=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height=720][fps=60]+bestaudio/best[height=720][fps=60]/best'
+
+
+def build_ydl_opts(output_path, progress_hooks, quiet=False):
+    """yt-dlp options for 720p60fps, merging if needed."""
+    return {
+        'format': FORMAT_720P60,
+        'outtmpl': os.path.join(output_path, '%(title)s_720p60fps.%(ext)s'),
+        'progress_hooks': progress_hooks,
+        'quiet': quiet,
+        'noprogress': quiet,
+        'no_warnings': quiet,
         'postprocessors': [{
             'key': 'FFmpegVideoConvertor',
             'preferedformat': 'mp4',
         }],
     }
-    
+
+
+def download_video(url, output_path=None):
+    """Download YouTube video in 720p 60fps MP4 format."""
+    if not output_path:
+        output_path = os.getcwd()
+
+    ydl_opts = build_ydl_opts(output_path, [progress_hook])
+
     try:
         with YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=False)
@@ -47,12 +62,246 @@ def progress_hook(d):
     elif d['status'] == 'finished':
         print("\nDownload finished, processing with FFmpeg...")
 
+
+# ---------------------------------------------------------------------------
+# Batch mode
+# ---------------------------------------------------------------------------
+
+def read_batch_urls(path):
+    """Read one URL per line, skipping blanks, '#' comments and duplicates."""
+    urls = []
+    seen = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            url = line.strip()
+            if not url or url.startswith('#') or url in seen:
+                continue
+            seen.add(url)
+            urls.append(url)
+    return urls
+
+
+def load_manifest(path):
+    """Return the latest manifest record per URL. A torn last line (crash mid-write) is ignored."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(rec, dict) and rec.get('url'):
+                records[rec['url']] = rec
+    return records
+
+
+class ManifestWriter:
+    """Append-only JSONL manifest; every record is flushed and fsynced so a crash loses at most the line being written."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._fh = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._fh.write(line)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+
+
+class BatchProgress:
+    """Aggregated progress for all workers, rendered as one status line by a single thread."""
+
+    def __init__(self, total, skipped=0, interval=0.5, stream=None):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.completed_bytes = 0
+        self._active = {}  # url -> {'bytes': int, 'speed': float}
+        self._lock = threading.Lock()
+        self._interval = interval
+        self._stream = stream or sys.stdout
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start_item(self, url):
+        with self._lock:
+            self._active[url] = {'bytes': 0, 'base': 0, 'speed': 0.0}
+
+    def update_item(self, url, d):
+        with self._lock:
+            item = self._active.get(url)
+            if item is None:
+                return
+            if d.get('status') == 'downloading':
+                item['bytes'] = item['base'] + (d.get('downloaded_bytes') or 0)
+                item['speed'] = d.get('speed') or 0.0
+            elif d.get('status') == 'finished':
+                # Video and audio streams are downloaded one after another
+                item['base'] += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+                item['bytes'] = item['base']
+                item['speed'] = 0.0
+
+    def finish_item(self, url, ok):
+        with self._lock:
+            item = self._active.pop(url, None)
+            if item:
+                self.completed_bytes += item['bytes']
+            if ok:
+                self.done += 1
+            elif ok is not None:
+                self.failed += 1
+
+    def item_bytes(self, url):
+        with self._lock:
+            item = self._active.get(url)
+            return item['bytes'] if item else 0
+
+    def render(self):
+        with self._lock:
+            active = len(self._active)
+            in_flight = sum(i['bytes'] for i in self._active.values())
+            speed = sum(i['speed'] for i in self._active.values())
+            finished = self.done + self.failed + self.skipped
+            return (f"[batch] {finished}/{self.total} "
+                    f"(done {self.done}, failed {self.failed}, skipped {self.skipped}, active {active}) | "
+                    f"{human_size(self.completed_bytes + in_flight)} at {human_size(speed)}/s")
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._stream.write('\r' + self.render() + '\x1b[K')
+            self._stream.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._stream.write('\r' + self.render() + '\x1b[K\n')
+        self._stream.flush()
+
+
+def _batch_download_one(url, output_path, progress, stop_event, proxies=None):
+    """Download a single batch entry and return its manifest record."""
+    def hook(d):
+        if stop_event.is_set():
+            raise DownloadCancelled('batch interrupted')
+        progress.update_item(url, d)
+
+    progress.start_item(url)
+    started = time.time()
+    record = {'url': url}
+    try:
+        ydl_opts = build_ydl_opts(output_path, [hook], quiet=True)
+        with (proxies or NO_PROXIES).lease() as proxy:
+            if proxy:
+                ydl_opts['proxy'] = proxy.url
+                ydl_opts['progress_hooks'].append(proxy.progress_hook())
+                record['proxy'] = proxy.to_dict()['proxy']
+            with YoutubeDL(ydl_opts) as ydl:
+                # A single extract_info(download=True) avoids extracting the page twice
+                info = ydl.extract_info(url, download=True)
+        requested = (info or {}).get('requested_downloads') or [{}]
+        filepath = requested[-1].get('filepath')
+        record.update({
+            'status': 'done',
+            'title': (info or {}).get('title'),
+            'filepath': filepath,
+            'bytes': os.path.getsize(filepath) if filepath and os.path.exists(filepath) else progress.item_bytes(url),
+            'error': None,
+        })
+    except DownloadCancelled:
+        # No record: the entry is retried on resume and yt-dlp continues its .part file
+        progress.finish_item(url, ok=None)
+        return None
+    except Exception as e:
+        record.update({'status': 'failed', 'bytes': progress.item_bytes(url), 'error': str(e)})
+    record['duration_sec'] = round(time.time() - started, 3)
+    record['finished_at'] = int(time.time())
+    progress.finish_item(url, ok=record['status'] == 'done')
+    return record
+
+
+def run_batch(batch_file, output_path=None, jobs=4, manifest_path=None, skip_failed=False, proxies=None):
+    """Download every URL in batch_file with a pool of workers, resuming from the JSONL manifest."""
+    if not output_path:
+        output_path = os.getcwd()
+    os.makedirs(output_path, exist_ok=True)
+    if not manifest_path:
+        manifest_path = batch_file + '.manifest.jsonl'
+
+    urls = read_batch_urls(batch_file)
+    previous = load_manifest(manifest_path)
+    skip_status = {'done', 'failed'} if skip_failed else {'done'}
+    pending = [u for u in urls if previous.get(u, {}).get('status') not in skip_status]
+
+    print(f"Batch: {len(urls)} URLs, {len(urls) - len(pending)} already in manifest, {len(pending)} to process with {jobs} workers")
+    print(f"Manifest: {manifest_path}")
+
+    progress = BatchProgress(total=len(urls), skipped=len(urls) - len(pending))
+    writer = ManifestWriter(manifest_path)
+    stop_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+    progress.start()
+    interrupted = False
+    futures = []
+    written = set()
+    try:
+        futures = [executor.submit(_batch_download_one, u, output_path, progress, stop_event, proxies) for u in pending]
+        for fut in as_completed(futures):
+            written.add(fut)
+            record = fut.result()
+            if record:
+                writer.write(record)
+    except KeyboardInterrupt:
+        interrupted = True
+        stop_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Entries that finished while we were shutting down still belong in the manifest
+        for fut in futures:
+            if fut in written or fut.cancelled() or fut.exception() is not None:
+                continue
+            record = fut.result()
+            if record:
+                writer.write(record)
+    finally:
+        executor.shutdown(wait=True)
+        progress.stop()
+        writer.close()
+
+    if interrupted:
+        print("Interrupted; re-run the same command to resume from the manifest.")
+    return progress.failed == 0 and not interrupted
+
+
 def main():
     parser = argparse.ArgumentParser(description="Download YouTube videos in 720p 60fps MP4 format using yt-dlp")
-    parser.add_argument("url", help="YouTube video URL")
+    parser.add_argument("url", nargs='?', help="YouTube video URL")
     parser.add_argument("-o", "--output", help="Output directory (default: current directory)")
+    parser.add_argument("--batch", metavar="FILE", help="File with one URL per line to download in parallel")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of parallel batch workers (default: 4)")
+    parser.add_argument("--manifest", help="JSONL manifest path (default: <batch file>.manifest.jsonl)")
+    parser.add_argument("--skip-failed", action="store_true", help="Do not retry URLs recorded as failed in the manifest")
+    parser.add_argument("--proxies", metavar="FILE", help="File with one proxy URL per line to spread batch downloads across")
     args = parser.parse_args()
+    if args.batch:
+        proxies = ProxyPool(read_proxy_file(args.proxies)) if args.proxies else None
+        ok = run_batch(args.batch, args.output, args.jobs, args.manifest, args.skip_failed, proxies)
+        sys.exit(0 if ok else 1)
+    if not args.url:
+        parser.error("either a URL or --batch FILE is required")
     download_video(args.url, args.output)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
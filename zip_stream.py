@@ -0,0 +1,79 @@
+import os
+import zipfile
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+
+class _Sink:
+    """Write-only, non-seekable file object that collects what ZipFile writes until it is drained."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._offset = 0
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # ZipFile records entry offsets from tell(); seek() is never offered, so it streams
+        return self._offset
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_arcname(name: str, used: set) -> str:
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f'{base} ({n}){ext}'
+    used.add(candidate)
+    return candidate
+
+
+def stream_zip(entries: Iterable[Tuple[str, str | bytes]], chunk_size: int = 256 * 1024,
+               on_entry_done: Callable[[str, str | bytes], None] | None = None) -> Iterator[bytes]:
+    """Yield a ZIP archive built on the fly from (arcname, path or bytes) entries.
+
+    Entries are stored (media is already compressed) with data descriptors, so
+    nothing is ever seeked or buffered beyond one chunk: memory use is constant
+    and no archive file is written. ``entries`` may be a lazy iterator that
+    blocks until the next file is ready; ``on_entry_done`` runs after each
+    entry has been emitted (e.g. to delete the source file).
+    """
+    sink = _Sink()
+    used: set = set()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for arcname, source in entries:
+            info = zipfile.ZipInfo(unique_arcname(arcname, used))
+            info.compress_type = zipfile.ZIP_STORED
+            if isinstance(source, bytes):
+                with zf.open(info, 'w') as dest:
+                    dest.write(source)
+            else:
+                info.date_time = zipfile.ZipInfo.from_file(source).date_time
+                with open(source, 'rb') as src, zf.open(info, 'w', force_zip64=True) as dest:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+            if on_entry_done is not None:
+                on_entry_done(arcname, source)
+    data = sink.drain()
+    if data:
+        yield data